@@ -0,0 +1,85 @@
+'''Micro-benchmark: lines/second for parsing chia plot logs.
+
+Compares the per-line regex lists that job.py and analyzer.py used to run
+with the shared dispatcher in plotman.log_parser, on a synthetic log built
+by repeating the sample log from the test resources.
+
+    python benchmarks/log_parser_bench.py [--mb 20]
+'''
+
+import argparse
+import importlib.resources
+import re
+import time
+
+from plotman import log_parser
+from plotman._tests import resources
+
+
+def legacy_job_parse(lines):
+    'The uncompiled regexes previously run by Job.set_phase_from_logfile().'
+    n = 0
+    for line in lines:
+        if re.match(r'^Starting phase (\d).*', line):
+            n += 1
+        if re.match(r'^Computing table (\d).*', line):
+            n += 1
+        if re.match(r'^Backpropagating on table (\d).*', line):
+            n += 1
+        if re.match(r'^Compressing tables (\d) and (\d).*', line):
+            n += 1
+    return n
+
+def legacy_analyzer_parse(lines):
+    'The uncompiled regexes previously run by analyzer.analyze().'
+    n = 0
+    for line in lines:
+        if re.search(r'Starting plot (\d*)/(\d*)', line):
+            n += 1
+        if re.search(r'^Starting plotting.*dirs: (.*) and (.*)', line):
+            n += 1
+        if re.search(r'^Starting phase 2/4: Backpropagation', line):
+            n += 1
+        for phase in ['1', '2', '3', '4']:
+            if re.search(r'^Time for phase ' + phase + r' = (\d+.\d+) seconds..*', line):
+                n += 1
+        if re.search(r'Bucket \d+ ([^\.]+)\..*', line):
+            n += 1
+        if re.search(r'^Total time = (\d+.\d+) seconds.*', line):
+            n += 1
+    return n
+
+def dispatcher_parse(lines):
+    n = 0
+    for event in log_parser.parse_lines(lines):
+        n += 1
+    return n
+
+def synthetic_log_lines(megabytes):
+    sample = importlib.resources.read_text(resources, '2021-04-04-19:00:47.log')
+    copies = max(1, int(megabytes * 1_000_000 / len(sample)))
+    return (sample * copies).splitlines(keepends=True)
+
+def bench(name, parse, lines):
+    start = time.perf_counter()
+    parse(lines)
+    elapsed = time.perf_counter() - start
+    print('%-28s %8.3f s  %12.0f lines/s' % (name, elapsed, len(lines) / elapsed))
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mb', type=float, default=20, help='synthetic log size in MB')
+    args = parser.parse_args()
+
+    lines = synthetic_log_lines(args.mb)
+    print('%d lines, %.1f MB' % (len(lines), sum(map(len, lines)) / 1_000_000))
+
+    job_before = bench('before: job.py', legacy_job_parse, lines)
+    analyzer_before = bench('before: analyzer.py', legacy_analyzer_parse, lines)
+    after = bench('after: log_parser', dispatcher_parse, lines)
+    print('speedup: %.1fx (job.py), %.1fx (analyzer.py)' % (
+        job_before / after, analyzer_before / after))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''Benchmark harness: compare Scheduling settings in the simulator.
+
+Simulates a sweep of tmpdir stagger milestones and global staggers on a box
+with a number of tmp dirs, drawing job durations from the completed plots
+in a log dir (or, by default, from the sample log in the test resources),
+and prints plots/day, tmp dir idle time and peak concurrency for each.
+
+    python benchmarks/scheduler_bench.py [--logdir DIR] [--tmpdirs 8] [--days 365]
+'''
+
+import argparse
+import importlib.resources
+import itertools
+import tempfile
+import time
+
+from plotman import configuration, eta, simulator
+from plotman._tests import resources
+
+
+def load_history(logdir):
+    history = eta.PhaseHistory()
+    if logdir:
+        history.load_logdir(logdir)
+        return history
+    with tempfile.TemporaryDirectory() as d:
+        path = d + '/sample.log'
+        with open(path, 'wb') as f:
+            f.write(importlib.resources.read_binary(resources, '2021-04-04-19:00:47.log'))
+        history.load_logfile(path)
+    return history
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logdir', help='log dir to take job durations from')
+    parser.add_argument('--tmpdirs', type=int, default=8, help='number of tmp dirs')
+    parser.add_argument('--days', type=float, default=365, help='days to simulate')
+    args = parser.parse_args()
+
+    history = load_history(args.logdir)
+    dir_cfg = configuration.Directories(
+        log='/plots/log',
+        tmp=['/mnt/tmp/%02d' % i for i in range(args.tmpdirs)],
+        dst=['/mnt/dst/00', '/mnt/dst/01'])
+
+    print('%-10s %-9s %-6s %10s %8s %6s %9s' % (
+        'milestone', 'stagger_m', 'batch', 'plots/day', 'idle', 'peak', 'runtime'))
+    for (milestone, stagger_m, batch) in itertools.product(
+            [(1, 7), (2, 1), (3, 0)], [0, 30], [False, True]):
+        sched_cfg = configuration.Scheduling(
+            global_max_jobs=3 * args.tmpdirs,
+            global_stagger_m=stagger_m,
+            polling_time_s=20,
+            tmpdir_max_jobs=3,
+            tmpdir_stagger_phase_major=milestone[0],
+            tmpdir_stagger_phase_minor=milestone[1],
+            batch_admission=batch)
+        start = time.perf_counter()
+        result = simulator.simulate(dir_cfg, sched_cfg, history, args.days, seed=0)
+        elapsed = time.perf_counter() - start
+        idle = sum(result.idle_frac_by_tmpdir.values()) / len(result.idle_frac_by_tmpdir)
+        print('%-10s %-9d %-6s %10.2f %7.1f%% %6d %8.2fs' % (
+            '%d:%d' % milestone, stagger_m, batch, result.plots_per_day,
+            100 * idle, result.peak_jobs, elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import pytest
+
+from plotman import admission, configuration, manager
+
+GIB = 2 ** 30
+
+
+@pytest.fixture
+def sched_cfg():
+    return configuration.Scheduling(
+        global_max_jobs=12,
+        global_stagger_m=0,
+        polling_time_s=20,
+        tmpdir_max_jobs=3,
+        tmpdir_stagger_phase_major=2,
+        tmpdir_stagger_phase_minor=1,
+        admission_control=True)
+
+@pytest.fixture
+def plotting_cfg():
+    return configuration.Plotting(
+        k=32, e=False, n_threads=2, n_buckets=128, job_buffer=4096)
+
+class FauxMemoryInfo:
+    def __init__(self, rss):
+        self.rss = rss
+
+class FauxProc:
+    def __init__(self, rss):
+        self.rss = rss
+
+    def memory_info(self):
+        return FauxMemoryInfo(self.rss)
+
+def running_job(r='2', b='4096', rss=0):
+    j = manager.PendingJob('/tmp', '/dst', '/log/x.log', r=r, b=b)
+    j.proc = FauxProc(rss)
+    return j
+
+
+def test_mem_available_bytes(tmp_path):
+    meminfo = tmp_path.joinpath('meminfo')
+    meminfo.write_text('MemTotal:       65807420 kB\n'
+                       'MemFree:         1204428 kB\n'
+                       'MemAvailable:   43311080 kB\n')
+    assert admission.mem_available_bytes(str(meminfo)) == 43311080 * 1024
+
+def test_job_defaults():
+    j = running_job(r=0, b=0)
+    assert admission.job_threads(j) == admission.CHIA_DEFAULT_THREADS
+    assert admission.job_buffer_bytes(j) == admission.CHIA_DEFAULT_BUFFER_MIB * admission.MIB
+
+def test_admits(sched_cfg, plotting_cfg):
+    jobs = [running_job(), running_job()]
+    assert admission.check(jobs, sched_cfg, plotting_cfg, cpus=8, mem_available=64 * GIB) is None
+
+def test_refuses_threads(sched_cfg, plotting_cfg):
+    jobs = [running_job(r='4'), running_job(r='3')]
+    assert (admission.check(jobs, sched_cfg, plotting_cfg, cpus=8, mem_available=64 * GIB) ==
+            'cpu (7+2/8 threads)')
+
+    sched_cfg.cpu_oversubscription = 1.5
+    assert admission.check(jobs, sched_cfg, plotting_cfg, cpus=8, mem_available=64 * GIB) is None
+
+def test_refuses_memory(sched_cfg, plotting_cfg):
+    # The first job has all its buffer resident, the second none of it yet.
+    jobs = [running_job(rss=4 * GIB), running_job(rss=0)]
+    assert admission.check(jobs, sched_cfg, plotting_cfg, cpus=8, mem_available=9 * GIB) is None
+    assert (admission.check(jobs, sched_cfg, plotting_cfg, cpus=8, mem_available=7 * GIB) ==
+            'memory (need 4096 MiB, 3072 MiB free)')
+
+def test_start_new_plots_counts_started_jobs(sched_cfg, plotting_cfg, mocker):
+    sched_cfg.batch_admission = True
+    mocker.patch.object(admission, 'host_cpus', return_value=4)
+    mocker.patch.object(admission, 'mem_available_bytes', return_value=64 * GIB)
+    mocker.patch.object(manager, 'start_plot', side_effect=lambda dir_cfg, plotting_cfg, tmpdir, dstdir, job_priority=None, job_placement=None: (
+        manager.PendingJob(tmpdir, dstdir, '', r=plotting_cfg.n_threads, b=plotting_cfg.job_buffer),
+        'started'))
+    dir_cfg = configuration.Directories(
+        log='/plots/log', tmp=['/t/0', '/t/1', '/t/2'], dst=['/d/0'])
+
+    (logmsgs, wait_reason) = manager.start_new_plots(dir_cfg, sched_cfg, plotting_cfg, jobs=[])
+    assert len(logmsgs) == 2
+    assert wait_reason == 'cpu (4+2/4 threads)'
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from plotman import archive, archive_daemon, configuration, discovery, plot_util, processes
+from plotman.plot_util import GB
+from plotman._tests.helpers import FakeClock
+
+
+NO_PROCESSES = discovery.Snapshot({}, 0.0)
+
+@pytest.fixture
+def env(tmp_path, mocker):
+    dst = tmp_path / 'dst'
+    dst.mkdir()
+    plots = [dst / 'plot-k32-a.plot', dst / 'plot-k32-b.plot']
+    for plot in plots:
+        plot.write_bytes(b'plot')
+    mocker.patch.object(plot_util, 'list_k32_plots',
+                        side_effect=lambda d: sorted(os.path.join(d, f) for f in os.listdir(d)))
+    mocker.patch.object(plot_util, 'df_b', return_value=1000 * GB)
+    mocker.patch.object(plot_util, 'get_k32_plotsize', return_value=100 * GB)
+    dir_cfg = configuration.Directories(
+        log='/plots/log', tmp=['/t/0'], dst=[str(dst)],
+        archive=configuration.Archive(
+            rsyncd_module='plots_mod', rsyncd_path='/plotdir', rsyncd_host='thehostname',
+            rsyncd_user='theusername', plots_per_transfer=2))
+    return (dir_cfg, [str(plot) for plot in plots], str(tmp_path / 'state.json'))
+
+def daemon(state_path, clock, started):
+    free_space = archive.ArchdirFreeSpace(query=lambda arch_cfg: { '/plotdir/000': 1000 * GB })
+    return archive_daemon.ArchiveDaemon(state_path, clock=clock, start=started.append,
+                                        free_space=free_space, wait_for_free_space=True,
+                                        progress_dir=os.path.dirname(state_path))
+
+def test_retry_delay():
+    assert [archive_daemon.retry_delay_s(n) for n in [1, 2, 3, 8]] == [30, 60, 120, 3600]
+
+def test_failed_plots_retried_after_restart(env):
+    (dir_cfg, plots, state_path) = env
+    clock = FakeClock()
+    started = []
+    d = daemon(state_path, clock, started)
+
+    (_, status, _) = d.step(dir_cfg, [], NO_PROCESSES)
+    assert status == '<just started 1 transfer(s)>'
+    assert started[0].endswith(' '.join(plots) + ' rsync://theusername@thehostname:12000/plots_mod/000')
+
+    # The transfer ends having sent only the first plot.
+    os.remove(plots[0])
+    clock.now += 60
+    (logmsgs, status, _) = d.step(dir_cfg, [], NO_PROCESSES)
+    assert logmsgs == [
+        'Archived %s to /plotdir/000' % plots[0],
+        'Archiving %s to /plotdir/000 failed (attempt 1), retrying in 30s' % plots[1]]
+    assert status == 'No plots found (1 plot(s) waiting to retry)'
+    assert len(started) == 1
+
+    # A restarted daemon keeps waiting, then tries again.
+    d = daemon(state_path, clock, started)
+    assert d.seconds_until_retry() == 30
+    clock.now += 30
+    d.step(dir_cfg, [], NO_PROCESSES)
+    assert len(started) == 2
+    assert plots[1] in started[1]
+
+    clock.now += 60
+    (logmsgs, _, _) = d.step(dir_cfg, [], discovery.Snapshot({}, 0.0))
+    assert logmsgs[0].endswith('failed (attempt 2), retrying in 60s')
+
+def test_adopts_running_transfers(env):
+    (dir_cfg, plots, state_path) = env
+    started = []
+    d = daemon(state_path, FakeClock(), started)
+    snapshot = discovery.Snapshot({
+        discovery.ProcessKey(10, 1.0): (processes.ARCHIVE, [
+            'rsync', '--remove-source-files', plots[0],
+            'rsync://theusername@thehostname:12000/plots_mod/000']),
+    }, 0.0)
+
+    (logmsgs, status, transfers) = d.step(dir_cfg, [], snapshot)
+    assert (logmsgs, status) == ([], 'pid: 10')
+    assert [t.pid for t in transfers] == [10]
+    assert started == []
+
+    progress_file = os.path.join(os.path.dirname(state_path), 'plot-k32-a.plot.progress')
+    open(progress_file, 'w').close()
+    (logmsgs, _, _) = d.step(dir_cfg, [], NO_PROCESSES)
+    assert logmsgs[0] == 'Archiving %s to /plotdir/000 failed (attempt 1), retrying in 30s' % plots[0]
+    assert not os.path.exists(progress_file)
+    assert logmsgs[1].startswith('Starting archive: ')
+
+def test_retries_due_or_being_sent_dont_hasten_polling(env):
+    (dir_cfg, plots, state_path) = env
+    clock = FakeClock()
+    started = []
+    d = daemon(state_path, clock, started)
+    d.retries[plots[0]] = { 'attempts': 1, 'next_try': clock.now - 10 }
+    assert d.seconds_until_retry() is None
+    assert d.sleep_s() == archive_daemon.POLL_S
+
+    # Sent again, the retry is parked until the transfer ends.
+    dir_cfg.archive.max_transfers = 1
+    d.step(dir_cfg, [], NO_PROCESSES)
+    assert plots[0] in started[0]
+    assert d.retries[plots[0]] == { 'attempts': 1, 'next_try': None }
+    assert d.sleep_s() == archive_daemon.POLL_S
+
+    clock.now += 60
+    (logmsgs, _, _) = d.step(dir_cfg, [], NO_PROCESSES)
+    assert 'failed (attempt 2), retrying in 60s' in logmsgs[0]
+    # The other plot of the batch failed for the first time.
+    assert d.sleep_s() == 30
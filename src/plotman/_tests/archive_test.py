@@ -1,4 +1,13 @@
-from plotman import archive, configuration, manager
+import shlex
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from plotman import archive, configuration, discovery, manager, plot_util, processes
+from plotman.plot_util import GB
+from plotman._tests.helpers import FakeClock
 
 
 def test_compute_priority():
@@ -23,3 +32,218 @@ def test_rsync_dest():
     # for matching jobs.
     assert ('rsync://theusername@thehostname:12000/' ==
             archive.rsync_dest(arch_cfg, '/'))
+
+def test_archdir_from_rsync_dest():
+    arch_cfg = configuration.Archive(
+        rsyncd_module='plots_mod',
+        rsyncd_path='/plotdir',
+        rsyncd_host='thehostname',
+        rsyncd_user='theusername',
+        rsyncd_bwlimit=80000
+    )
+
+    assert (archive.archdir_from_rsync_dest(
+        arch_cfg, archive.rsync_dest(arch_cfg, '/plotdir/012')) == '/plotdir/012')
+    assert (archive.archdir_from_rsync_dest(
+        arch_cfg, 'rsync://theusername@thehostname:12000/plots_mod/012/') == '/plotdir/012')
+    assert (archive.archdir_from_rsync_dest(
+        arch_cfg, 'rsync://other@thehostname:12000/plots_mod/012') is None)
+    assert (archive.archdir_from_rsync_dest(
+        arch_cfg, 'rsync://theusername@thehostname:12000/other_mod/012') is None)
+
+@pytest.fixture
+def dir_cfg():
+    return configuration.Directories(
+        log='/plots/log',
+        tmp=['/t/0'],
+        dst=['/d/0', '/d/1', '/d/2'],
+        archive=configuration.Archive(
+            rsyncd_module='plots_mod',
+            rsyncd_path='/plotdir',
+            rsyncd_host='thehostname',
+            rsyncd_user='theusername',
+            rsyncd_bwlimit=80000,
+            max_transfers=2))
+
+@pytest.fixture
+def archive_env(mocker):
+    # Every dst dir holds two plots; the archive has three dirs with room.
+    mocker.patch.object(plot_util, 'list_k32_plots',
+                        side_effect=lambda d: [d + '/plot-k32-a.plot', d + '/plot-k32-b.plot'])
+    mocker.patch.object(plot_util, 'df_b', return_value=1000 * GB)
+    mocker.patch.object(archive, 'get_archdir_freebytes', side_effect=lambda arch_cfg: {
+        '/plotdir/000': 1000 * GB, '/plotdir/001': 1000 * GB, '/plotdir/002': 1000 * GB })
+
+def test_archive_commands_parallel(dir_cfg, archive_env):
+    (cmds, reason) = archive.archive_commands(dir_cfg, [], transfers=[])
+    assert cmds == [
+        'rsync --bwlimit=80000 --remove-source-files -P --partial-dir=.plotman-partial /d/2/plot-k32-a.plot '
+        'rsync://theusername@thehostname:12000/plots_mod/000',
+        'rsync --bwlimit=80000 --remove-source-files -P --partial-dir=.plotman-partial /d/1/plot-k32-a.plot '
+        'rsync://theusername@thehostname:12000/plots_mod/001',
+    ]
+    assert reason == 'max transfers (2) running'
+
+def test_archive_commands_avoid_busy_drives(dir_cfg, archive_env):
+    transfers = [archive.ArchiveTransfer(123, ['/d/2/plot-k32-a.plot'], '/plotdir/000')]
+    (cmds, _) = archive.archive_commands(dir_cfg, [], transfers)
+    assert cmds == [
+        'rsync --bwlimit=80000 --remove-source-files -P --partial-dir=.plotman-partial /d/1/plot-k32-a.plot '
+        'rsync://theusername@thehostname:12000/plots_mod/001',
+    ]
+
+    transfers.append(archive.ArchiveTransfer(124, ['/d/1/plot-k32-a.plot'], '/plotdir/001'))
+    assert archive.archive_commands(dir_cfg, [], transfers) == ([], 'max transfers (2) running')
+
+def test_archive_commands_out_of_archive_dirs(dir_cfg, archive_env):
+    dir_cfg.archive.max_transfers = 3
+    transfers = [archive.ArchiveTransfer(123, ['/d/2/plot-k32-a.plot'], '/plotdir/000'),
+                 archive.ArchiveTransfer(124, ['/d/1/plot-k32-a.plot'], '/plotdir/001')]
+    (cmds, reason) = archive.archive_commands(dir_cfg, [], transfers)
+    assert cmds == [
+        'rsync --bwlimit=80000 --remove-source-files -P --partial-dir=.plotman-partial /d/0/plot-k32-a.plot '
+        'rsync://theusername@thehostname:12000/plots_mod/002',
+    ]
+
+    dir_cfg.archive.max_transfers = 4
+    dir_cfg.dst.append('/d/3')
+    (cmds, reason) = archive.archive_commands(dir_cfg, [], transfers[:1])
+    assert len(cmds) == 2
+    assert reason == 'No more idle archive directories with enough free space'
+
+def test_archive_single(dir_cfg, archive_env):
+    dir_cfg.archive.max_transfers = 1
+    (should_start, cmd) = archive.archive(dir_cfg, [])
+    assert should_start
+    assert cmd.endswith('-P --partial-dir=.plotman-partial /d/2/plot-k32-a.plot rsync://theusername@thehostname:12000/plots_mod/000')
+
+def test_parse_df():
+    output = '\n'.join([
+        'Filesystem     1K-blocks       Used   Available Use% Mounted on',
+        'sysfs                 0K         0K          0K    - /sys',
+        '/dev/sdb1    15625879552K 100K 15625879452K   1% /plotdir/000',
+        '/dev/sdc1    15625879552K 15625879552K 0K 100% /plotdir/001',
+        'autofs                 -          -           -    - /plotdir/002',
+        '/dev/sdd1    15625879552K 100K 1000K   1% /plotdirs/003',
+    ])
+    assert archive.parse_df(output, '/plotdir') == {
+        '/plotdir/000': 15625879452 * 1024, '/plotdir/001': 0 }
+
+def test_get_archdir_freebytes_reuses_ssh_connection(dir_cfg, mocker, tmp_path):
+    mocker.patch('appdirs.user_cache_dir', return_value=str(tmp_path))
+    run = mocker.patch('subprocess.run')
+    run.return_value.stdout = b'/dev/sdb1 2048K 1024K 1024K 50% /plotdir/000\n'
+
+    assert archive.get_archdir_freebytes(dir_cfg.archive) == { '/plotdir/000': 1024 * 1024 }
+    args = run.call_args.args[0]
+    assert args[-3:] == ['theusername@thehostname', 'df', '-aBK']
+    assert 'ControlMaster=auto' in args
+    assert 'ControlPath=%s/ssh/%%C' % tmp_path in args
+    assert run.call_args.kwargs['timeout'] == 15
+
+    run.side_effect = subprocess.TimeoutExpired(args, 15)
+    assert archive.get_archdir_freebytes(dir_cfg.archive) == {}
+
+def test_archdir_free_space_cache(dir_cfg):
+    answers = [{ '/plotdir/000': 1000 * GB }, { '/plotdir/000': 900 * GB }]
+    clock = FakeClock()
+    free_space = archive.ArchdirFreeSpace(query=lambda arch_cfg: answers.pop(0), clock=clock)
+
+    assert free_space.freebytes(dir_cfg.archive) == { '/plotdir/000': 1000 * GB }
+
+    # Plots sent count against the snapshot until it is due again...
+    clock.now += 10
+    free_space.record_sent('/plotdir/000', 100 * GB)
+    assert free_space.freebytes(dir_cfg.archive) == { '/plotdir/000': 900 * GB }
+    assert len(answers) == 1
+
+    # ...when the host's answer includes them.
+    clock.now += 300
+    assert free_space.freebytes(dir_cfg.archive) == { '/plotdir/000': 900 * GB }
+    assert answers == []
+    assert free_space.sent_bytes('/plotdir/000') == 0
+
+def test_archdir_free_space_does_not_wait(dir_cfg):
+    answered = threading.Event()
+
+    def slow_query(arch_cfg):
+        answered.wait()
+        return { '/plotdir/000': 1000 * GB }
+
+    free_space = archive.ArchdirFreeSpace(query=slow_query)
+    assert free_space.freebytes(dir_cfg.archive, wait=False) is None
+    answered.set()
+    free_space.thread.join()
+    assert free_space.freebytes(dir_cfg.archive, wait=False) == { '/plotdir/000': 1000 * GB }
+
+def test_archive_commands_count_against_cache(dir_cfg, archive_env, mocker):
+    mocker.patch.object(plot_util, 'get_k32_plotsize', return_value=100 * GB)
+    free_space = archive.ArchdirFreeSpace(query=lambda arch_cfg: {
+        '/plotdir/000': 1000 * GB, '/plotdir/001': 1000 * GB })
+    free_space.freebytes(dir_cfg.archive)
+
+    (cmds, _) = archive.archive_commands(dir_cfg, [], [], free_space)
+    assert len(cmds) == 2
+    assert free_space.freebytes(dir_cfg.archive) == {
+        '/plotdir/000': 900 * GB, '/plotdir/001': 900 * GB }
+
+    # The running transfers' plots are not counted twice.
+    transfers = [archive.ArchiveTransfer(1, ['/d/2/plot-k32-a.plot'], '/plotdir/000')]
+    mocker.patch('os.stat').return_value.st_size = 100 * GB
+    (cmds, _) = archive.archive_commands(dir_cfg, [], transfers, free_space)
+    assert free_space.freebytes(dir_cfg.archive)['/plotdir/000'] == 900 * GB
+
+@pytest.fixture
+def local_cfg(dir_cfg, tmp_path):
+    for d in ['000', '001']:
+        (tmp_path / 'farm' / d).mkdir(parents=True)
+    (tmp_path / 'farm' / 'README').write_text('')
+    dir_cfg.archive = configuration.Archive(
+        rsyncd_path=str(tmp_path / 'farm'), mode='local', rsyncd_bwlimit=80000, max_transfers=2)
+    return dir_cfg
+
+def test_local_archdir_freebytes(local_cfg, tmp_path, mocker):
+    mocker.patch.object(plot_util, 'df_b', return_value=1000 * GB)
+    assert archive.get_archdir_freebytes(local_cfg.archive) == {
+        str(tmp_path / 'farm' / '000'): 1000 * GB, str(tmp_path / 'farm' / '001'): 1000 * GB }
+
+def test_local_archive_commands(local_cfg, archive_env, tmp_path, mocker):
+    mocker.patch.object(archive, 'get_archdir_freebytes', side_effect=lambda arch_cfg: {
+        str(tmp_path / 'farm' / '000'): 1000 * GB })
+    mocker.patch.object(archive.transfer, 'get_log_path', return_value='/plotman/archive.log')
+    (cmds, _) = archive.archive_commands(local_cfg, [], transfers=[])
+    assert cmds == [
+        '%s -m plotman.transfer --remove-source-files --bwlimit=80000 '
+        '--log=/plotman/archive.log /d/2/plot-k32-a.plot %s' % (sys.executable, tmp_path / 'farm' / '000')]
+
+def test_local_running_transfers(local_cfg, tmp_path):
+    archdir = str(tmp_path / 'farm' / '001')
+    snapshot = discovery.Snapshot({
+        discovery.ProcessKey(10, 1.0): (processes.ARCHIVE, [
+            sys.executable, '-m', 'plotman.transfer', '--remove-source-files',
+            '/d/0/plot-k32-a.plot', archdir]),
+        discovery.ProcessKey(11, 1.0): (processes.ARCHIVE, [
+            'rsync', '/d/1/plot-k32-a.plot', '/elsewhere/000']),
+    }, 0.0)
+
+    assert archive.get_running_archive_transfers(local_cfg.archive, snapshot) == [
+        archive.ArchiveTransfer(10, ['/d/0/plot-k32-a.plot'], archdir)]
+
+def test_start_transfer_writes_progress(mocker, tmp_path):
+    mocker.patch.object(archive.transfer_progress, 'get_progress_dir',
+                        return_value=str(tmp_path / 'transfers'))
+    popen = mocker.patch('subprocess.Popen')
+    archive.start_transfer('rsync --bwlimit=80000 --remove-source-files -P --partial-dir=.plotman-partial /d/0/plot-k32-a.plot '
+                           'rsync://theusername@thehostname:12000/plots_mod/000')
+    assert popen.call_args.kwargs['stdout'].name == str(
+        tmp_path / 'transfers' / 'plot-k32-a.plot.progress')
+
+def test_transfer_command_quotes_paths(local_cfg, tmp_path, mocker):
+    mocker.patch.object(archive.transfer, 'get_log_path',
+                        return_value='/Users/me/Library/Application Support/plotman/archive.log')
+    plot = '/d/my plots/plot-k32-a.plot'
+    archdir = str(tmp_path / 'farm' / '000')
+    cmd = archive.transfer_command(local_cfg.archive, [plot], archdir)
+    assert "'--log=/Users/me/Library/Application Support/plotman/archive.log'" in cmd
+    assert archive.transfer_from_cmdline(local_cfg.archive, 1, shlex.split(cmd)) == \
+        archive.ArchiveTransfer(1, [plot], archdir, 80000)
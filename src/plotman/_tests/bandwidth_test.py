@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from plotman import archive, bandwidth, configuration, diskstats, manager
+from plotman._tests.helpers import FakeClock
+
+
+class FakeSampler:
+    def __init__(self, write_mb_s):
+        self.write_mb_s = write_mb_s
+
+    def load(self, d):
+        w = self.write_mb_s.get(d)
+        return None if w is None else diskstats.DeviceLoad(0.5, 1.0, 1, 0.0, w * 1e6)
+
+class FakeJob:
+    def __init__(self, dstdir, phase):
+        self.dstdir = dstdir
+        self.phase = phase
+
+    def progress(self):
+        return self.phase
+
+@pytest.fixture
+def dir_cfg():
+    return configuration.Directories(
+        log='/plots/log', tmp=['/t/0'], dst=['/d/0', '/d/1'],
+        archive=configuration.Archive(
+            rsyncd_module='plots_mod', rsyncd_path='/plotdir', rsyncd_host='thehostname',
+            rsyncd_user='theusername', rsyncd_bwlimit=80000,
+            bandwidth=configuration.ArchiveBandwidth(max_kbps=200000, min_kbps=10000)))
+
+@pytest.fixture
+def controller(tmp_path):
+    clock = FakeClock()
+    started = []
+    stopped = []
+    c = bandwidth.BandwidthController(str(tmp_path / 'bwlimit.json'), clock=clock,
+                                      stop=stopped.append, start=started.append)
+    return (c, clock, started, stopped)
+
+def transfer(pid, dstdir, bwlimit):
+    return archive.ArchiveTransfer(pid, [dstdir + '/plot-k32-a.plot'], '/plotdir/000', bwlimit)
+
+
+def test_next_kbps():
+    bw_cfg = configuration.ArchiveBandwidth(max_kbps=200000, min_kbps=10000)
+    assert bandwidth.next_kbps(bw_cfg, 80000, (3, 6), None) == (10000, 'a job is in phase 3:6')
+    assert (bandwidth.next_kbps(bw_cfg, 80000, (2, 1), FakeSampler({ '/d/0': 50 }).load('/d/0'))
+            == (40000, 'dst device writing 50 MB/s'))
+    assert bandwidth.next_kbps(bw_cfg, 80000, (2, 1), None) == (100000, 'dst device idle')
+    assert bandwidth.next_kbps(bw_cfg, 190000, (0, 0), None)[0] == 200000
+    assert bandwidth.next_kbps(bw_cfg, 15000, (0, 0), FakeSampler({ 'd': 50 }).load('d'))[0] == 10000
+    assert bandwidth.next_kbps(bw_cfg, 80000, (None, None), None) == (100000, 'dst device idle')
+
+def test_rsync_restarted_on_big_changes(dir_cfg, controller, tmp_path):
+    (c, clock, started, stopped) = controller
+    jobs = [FakeJob('/d/0', (3, 6))]
+    transfers = [transfer(10, '/d/0', 80000), transfer(11, '/d/1', 80000)]
+
+    assert c.apply(dir_cfg, jobs, transfers, FakeSampler({})) == [
+        'Archive bandwidth from /d/0: 80000 -> 10000 KB/s (a job is in phase 3:6)',
+        'Archive bandwidth from /d/1: 80000 -> 100000 KB/s (dst device idle)',
+        'Restarted archive transfer 10 at 10000 KB/s: ' +
+        archive.transfer_command(dir_cfg.archive, ['/d/0/plot-k32-a.plot'], '/plotdir/000', 10000),
+    ]
+    assert stopped == [10]
+    assert json.loads((tmp_path / 'bwlimit.json').read_text()) == { '/d/0': 10000, '/d/1': 100000 }
+
+    # Not again until adjust_interval_s has passed.
+    transfers[0] = transfer(12, '/d/0', 10000)
+    assert c.apply(dir_cfg, jobs, transfers, FakeSampler({})) == []
+
+    # The rsync to /d/1 is restarted once the limit has grown enough.
+    clock.now += 60
+    assert c.apply(dir_cfg, jobs, transfers, FakeSampler({})) == [
+        'Archive bandwidth from /d/1: 100000 -> 125000 KB/s (dst device idle)',
+        'Restarted archive transfer 11 at 125000 KB/s: ' +
+        archive.transfer_command(dir_cfg.archive, ['/d/1/plot-k32-a.plot'], '/plotdir/000', 125000),
+    ]
+    assert c.limit(dir_cfg.archive, '/d/1') == 125000
+    assert c.limit(dir_cfg.archive, '/d/2') == 80000
+
+def test_local_transfers_not_restarted(dir_cfg, controller):
+    (c, _, started, stopped) = controller
+    dir_cfg.archive.mode = 'local'
+    transfers = [transfer(10, '/d/0', 80000)]
+    assert len(c.apply(dir_cfg, [FakeJob('/d/0', (4, 0))], transfers, FakeSampler({}))) == 1
+    assert started == [] and stopped == []
+
+def test_without_bandwidth_config(dir_cfg, controller):
+    (c, _, _, _) = controller
+    dir_cfg.archive.bandwidth = None
+    assert c.apply(dir_cfg, [], [transfer(10, '/d/0', 80000)], FakeSampler({})) == []
+    assert c.limit(dir_cfg.archive, '/d/0') == 80000
@@ -38,6 +38,18 @@ def test_get_validated_configs__malformed(mocker, config_path):
     assert exc_info.value.args[0] == f"Config file at: '{configuration.get_path()}' is malformed"
 
 
+def test_get_validated_configs__unparsable(mocker, tmp_path):
+    """Check that get_validated_configs() raises exception when plotman.yaml isn't YAML, e.g. half saved."""
+    config_path = tmp_path / "plotman.yaml"
+    config_path.write_text("directories:\n  tmp: [/mnt/tmp/00\n")
+    mocker.patch("plotman.configuration.get_path", return_value=config_path)
+
+    with pytest.raises(configuration.ConfigurationException) as exc_info:
+        configuration.get_validated_configs()
+
+    assert exc_info.value.args[0] == f"Config file at: '{config_path}' is malformed"
+
+
 def test_get_validated_configs__missing(mocker, config_path):
     """Check that get_validated_configs() raises exception when plotman.yaml does not exist."""
     nonexistent_config = config_path.with_name("plotman2.yaml")
@@ -50,3 +62,19 @@ def test_get_validated_configs__missing(mocker, config_path):
         f"No 'plotman.yaml' file exists at expected location: '{nonexistent_config}'. To generate "
         f"default config file, run: 'plotman config generate'"
     )
+
+
+def test_get_validated_configs__rsync_needs_host(mocker, config_path):
+    """Check that archive mode rsync (the default) requires the rsync daemon's details."""
+    mocker.patch("plotman.configuration.get_path", return_value=config_path)
+    with open(configuration.get_path(), "r") as file:
+        loaded_yaml = yaml.load(file, Loader=yaml.SafeLoader)
+
+    del loaded_yaml["directories"]["archive"]["rsyncd_host"]
+    mocker.patch("yaml.load", return_value=loaded_yaml)
+
+    with pytest.raises(configuration.ConfigurationException):
+        configuration.get_validated_configs()
+
+    loaded_yaml["directories"]["archive"]["mode"] = "local"
+    assert configuration.get_validated_configs().directories.archive.rsyncd_host is None
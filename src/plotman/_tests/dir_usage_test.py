@@ -0,0 +1,69 @@
+import pytest
+
+from plotman import dir_usage, job
+
+ID_A = 'a' * 64
+ID_B = 'b' * 64
+
+
+@pytest.fixture(name='tmpdir_path')
+def tmpdir_fixture(tmp_path):
+    d = tmp_path.joinpath('tmp')
+    d.mkdir()
+    d.joinpath('plot-k32-2021-04-04-19-00-%s.plot.table1.tmp' % ID_A).write_bytes(b'x' * 100)
+    d.joinpath('plot-k32-2021-04-04-19-00-%s.plot.sort.tmp' % ID_A).write_bytes(b'x' * 10)
+    d.joinpath('plot-k32-2021-04-04-20-00-%s.plot.table2.tmp' % ID_B).write_bytes(b'x' * 7)
+    d.joinpath('unrelated').write_bytes(b'x' * 3)
+    return d
+
+
+def test_scan_dir(tmpdir_path):
+    usage = dir_usage.scan_dir(str(tmpdir_path))
+    assert usage.total_bytes == 120
+    assert usage.bytes_by_plot_id == { ID_A: 110, ID_B: 7 }
+
+def test_scan_dir_missing(tmp_path):
+    usage = dir_usage.scan_dir(str(tmp_path.joinpath('missing')))
+    assert usage.total_bytes == 0
+    assert usage.bytes_by_plot_id == {}
+
+def test_cache_scans_once_per_ttl(tmpdir_path, mocker):
+    scan_dir = mocker.spy(dir_usage, 'scan_dir')
+    cache = dir_usage.DirUsageCache(ttl_s=60)
+    assert cache.plot_bytes(str(tmpdir_path), ID_A) == 110
+    assert cache.plot_bytes(str(tmpdir_path), ID_B) == 7
+    assert cache.plot_bytes(str(tmpdir_path), 'c' * 64) == 0
+    assert scan_dir.call_count == 1
+
+    cache.ttl_s = -1  # Everything is stale
+    tmpdir_path.joinpath('plot-k32-2021-04-04-20-00-%s.plot.table3.tmp' % ID_B).write_bytes(b'x')
+    assert cache.plot_bytes(str(tmpdir_path), ID_B) == 8
+    assert scan_dir.call_count == 2
+
+def test_cache_with_zero_ttl_scans_once_per_refresh(tmpdir_path, mocker):
+    scan_dir = mocker.spy(dir_usage, 'scan_dir')
+    cache = dir_usage.DirUsageCache(ttl_s=0)
+    jobs = []
+    for plot_id in [ID_A, ID_B, 'c' * 64]:
+        j = job.Job.__new__(job.Job)
+        j.plot_id = plot_id
+        j.tmpdir = str(tmpdir_path)
+        jobs.append(j)
+
+    assert [j.get_tmp_usage(cache) for j in jobs] == [110, 7, 0]
+    assert scan_dir.call_count == 1
+
+    cache.refresh()
+    assert [j.get_tmp_usage(cache) for j in jobs] == [110, 7, 0]
+    assert scan_dir.call_count == 2
+
+def test_job_usage_from_cache(tmpdir_path):
+    j = job.Job.__new__(job.Job)
+    j.plot_id = ID_A
+    j.tmpdir = str(tmpdir_path)
+    j.dstdir = str(tmpdir_path.parent)
+
+    cache = dir_usage.DirUsageCache()
+    assert j.get_tmp_usage(cache) == 110
+    assert j.get_tmp2_usage(cache) == 0  # No tmp2dir
+    assert j.get_dst_usage(cache) == 0
@@ -0,0 +1,93 @@
+import pytest
+
+from plotman import discovery, job
+
+PLOT_CMDLINE = ['/usr/bin/python3', '/venv/bin/chia', 'plots', 'create', '-k', '32']
+
+
+class FauxProcTree:
+    # Just enough of /proc for discovery.ProcessDiscovery.
+
+    def __init__(self, root):
+        self.root = root
+        self.set_uptime(1000)
+
+    def set_uptime(self, seconds):
+        self.root.joinpath('uptime').write_text('%.2f 1234.56\n' % seconds)
+
+    def add(self, pid, cmdline, start_ticks=100, comm='python3'):
+        d = self.root.joinpath(str(pid))
+        d.mkdir(exist_ok=True)
+        fields = ['S'] + ['0'] * 18 + [str(start_ticks)] + ['0'] * 30
+        d.joinpath('stat').write_text('%d (%s) %s\n' % (pid, comm, ' '.join(fields)))
+        d.joinpath('cmdline').write_bytes(b''.join(a.encode() + b'\0' for a in cmdline))
+
+    def remove(self, pid):
+        d = self.root.joinpath(str(pid))
+        for f in d.iterdir():
+            f.unlink()
+        d.rmdir()
+
+
+@pytest.fixture(name='proc_tree')
+def proc_tree_fixture(tmp_path):
+    return FauxProcTree(tmp_path)
+
+@pytest.fixture(name='counting_classify')
+def counting_classify_fixture():
+    calls = []
+    def classify(cmdline):
+        calls.append(cmdline)
+        return job.is_plotting_cmdline(cmdline)
+    classify.calls = calls
+    return classify
+
+
+def test_refresh_finds_plot_processes(proc_tree, counting_classify):
+    proc_tree.add(10, PLOT_CMDLINE)
+    proc_tree.add(11, ['/usr/sbin/sshd', '-D'])
+    proc_tree.add(12, [], comm='kworker/0:1 (x)')   # Kernel threads have no cmdline
+    d = discovery.ProcessDiscovery(counting_classify, proc_root=str(proc_tree.root))
+
+    assert [key.pid for key in d.refresh()] == [10]
+    assert d.refresh()[0].create_time == 1.0  # 100 ticks
+    assert len(counting_classify.calls) == 3
+
+def test_refresh_reads_cmdline_only_for_new_processes(proc_tree, counting_classify):
+    proc_tree.add(10, PLOT_CMDLINE)
+    proc_tree.add(11, ['/usr/sbin/sshd', '-D'])
+    d = discovery.ProcessDiscovery(counting_classify, proc_root=str(proc_tree.root))
+    d.refresh()
+    assert d.last_n_classified == 2
+
+    proc_tree.add(12, PLOT_CMDLINE)
+    assert sorted(key.pid for key in d.refresh()) == [10, 12]
+    assert d.last_n_classified == 1
+    assert len(counting_classify.calls) == 3
+
+def test_refresh_handles_pid_reuse(proc_tree, counting_classify):
+    proc_tree.add(10, ['/usr/sbin/sshd', '-D'], start_ticks=100)
+    d = discovery.ProcessDiscovery(counting_classify, proc_root=str(proc_tree.root))
+    assert d.refresh() == []
+
+    proc_tree.add(10, PLOT_CMDLINE, start_ticks=5000)
+    assert d.refresh() == [discovery.ProcessKey(10, 50.0)]
+
+def test_refresh_drops_vanished_processes(proc_tree, counting_classify):
+    proc_tree.add(10, PLOT_CMDLINE)
+    d = discovery.ProcessDiscovery(counting_classify, proc_root=str(proc_tree.root))
+    assert len(d.refresh()) == 1
+
+    proc_tree.remove(10)
+    assert d.refresh() == []
+    assert d.classified == {}
+
+def test_refresh_rechecks_young_nonmatching_processes(proc_tree, counting_classify):
+    # Freshly forked, not yet exec'd into chia.
+    proc_tree.set_uptime(10)
+    proc_tree.add(10, ['/usr/bin/python3', '/venv/bin/plotman', 'plot'], start_ticks=900)
+    d = discovery.ProcessDiscovery(counting_classify, proc_root=str(proc_tree.root))
+    assert d.refresh() == []
+
+    proc_tree.add(10, PLOT_CMDLINE, start_ticks=900)
+    assert [key.pid for key in d.refresh()] == [10]
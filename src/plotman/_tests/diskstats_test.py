@@ -0,0 +1,107 @@
+import importlib.resources
+import os
+
+import pytest
+
+from plotman import configuration, diskstats, manager
+from plotman._tests import resources
+from plotman._tests.helpers import FakeClock
+
+
+@pytest.fixture(name='diskstats_paths')
+def diskstats_fixture(tmp_path):
+    # Two samples of /proc/diskstats, taken two seconds apart.
+    paths = []
+    for name in ['diskstats.0', 'diskstats.1']:
+        path = tmp_path.joinpath(name)
+        path.write_text(importlib.resources.read_text(resources, name))
+        paths.append(str(path))
+    return paths
+
+def sampled(diskstats_paths):
+    clock = FakeClock()
+    sampler = diskstats.DiskStatsSampler(diskstats_paths[0], clock)
+    sampler.sample()
+    sampler.path = diskstats_paths[1]
+    clock.now += 2
+    sampler.sample()
+    return sampler
+
+
+def test_read_diskstats(diskstats_paths):
+    counters = diskstats.read_diskstats(diskstats_paths[0])
+    assert counters[(8, 0)] == diskstats.DiskCounters(
+        sectors_read=20573548, sectors_written=97618152, in_flight=0,
+        io_ms=1101960, weighted_io_ms=2058192)
+    assert counters[(259, 0)].in_flight == 3
+    # Lines from old kernels, without I/O time fields, are skipped.
+    assert (253, 0) not in counters
+
+def test_read_diskstats_missing(tmp_path):
+    assert diskstats.read_diskstats(str(tmp_path.joinpath('missing'))) == {}
+
+def test_sampler_loads(diskstats_paths):
+    sampler = sampled(diskstats_paths)
+
+    sda = sampler.loads[(8, 0)]
+    assert sda.utilization == pytest.approx(0.25)
+    assert sda.queue_depth == pytest.approx(0.5)
+    assert sda.read_bytes_s == 0
+    assert sda.write_bytes_s == pytest.approx(20480 * 512 / 2)
+
+    nvme = sampler.loads[(259, 0)]
+    assert nvme.utilization == pytest.approx(0.975)
+    assert nvme.queue_depth == pytest.approx(6.0)
+    assert nvme.in_flight == 9
+
+def test_sampler_ignores_close_samples(diskstats_paths):
+    clock = FakeClock()
+    sampler = diskstats.DiskStatsSampler(diskstats_paths[0], clock)
+    sampler.sample()
+    sampler.path = diskstats_paths[1]
+    clock.now += diskstats.MIN_INTERVAL_S / 2
+    sampler.sample()
+    assert sampler.loads == {}
+
+def test_sampler_saturated(diskstats_paths, tmp_path):
+    sampler = sampled(diskstats_paths)
+    sampler.devices = { '/mnt/tmp/00': (259, 0), '/mnt/tmp/01': (8, 0) }
+
+    assert sampler.saturated('/mnt/tmp/00', 0.9)
+    assert not sampler.saturated('/mnt/tmp/01', 0.9)
+    assert not sampler.saturated('/mnt/tmp/00', None)
+    # Unknown device
+    assert not sampler.saturated(str(tmp_path), 0.9)
+    assert sampler.device(str(tmp_path)) == (
+        os.major(tmp_path.stat().st_dev), os.minor(tmp_path.stat().st_dev))
+
+@pytest.fixture
+def sched_cfg():
+    return configuration.Scheduling(
+        global_max_jobs=4,
+        global_stagger_m=0,
+        polling_time_s=20,
+        tmpdir_max_jobs=1,
+        tmpdir_stagger_phase_major=2,
+        tmpdir_stagger_phase_minor=1,
+        max_device_utilization=0.9)
+
+def test_select_new_plot_avoids_busy_devices(diskstats_paths, sched_cfg):
+    sampler = sampled(diskstats_paths)
+    sampler.devices = { '/mnt/tmp/00': (259, 0), '/mnt/tmp/01': (8, 0),
+                        '/mnt/dst/00': (259, 0), '/mnt/dst/01': (8, 0) }
+    dir_cfg = configuration.Directories(
+        log='/plots/log',
+        tmp=['/mnt/tmp/00', '/mnt/tmp/01'],
+        dst=['/mnt/dst/00', '/mnt/dst/01'])
+
+    for _ in range(10):
+        assert (manager.select_new_plot(dir_cfg, sched_cfg, [], disk_sampler=sampler) ==
+                ('/mnt/tmp/01', '/mnt/dst/01', None))
+
+    dir_cfg.tmp = ['/mnt/tmp/00']
+    assert (manager.select_new_plot(dir_cfg, sched_cfg, [], disk_sampler=sampler) ==
+            (None, None, 'eligible tmp devices busy'))
+
+    sched_cfg.max_device_utilization = None
+    assert manager.select_new_plot(dir_cfg, sched_cfg, [], disk_sampler=sampler)[0] == '/mnt/tmp/00'
@@ -0,0 +1,77 @@
+import importlib.resources
+
+import pytest
+
+from plotman import eta, job
+from plotman._tests import resources
+
+# Phase durations logged in the sample logfile.
+PHASE_S = {1: 17571.981, 2: 6911.621, 3: 14537.188, 4: 924.288}
+TOTAL_S = sum(PHASE_S.values())
+
+
+@pytest.fixture(name='history')
+def history_fixture(tmp_path):
+    log_contents = importlib.resources.read_binary(resources, '2021-04-04-19:00:47.log')
+    tmp_path.joinpath('done.log').write_bytes(log_contents)
+    # A running job's log has no completed plots.
+    tmp_path.joinpath('running.log').write_bytes(log_contents[:log_contents.index(b'Time for phase 1')])
+
+    history = eta.PhaseHistory()
+    history.load_logdir(str(tmp_path))
+    return history
+
+def job_at_phase(phase, reached_at=None, tmpdir='/farm/yards/901', dstdir='/dst/0'):
+    j = job.Job.__new__(job.Job)
+    j.phase = phase
+    j.tmpdir = tmpdir
+    j.dstdir = dstdir
+    j.phase_times = {} if reached_at is None else { phase: reached_at }
+    return j
+
+
+def test_history_expected_phase_s(history):
+    assert history.n_plots() == 1
+    for p in eta.PHASES:
+        assert history.expected_phase_s(p) == PHASE_S[p]
+        assert history.expected_phase_s(p, '/some/other/tmp') == PHASE_S[p]
+
+def test_history_empty(tmp_path):
+    history = eta.PhaseHistory()
+    history.load_logdir(str(tmp_path))
+    assert history.expected_phase_s(1) is None
+    assert eta.Estimator(history).remaining_s(job_at_phase((1, 0))) is None
+
+def test_remaining_s_at_start(history):
+    estimator = eta.Estimator(history)
+    assert estimator.remaining_s(job_at_phase((0, 0))) == pytest.approx(TOTAL_S)
+    assert estimator.remaining_s(job_at_phase((None, None))) is None
+
+def test_remaining_s_credits_time_in_subphase(history):
+    estimator = eta.Estimator(history)
+    j = job_at_phase((2, 3), reached_at=1000)
+    done_before = PHASE_S[1] + PHASE_S[2] * 3 / 6
+
+    assert estimator.remaining_s(j, now=1100) == pytest.approx(TOTAL_S - done_before - 100)
+    # Overdue: no credit beyond the length of the subphase.
+    assert (estimator.remaining_s(j, now=1000 + 100_000) ==
+            pytest.approx(TOTAL_S - done_before - PHASE_S[2] / 6))
+
+def test_time_to_phase(history):
+    estimator = eta.Estimator(history)
+    j = job_at_phase((1, 4))
+    assert estimator.time_to_phase(j, (1, 4)) == 0
+    assert estimator.time_to_phase(j, (1, 2)) == 0
+    assert estimator.time_to_phase(j, (2, 0)) == pytest.approx(PHASE_S[1] * 4 / 8)
+
+def test_dst_write_etas(history):
+    estimator = eta.Estimator(history)
+    jobs = [job_at_phase((3, 0), dstdir='/dst/0'),
+            job_at_phase((1, 0), dstdir='/dst/0'),
+            job_at_phase((4, 0), dstdir='/dst/1'),
+            job_at_phase((None, None), dstdir='/dst/2')]
+    etas = estimator.dst_write_etas(jobs, now=0)
+
+    assert sorted(etas.keys()) == ['/dst/0', '/dst/1']
+    assert etas['/dst/0'] == [pytest.approx(PHASE_S[3] + PHASE_S[4]), pytest.approx(TOTAL_S)]
+    assert etas['/dst/1'] == [pytest.approx(PHASE_S[4])]
@@ -0,0 +1,6 @@
+class FakeClock:
+    '''A clock for the tests to move forward by hand: its time is now.'''
+    now = 1000.0
+
+    def __call__(self):
+        return self.now
@@ -1,8 +1,10 @@
 import contextlib
 import datetime
 import locale
+import os
 import importlib.resources
 
+import psutil
 import pytest
 from plotman import job
 from plotman._tests import resources
@@ -54,3 +56,139 @@ def test_job_parses_time_with_non_english_locale(logfile_path, locale_name):
         job.Job.init_from_logfile(self=faux_job_with_logfile)
 
     assert faux_job_with_logfile.start_time == log_file_time
+
+
+def job_for_logfile(logfile_path):
+    # Skip .__init__(), which needs a live plotting process.
+    j = job.Job.__new__(job.Job)
+    j.logfile = str(logfile_path)
+    return j
+
+
+def test_job_phase_from_logfile(logfile_path):
+    j = job_for_logfile(logfile_path)
+    j.set_phase_from_logfile()
+
+    assert j.progress() == (4, 0)
+    assert j.logfile_offset == logfile_path.stat().st_size
+
+
+def test_job_phase_parses_only_appended_output(logfile_path, tmp_path):
+    contents = logfile_path.read_bytes()
+    phase_2_start = contents.index(b'Starting phase 2/4')
+    growing_log_path = tmp_path.joinpath('growing.log')
+
+    # Cut the log in the middle of a line.
+    growing_log_path.write_bytes(contents[:phase_2_start + 10])
+    j = job_for_logfile(growing_log_path)
+    j.set_phase_from_logfile()
+    assert j.progress() == (1, 7)
+    assert j.logfile_partial == b'Starting p'
+
+    with open(growing_log_path, 'ab') as f:
+        f.write(contents[phase_2_start + 10:])
+    j.set_phase_from_logfile()
+    assert j.progress() == (4, 0)
+
+    # Nothing new, nothing reread.
+    j.set_phase_from_logfile()
+    assert j.progress() == (4, 0)
+    assert j.logfile_offset == len(contents)
+
+
+def test_job_phase_after_logfile_truncation(logfile_path, tmp_path):
+    contents = logfile_path.read_bytes()
+    phase_2_start = contents.index(b'Starting phase 2/4')
+    j = job_for_logfile(logfile_path)
+    j.set_phase_from_logfile()
+    assert j.progress() == (4, 0)
+
+    # Shorter than before.
+    logfile_path.write_bytes(contents[:phase_2_start])
+    j.set_phase_from_logfile()
+    assert j.progress() == (1, 7)
+
+    # Rewritten to be longer than before, with different content.
+    logfile_path.write_bytes(contents[:phase_2_start] + b'\n' * len(contents))
+    j.set_phase_from_logfile()
+    assert j.progress() == (1, 7)
+
+
+def test_job_phase_after_logfile_rotation(logfile_path, tmp_path):
+    contents = logfile_path.read_bytes()
+    j = job_for_logfile(logfile_path)
+    j.set_phase_from_logfile()
+    assert j.progress() == (4, 0)
+
+    # Same size as before, but a different file.
+    phase_2_start = contents.index(b'Starting phase 2/4')
+    replacement_path = tmp_path.joinpath('replacement.log')
+    replacement_path.write_bytes(
+        contents[:phase_2_start] + b'\n' * (len(contents) - phase_2_start))
+    os.replace(replacement_path, logfile_path)
+    j.set_phase_from_logfile()
+    assert j.progress() == (1, 7)
+
+
+def test_job_metadata_pending_until_logged(logfile_path, tmp_path):
+    contents = logfile_path.read_bytes()
+    new_log_path = tmp_path.joinpath('new.log')
+    new_log_path.write_bytes(contents[:contents.index(b'ID: ')])
+
+    j = job_for_logfile(new_log_path)
+    assert not j.init_from_logfile()
+    assert j.metadata_pending == {'plot_id', 'start_time'}
+    assert j.plot_id == '--------'
+    assert j.start_time is not None  # Provisional
+    assert j.progress() == (0, 0)
+
+    new_log_path.write_bytes(contents[:contents.index(b'Computing table 1')])
+    j.update_from_logfile()
+    assert j.metadata_pending == frozenset()
+    assert j.plot_id == '3eb8a37981de1cc76187a36ed947ab4307943cf92967a7e166841186c7899e24'
+    assert j.start_time == log_file_time
+    assert j.progress() == (1, 0)
+
+
+def test_job_metadata_found_at_init(logfile_path):
+    j = job_for_logfile(logfile_path)
+    assert j.init_from_logfile()
+    assert j.metadata_pending == frozenset()
+    assert j.start_time == log_file_time
+    assert j.progress() == (4, 0)
+
+
+def job_for_this_process():
+    j = job.Job.__new__(job.Job)
+    j.proc = psutil.Process()
+    j.create_time = j.proc.create_time()
+    return j
+
+
+def test_job_sample_metrics():
+    j = job_for_this_process()
+    metrics = j.sample_metrics()
+
+    assert j.metrics is metrics
+    assert metrics.run_status in {'RUN', 'SLP'}
+    assert metrics.mem_usage > 0
+    assert metrics.time_wall >= 0
+    assert metrics.time_user >= 0
+
+
+def test_job_phase_times(logfile_path):
+    j = job_for_logfile(logfile_path)
+    j.set_phase_from_logfile()
+
+    with set_locale('C'):
+        def logged(s):
+            return datetime.datetime.strptime(s, '%a %b %d %H:%M:%S %Y').timestamp()
+
+        assert j.phase_time((1, 0)) == logged('Sun Apr  4 19:00:50 2021')
+        # Timed by the preceding "F1 complete" line.
+        assert j.phase_time((1, 2)) == logged('Sun Apr  4 19:04:03 2021')
+        assert j.phase_time((2, 0)) == logged('Sun Apr  4 23:53:42 2021')
+        assert j.phase_time((3, 6)) == logged('Mon Apr  5 05:13:07 2021')
+        assert j.phase_time((4, 0)) == logged('Mon Apr  5 05:51:11 2021')
+    assert j.phase_time((4, 1)) is None
+    assert j.phase_durations == {1: 17571.981, 2: 6911.621, 3: 14537.188, 4: 924.288}
@@ -0,0 +1,73 @@
+import importlib.resources
+
+from plotman import log_parser
+from plotman._tests import resources
+
+
+def fixture_events():
+    log_contents = importlib.resources.read_text(resources, '2021-04-04-19:00:47.log')
+    return list(log_parser.parse_lines(log_contents.splitlines(keepends=True)))
+
+def test_parse_line_phase_started():
+    assert (log_parser.parse_line(
+            'Starting phase 1/4: Forward Propagation into tmp files... Sun Apr  4 19:00:50 2021\n') ==
+            log_parser.PhaseStarted(1, 'Forward Propagation into tmp files', 'Sun Apr  4 19:00:50 2021'))
+    assert (log_parser.parse_line(
+            'Starting phase 3/4: Compression from tmp files into "/t/x.plot.2.tmp" ... Mon Apr  5 01:48:54 2021\n') ==
+            log_parser.PhaseStarted(3, 'Compression from tmp files into "/t/x.plot.2.tmp"', 'Mon Apr  5 01:48:54 2021'))
+
+def test_parse_line_tables():
+    assert log_parser.parse_line('Computing table 2\n') == log_parser.TableComputed(1, 2)
+    assert log_parser.parse_line('Backpropagating on table 6\n') == log_parser.TableComputed(2, 1)
+    assert log_parser.parse_line('Compressing tables 4 and 5\n') == log_parser.TableComputed(3, 4)
+
+def test_parse_line_times():
+    assert (log_parser.parse_line(
+            'Time for phase 1 = 22796.7 seconds. CPU (98%) Tue Sep 29 17:57:19 2020\n') ==
+            log_parser.PhaseTime(1, 22796.7, 'Tue Sep 29 17:57:19 2020'))
+    assert (log_parser.parse_line(
+            'Total time = 49487.1 seconds. CPU (97.26%) Wed Sep 30 01:22:10 2020\n') ==
+            log_parser.TotalTime(49487.1, 'Wed Sep 30 01:22:10 2020'))
+    assert (log_parser.parse_line(
+            'Total compress table time: 2678.466 seconds. CPU (83.230%) Mon Apr  5 05:13:07 2021\n') ==
+            log_parser.StepTime(2678.466, 'Mon Apr  5 05:13:07 2021'))
+    assert (log_parser.parse_line(
+            'scanned time =  337.014 seconds. CPU (30.500%) Sun Apr  4 23:59:19 2021\n') ==
+            log_parser.StepTime(337.014, 'Sun Apr  4 23:59:19 2021'))
+
+def test_parse_line_buckets():
+    assert (log_parser.parse_line(
+            '\tBucket 267 uniform sort. Ram: 0.920GiB, u_sort min: 0.688GiB, qs min: 0.172GiB.\n') ==
+            log_parser.BucketSorted(267, 'uniform sort', False))
+    assert (log_parser.parse_line(
+            '\tBucket 511 QS. Ram: 0.920GiB, u_sort min: 0.375GiB, qs min: 0.094GiB. force_qs: 1\n') ==
+            log_parser.BucketSorted(511, 'QS', True))
+
+def test_parse_line_plot_started():
+    assert (log_parser.parse_line(
+            '2021-04-08T13:33:43.542  chia.plotting.create_plots       : INFO     Starting plot 1/5\n') ==
+            log_parser.PlotStarted(1, 5))
+
+def test_parse_line_uninteresting():
+    assert log_parser.parse_line('Using 128 buckets\n') is None
+    assert log_parser.parse_line('\n') is None
+    assert log_parser.parse_line('') is None
+
+def test_parse_lines_fixture():
+    events = fixture_events()
+    by_type = {}
+    for event in events:
+        by_type.setdefault(type(event), []).append(event)
+
+    assert by_type[log_parser.PlotStarted] == [log_parser.PlotStarted(1, 1)]
+    assert by_type[log_parser.TmpDirs] == [log_parser.TmpDirs('/farm/yards/901', '/farm/yards/901')]
+    assert by_type[log_parser.PlotId] == [log_parser.PlotId(
+            '3eb8a37981de1cc76187a36ed947ab4307943cf92967a7e166841186c7899e24')]
+    assert [e.phase for e in by_type[log_parser.PhaseStarted]] == [1, 2, 3, 4]
+    assert len(by_type[log_parser.TableComputed]) == 7 + 6 + 6
+    assert len(by_type[log_parser.BucketSorted]) == 1961
+    assert len(by_type[log_parser.StepTime]) == 1 + 6 + 6 + 5 + 6
+    assert [e.seconds for e in by_type[log_parser.PhaseTime]] == [
+            17571.981, 6911.621, 14537.188, 924.288]
+    assert by_type[log_parser.TotalTime] == [
+            log_parser.TotalTime(39945.08, 'Mon Apr  5 06:06:35 2021')]
@@ -0,0 +1,110 @@
+import importlib.resources
+
+import pytest
+
+from plotman import job, log_watcher
+from plotman._tests import resources
+
+
+def inotify_available(logdir):
+    try:
+        log_watcher.InotifyBackend(str(logdir)).close()
+    except OSError:
+        return False
+    return True
+
+@pytest.fixture(name='logdir', params=['poll', 'inotify'])
+def logdir_fixture(request, tmp_path):
+    if request.param == 'inotify' and not inotify_available(tmp_path):
+        pytest.skip('inotify is not available')
+    tmp_path.joinpath('idle.log').write_text('Starting phase 1/4\n')
+    return (tmp_path, request.param)
+
+@pytest.fixture(name='log_contents')
+def log_contents_fixture():
+    return importlib.resources.read_binary(resources, '2021-04-04-19:00:47.log')
+
+def job_for_logfile(logfile_path):
+    j = job.Job.__new__(job.Job)
+    j.logfile = str(logfile_path)
+    return j
+
+
+def test_no_activity(logdir):
+    (path, backend) = logdir
+    watcher = log_watcher.LogWatcher(str(path), backend)
+    try:
+        activity = watcher.wait(0.01)
+        assert not activity
+        assert watcher.backend_name == backend
+    finally:
+        watcher.close()
+
+def test_created_and_modified(logdir):
+    (path, backend) = logdir
+    watcher = log_watcher.LogWatcher(str(path), backend)
+    try:
+        new_log = path.joinpath('new.log')
+        new_log.write_text('Starting phase 1/4\n')
+        activity = watcher.wait(2)
+        assert str(new_log) in activity.created
+
+        with open(path.joinpath('idle.log'), 'a') as f:
+            f.write('Computing table 2\n')
+        activity = watcher.wait(2)
+        assert str(path.joinpath('idle.log')) in activity.modified
+    finally:
+        watcher.close()
+
+def test_updates_only_written_jobs(logdir, log_contents, mocker):
+    (path, backend) = logdir
+    phase_2_start = log_contents.index(b'Starting phase 2/4')
+    growing_log = path.joinpath('growing.log')
+    growing_log.write_bytes(log_contents[:phase_2_start])
+
+    growing_job = job_for_logfile(growing_log)
+    growing_job.set_phase_from_logfile()
+    idle_job = job_for_logfile(path.joinpath('idle.log'))
+    idle_job.set_phase_from_logfile()
+    assert growing_job.progress() == (1, 7)
+
+    watcher = log_watcher.LogWatcher(str(path), backend)
+    try:
+        idle_update = mocker.spy(idle_job, 'update_from_logfile')
+        with open(growing_log, 'ab') as f:
+            f.write(log_contents[phase_2_start:])
+
+        (phase_changes, _) = watcher.poll([growing_job, idle_job], timeout=2)
+        assert phase_changes == [log_watcher.PhaseChange(growing_job, (1, 7), (4, 0))]
+        assert idle_update.call_count == 0
+    finally:
+        watcher.close()
+
+def test_overflow_updates_all_jobs(tmp_path, mocker):
+    j = job_for_logfile(tmp_path.joinpath('a.log'))
+    update = mocker.patch.object(j, 'update_from_logfile')
+    watcher = log_watcher.LogWatcher(str(tmp_path), 'poll')
+
+    overflow = log_watcher.LogActivity(frozenset(), frozenset(), frozenset(), True)
+    assert watcher.update_jobs([j], overflow) == []
+    assert update.call_count == 1
+
+def test_unknown_backend(tmp_path):
+    with pytest.raises(ValueError):
+        log_watcher.LogWatcher(str(tmp_path), 'carrier-pigeon')
+
+def test_polling_checks_only_jobs_logfiles(tmp_path, mocker):
+    for i in range(10):
+        tmp_path.joinpath('old-%d.log' % i).write_text('Starting phase 1/4\n')
+    j = job_for_logfile(tmp_path.joinpath('old-0.log'))
+    watcher = log_watcher.LogWatcher(str(tmp_path), 'poll')
+
+    stat = mocker.spy(log_watcher, 'stat_signature')
+    assert not watcher.wait(0, [j])
+    # The log dir, for new files, and the job's logfile.
+    assert sorted(c.args[0] for c in stat.call_args_list) == [
+        str(tmp_path), str(tmp_path.joinpath('old-0.log'))]
+
+    new_log = tmp_path.joinpath('new.log')
+    new_log.write_text('Starting phase 1/4\n')
+    assert watcher.wait(0, [j]).created == {str(new_log)}
@@ -91,3 +91,58 @@ def test_dstdirs_to_youngest_phase():
             { '/plots1' : (1, 5),
               '/plots2' : (1, 1),
               '/plots3' : (4, 1) } )
+
+@pytest.fixture
+def batch_sched_cfg():
+    return configuration.Scheduling(
+        global_max_jobs=3,
+        global_stagger_m=0,
+        polling_time_s=2,
+        tmpdir_stagger_phase_major=3,
+        tmpdir_stagger_phase_minor=0,
+        tmpdir_max_jobs=3,
+        batch_admission=True,
+        reserve_space=False
+    )
+
+def fake_start_plot(dir_cfg, plotting_cfg, tmpdir, dstdir, job_priority=None, job_placement=None):
+    return (manager.PendingJob(tmpdir, dstdir, '/plots/log/x.log'), 'started on ' + tmpdir)
+
+def test_start_new_plots_batch(batch_sched_cfg, dir_cfg, mocker):
+    mocker.patch.object(manager, 'start_plot', side_effect=fake_start_plot)
+    (logmsgs, wait_reason) = manager.start_new_plots(
+        dir_cfg, batch_sched_cfg, None, jobs=[])
+
+    # One job per tmpdir before the stagger milestone.
+    assert sorted(logmsgs) == ['started on /tmp', 'started on /var/tmp']
+    assert wait_reason == 'no eligible tempdirs'
+
+def test_start_new_plots_batch_max_jobs(batch_sched_cfg, dir_cfg, mocker):
+    batch_sched_cfg.global_max_jobs = 1
+    mocker.patch.object(manager, 'start_plot', side_effect=fake_start_plot)
+    (logmsgs, wait_reason) = manager.start_new_plots(
+        dir_cfg, batch_sched_cfg, None, jobs=[])
+
+    assert len(logmsgs) == 1
+    assert wait_reason == 'max jobs (1)'
+
+def test_start_new_plots_without_batch(batch_sched_cfg, dir_cfg, mocker):
+    batch_sched_cfg.batch_admission = False
+    start_plot = mocker.patch.object(manager, 'start_plot', side_effect=fake_start_plot)
+    (logmsgs, _) = manager.start_new_plots(
+        dir_cfg, batch_sched_cfg, None, jobs=[])
+
+    assert len(logmsgs) == 1
+    assert start_plot.call_count == 1
+
+def test_open_new_logfile_unique(tmp_path, mocker):
+    datetime = mocker.patch.object(manager, 'datetime')
+    datetime.now.return_value.strftime.return_value = '2021-04-04-19:00:47'
+
+    (first, f) = manager.open_new_logfile(str(tmp_path))
+    f.close()
+    (second, f) = manager.open_new_logfile(str(tmp_path))
+    f.close()
+
+    assert first == str(tmp_path.joinpath('2021-04-04-19:00:47.log'))
+    assert second == str(tmp_path.joinpath('2021-04-04-19:00:47-2.log'))
@@ -0,0 +1,109 @@
+import pytest
+
+from plotman import configuration, manager, placement, reporting
+
+
+@pytest.fixture
+def topology_root(tmp_path):
+    # A dual-socket machine with 8 CPUs per node, hyperthreads interleaved
+    # as the kernel usually numbers them, and a memory-only node.
+    for (node, cpulist) in [(0, '0-3,8-11'), (1, '4-7,12-15'), (2, '')]:
+        node_dir = tmp_path / ('node%d' % node)
+        node_dir.mkdir()
+        (node_dir / 'cpulist').write_text(cpulist + '\n')
+    (tmp_path / 'possible').write_text('0-2\n')
+    return str(tmp_path)
+
+def pinned_job(cpus):
+    return manager.PendingJob('/t/0', '/d/0', '', cpus=cpus)
+
+
+def test_parse_cpulist():
+    assert placement.parse_cpulist('0-3,8-11\n') == [0, 1, 2, 3, 8, 9, 10, 11]
+    assert placement.parse_cpulist('5') == [5]
+    assert placement.parse_cpulist('\n') == []
+
+def test_format_cpulist():
+    assert placement.format_cpulist([8, 0, 1, 2, 3, 9, 5]) == '0-3,5,8-9'
+    assert placement.format_cpulist([7]) == '7'
+
+def test_read_topology(topology_root):
+    assert placement.read_topology(topology_root) == {
+        0: [0, 1, 2, 3, 8, 9, 10, 11],
+        1: [4, 5, 6, 7, 12, 13, 14, 15] }
+    assert placement.read_topology(topology_root + '/missing') == {}
+
+def test_job_node(topology_root):
+    topology = placement.read_topology(topology_root)
+    assert placement.job_node(pinned_job([4, 5]), topology) == 1
+    assert placement.job_node(pinned_job([3, 4]), topology) is None
+    assert placement.job_node(manager.PendingJob('/t/0', '/d/0', ''), topology) is None
+
+def test_place_least_loaded_node(topology_root):
+    topology = placement.read_topology(topology_root)
+    assert placement.place(topology, [], 4) == placement.Placement(0, [0, 1, 2, 3])
+
+    jobs = [pinned_job([0, 1, 2, 3])]
+    assert placement.place(topology, jobs, 4) == placement.Placement(1, [4, 5, 6, 7])
+
+    # Within a node, the least used CPUs.
+    jobs.append(pinned_job([4, 5, 6, 7]))
+    assert placement.place(topology, jobs, 4) == placement.Placement(0, [8, 9, 10, 11])
+
+    # Unpinned jobs don't count against any node.
+    jobs = [pinned_job(list(range(16)))]
+    assert placement.place(topology, jobs, 2) == placement.Placement(0, [0, 1])
+
+def test_place_on_node(topology_root):
+    topology = placement.read_topology(topology_root)
+    jobs = [pinned_job([4, 5, 6, 7])]
+    assert placement.place(topology, jobs, 2, node=1) == placement.Placement(1, [12, 13])
+    assert placement.place(topology, jobs, 2, node=5) is None
+
+def test_place_single_node():
+    topology = { 0: [0, 1, 2, 3] }
+    assert placement.place(topology, [], 2) is None
+    assert placement.place(topology, [], 2, node=0) == placement.Placement(0, [0, 1])
+
+def test_place_job(topology_root):
+    topology = placement.read_topology(topology_root)
+    dir_cfg = configuration.Directories(
+        log='/plots/log', tmp=['/t/0', '/t/1'], dst=['/d/0'],
+        tmp_overrides={ '/t/1': configuration.TmpOverrides(numa_node=1) })
+    sched_cfg = configuration.Scheduling(
+        global_max_jobs=4, global_stagger_m=0, polling_time_s=20, tmpdir_max_jobs=2,
+        tmpdir_stagger_phase_major=2, tmpdir_stagger_phase_minor=1)
+    plotting_cfg = configuration.Plotting(k=32, e=False, n_threads=2, n_buckets=128,
+                                          job_buffer=3389)
+
+    assert placement.place_job(dir_cfg, sched_cfg, plotting_cfg, '/t/0', [], topology) is None
+    assert (placement.place_job(dir_cfg, sched_cfg, plotting_cfg, '/t/1', [], topology) ==
+            placement.Placement(1, [4, 5]))
+    sched_cfg.numa_pinning = True
+    assert (placement.place_job(dir_cfg, sched_cfg, plotting_cfg, '/t/0', [], topology) ==
+            placement.Placement(0, [0, 1]))
+
+def test_start_plot_pins_job(mocker, tmp_path):
+    popen = mocker.patch('subprocess.Popen')
+    process = mocker.patch('psutil.Process')
+    dir_cfg = configuration.Directories(log=str(tmp_path), tmp=['/t/0'], dst=['/d/0'])
+    plotting_cfg = configuration.Plotting(k=32, e=False, n_threads=2, n_buckets=128,
+                                          job_buffer=3389)
+
+    (pending_job, logmsg) = manager.start_plot(
+        dir_cfg, plotting_cfg, '/t/0', '/d/0',
+        job_placement=placement.Placement(1, [4, 5]))
+
+    assert pending_job.cpus == [4, 5]
+    assert logmsg.endswith(' ; on node 1 cpus 4-5')
+    # Not in the child before exec, which may deadlock if we run threads.
+    assert 'preexec_fn' not in popen.call_args.kwargs
+    process.assert_called_once_with(popen.return_value.pid)
+    process.return_value.cpu_affinity.assert_called_once_with([4, 5])
+
+def test_status_report_shows_node(topology_root):
+    topology = placement.read_topology(topology_root)
+    report = reporting.status_report([], 120, topology=topology)
+    assert 'node' in report.splitlines()[0]
+    report = reporting.status_report([], 120, topology={ 0: [0, 1] })
+    assert 'node' not in report.splitlines()[0]
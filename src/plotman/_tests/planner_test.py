@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from plotman import configuration, eta, job, planner
+
+FAST = {1: 3600, 2: 1800, 3: 3600, 4: 600}
+SLOW = {p: 2 * s for (p, s) in FAST.items()}
+
+
+@pytest.fixture
+def history():
+    history = eta.PhaseHistory()
+    history.logfile_plots = {
+        '/log/fast.log': [('/mnt/tmp/fast', FAST)] * eta.MIN_TMPDIR_SAMPLES,
+        '/log/slow.log': [('/mnt/tmp/slow', SLOW)] * eta.MIN_TMPDIR_SAMPLES,
+    }
+    return history
+
+@pytest.fixture
+def dir_cfg():
+    return configuration.Directories(
+        log='/log',
+        tmp=['/mnt/tmp/slow', '/mnt/tmp/fast'],
+        dst=['/mnt/dst/00'])
+
+@pytest.fixture
+def sched_cfg():
+    return configuration.Scheduling(
+        global_max_jobs=1,
+        global_stagger_m=0,
+        polling_time_s=20,
+        tmpdir_max_jobs=1,
+        tmpdir_stagger_phase_major=2,
+        tmpdir_stagger_phase_minor=1,
+        predictive_planning=True)
+
+def running_job(tmpdir, phase, reached_at, started_at):
+    j = job.Job.__new__(job.Job)
+    j.tmpdir = tmpdir
+    j.dstdir = '/mnt/dst/00'
+    j.phase = phase
+    j.phase_times = { phase: reached_at }
+    j.create_time = started_at
+    return j
+
+
+def test_expected_plot_s(history):
+    p = planner.Planner(history)
+    assert p.expected_plot_s('/mnt/tmp/fast') == sum(FAST.values())
+    assert p.expected_plot_s('/mnt/tmp/slow') == sum(SLOW.values())
+    assert p.fastest_tmpdir([], ['/mnt/tmp/slow', '/mnt/tmp/fast']) == '/mnt/tmp/fast'
+
+def test_plan_without_history(dir_cfg, sched_cfg):
+    p = planner.Planner(eta.PhaseHistory())
+    assert p.plan(dir_cfg, sched_cfg, []) is None
+
+def test_plan_follows_running_job(history, dir_cfg, sched_cfg):
+    now = time.time()
+    # Halfway through phase 3 on the fast tmpdir, reached just now.
+    j = running_job('/mnt/tmp/fast', (3, 3), now, now - 7000)
+    p = planner.Planner(history, horizon_s=6 * 3600)
+    plan = p.plan(dir_cfg, sched_cfg, [j], now)
+
+    # With a single job at a time, the next starts when this one is done,
+    # after 4 more subphases of phase 3 and phase 4, and goes to the fast
+    # tmpdir; then one every 9600 s.
+    assert plan[0].time == pytest.approx(now + FAST[3] * 4 / 7 + FAST[4], abs=2)
+    assert plan[0].tmpdir == '/mnt/tmp/fast'
+    assert all(start.tmpdir == '/mnt/tmp/fast' for start in plan)
+    assert len(plan) == 1 + int((now + 6 * 3600 - plan[0].time) / sum(FAST.values()))
+
+def test_plan_with_job_of_unknown_phase(history, dir_cfg, sched_cfg):
+    now = time.time()
+    j = running_job('/mnt/tmp/fast', (None, None), None, now - sum(FAST.values()) + 600)
+    p = planner.Planner(history, horizon_s=6 * 3600)
+    plan = p.plan(dir_cfg, sched_cfg, [j], now)
+    # Projected from its start, it is done in about 600 s.
+    assert plan[0].time == pytest.approx(now + 600, abs=2)
+
+def test_choose_tmpdir_prefers_throughput(history, dir_cfg, sched_cfg):
+    p = planner.Planner(history)
+    chooser = p.tmpdir_chooser(dir_cfg, sched_cfg)
+    assert chooser([], ['/mnt/tmp/slow', '/mnt/tmp/fast']) == '/mnt/tmp/fast'
+
+def test_choose_tmpdir_without_history(dir_cfg, sched_cfg):
+    p = planner.Planner(eta.PhaseHistory())
+    # Falls back to the default rule, which picks an eligible tmpdir.
+    assert p.choose_tmpdir(dir_cfg, sched_cfg, [], ['/mnt/tmp/slow', '/mnt/tmp/fast']) in dir_cfg.tmp
+    # Only among those eligible, e.g. not busy or full.
+    assert p.choose_tmpdir(dir_cfg, sched_cfg, [], ['/mnt/tmp/fast']) == '/mnt/tmp/fast'
@@ -0,0 +1,89 @@
+import psutil
+import pytest
+
+from plotman import configuration, job, priority
+
+
+class FakeProc:
+    '''Process whose priority may only be lowered, like an unprivileged one.'''
+    pid = 1234
+
+    def __init__(self, nice=15, ionice=(priority.IONICE_CLASSES['none'], 0)):
+        self._nice = nice
+        self._ionice = ionice
+        self.privileged = False
+
+    def nice(self, value=None):
+        if value is None:
+            return self._nice
+        if value < self._nice and not self.privileged:
+            raise psutil.AccessDenied(self.pid)
+        self._nice = value
+
+    def ionice(self, ioclass=None, value=None):
+        if ioclass is None:
+            return self._ionice
+        self._ionice = (ioclass, value or 0)
+
+def make_job(phase, proc):
+    j = job.Job.__new__(job.Job)
+    j.plot_id = '1234abcd' + '0' * 56
+    j.phase = phase
+    j.proc = proc
+    return j
+
+@pytest.fixture
+def policy():
+    return configuration.Priority(
+        phases={
+            3: configuration.PhasePriority(nice=10, ionice_class='best-effort', ionice_level=2),
+            4: configuration.PhasePriority(nice=5),
+        },
+        busy_nice=19)
+
+
+def test_phase_priority(policy):
+    assert priority.phase_priority(policy, 1) == configuration.PhasePriority(nice=15)
+    assert priority.phase_priority(policy, 4).nice == 5
+    assert priority.phase_priority(policy, 1, cpu_busy=True).nice == 19
+    # Only phase 1 is held back.
+    assert priority.phase_priority(policy, 3, cpu_busy=True).nice == 10
+    assert priority.phase_priority(None, 3) == configuration.PhasePriority(nice=15)
+
+def test_job_phase():
+    assert priority.job_phase(make_job((None, None), None)) == 1
+    assert priority.job_phase(make_job((3, 4), None)) == 3
+
+def test_apply_logs_changes(policy):
+    controller = priority.PriorityController(cpu_percent=lambda: 10.0)
+    proc = FakeProc(nice=0)
+    jobs = [make_job((3, 1), proc)]
+    assert controller.apply(policy, jobs) == [
+        '1234abcd (pid 1234, phase 3): nice 0 -> 10',
+        '1234abcd (pid 1234, phase 3): ionice none -> best-effort/2',
+    ]
+    assert proc.nice() == 10
+    assert controller.apply(policy, jobs) == []
+
+def test_apply_reports_denied_once(policy):
+    controller = priority.PriorityController(cpu_percent=lambda: 10.0)
+    proc = FakeProc(nice=15)
+    jobs = [make_job((4, 0), proc)]
+    assert controller.apply(policy, jobs) == ['1234abcd (pid 1234, phase 4): nice 15 -> 5 denied']
+    assert controller.apply(policy, jobs) == []
+    assert proc.nice() == 15
+
+def test_apply_holds_back_phase_1_when_busy(policy):
+    cpu_percent = [95.0]
+    controller = priority.PriorityController(cpu_percent=lambda: cpu_percent[0])
+    proc = FakeProc(nice=15)
+    proc.privileged = True
+    jobs = [make_job((1, 2), proc), make_job((None, None), None)]
+    assert controller.apply(policy, jobs) == ['1234abcd (pid 1234, phase 1): nice 15 -> 19']
+
+    cpu_percent[0] = 50.0
+    assert controller.apply(policy, jobs) == ['1234abcd (pid 1234, phase 1): nice 19 -> 15']
+
+def test_apply_without_policy():
+    controller = priority.PriorityController(cpu_percent=lambda: 100.0)
+    assert controller.apply(None, [make_job((1, 0), FakeProc(nice=0))]) == []
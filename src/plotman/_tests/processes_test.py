@@ -0,0 +1,34 @@
+from plotman import archive, configuration, discovery, processes
+from plotman._tests.discovery_test import PLOT_CMDLINE, FauxProcTree
+
+RSYNC_CMDLINE = ['rsync', '--bwlimit=80000', '--remove-source-files', '-P',
+                 '/d/0/plot-k32-a.plot', 'rsync://chia@farmer:12000/plots/000']
+
+
+def test_classify():
+    assert processes.classify(PLOT_CMDLINE) == processes.PLOT
+    assert processes.classify(RSYNC_CMDLINE) == processes.ARCHIVE
+    assert processes.classify(['/usr/bin/python3', '-m', 'plotman.transfer',
+                               '/d/0/plot-k32-a.plot', '/farm/000']) == processes.ARCHIVE
+    assert processes.classify(['/venv/bin/chia_harvester']) == processes.CHIA
+    assert processes.classify(['/usr/bin/python3', '/venv/bin/chia', 'start', 'farmer']) == processes.CHIA
+    assert processes.classify(['rsync', '-a', '/home', '/backup']) is None
+    assert processes.classify([]) is None
+
+def test_one_walk_for_all_views(tmp_path):
+    proc_tree = FauxProcTree(tmp_path)
+    proc_tree.add(10, PLOT_CMDLINE)
+    proc_tree.add(11, RSYNC_CMDLINE)
+    proc_tree.add(12, ['/venv/bin/chia_full_node'])
+    proc_tree.add(13, ['/usr/sbin/sshd', '-D'])
+    d = discovery.ProcessDiscovery(processes.classify, proc_root=str(tmp_path))
+
+    snapshot = d.snapshot()
+    assert [key.pid for key in snapshot.keys(processes.PLOT)] == [10]
+    assert [key.pid for key in snapshot.keys(processes.CHIA)] == [12]
+    assert d.snapshot(max_age_s=60) is snapshot
+
+    arch_cfg = configuration.Archive(rsyncd_path='/plots', rsyncd_module='plots',
+                                     rsyncd_host='farmer', rsyncd_user='chia')
+    assert archive.get_running_archive_transfers(arch_cfg, snapshot) == [
+        archive.ArchiveTransfer(11, ['/d/0/plot-k32-a.plot'], '/plots/000', 80000)]
@@ -2,7 +2,9 @@
 import os
 from unittest.mock import patch
 
-from plotman import reporting
+import psutil
+
+from plotman import job, reporting
 
 
 def test_phases_str_basic():
@@ -59,3 +61,34 @@ def test_job_viz_counts():
             ]
 
     assert(reporting.job_viz(jobs) == '1        2  .:;!  3 !     4 ')
+
+def test_status_report_samples_each_job_once(tmp_path, mocker):
+    j = job.Job.__new__(job.Job)
+    j.proc = psutil.Process()
+    j.create_time = j.proc.create_time()
+    j.tmpdir = str(tmp_path)
+    j.dstdir = str(tmp_path)
+    j.phase = (1, 2)
+    sample_metrics = mocker.spy(j, 'sample_metrics')
+    cpu_times = mocker.spy(j.proc, 'cpu_times')
+
+    report = reporting.status_report([j], 200)
+
+    assert str(j.proc.pid) in report
+    assert sample_metrics.call_count == 1
+    assert cpu_times.call_count == 1
+
+def test_status_report_shows_status_note(tmp_path):
+    j = job.Job.__new__(job.Job)
+    j.proc = psutil.Process()
+    j.create_time = j.proc.create_time()
+    j.tmpdir = str(tmp_path)
+    j.dstdir = str(tmp_path)
+    j.phase = (1, 2)
+
+    assert 'note' not in reporting.status_report([j], 200).splitlines()[0]
+
+    j.status_note = 'cpu 99%'
+    report = reporting.status_report([j], 200)
+    assert report.splitlines()[0].split()[-1] == 'note'
+    assert report.splitlines()[1].endswith('cpu 99%')
@@ -0,0 +1,136 @@
+import pytest
+
+from plotman import configuration, diskstats, eta, log_watcher, planner, priority, scheduler, throttle
+
+
+@pytest.fixture
+def sched_cfg():
+    return configuration.Scheduling(
+        global_max_jobs=4,
+        global_stagger_m=30,
+        polling_time_s=20,
+        tmpdir_stagger_phase_major=2,
+        tmpdir_stagger_phase_minor=1,
+        tmpdir_max_jobs=3
+    )
+
+class FauxJob:
+    def __init__(self, time_wall, logfile=''):
+        self.time_wall = time_wall
+        self.logfile = logfile
+
+    def get_time_wall(self):
+        return self.time_wall
+
+class FauxWatcher:
+    def __init__(self, results):
+        self.results = list(results)
+        self.timeouts = []
+
+    def poll(self, jobs, timeout=0):
+        self.timeouts.append(timeout)
+        if self.results:
+            return self.results.pop(0)
+        return ([], log_watcher.NO_ACTIVITY)
+
+    def closed_jobs(self, jobs, activity):
+        return [j for j in jobs if j.logfile in activity.closed]
+
+def change(old, new):
+    return log_watcher.PhaseChange(None, old, new)
+
+
+def test_next_decision_time_no_jobs(sched_cfg):
+    assert scheduler.next_decision_time([], sched_cfg, 1000) == 1020
+
+def test_next_decision_time_stagger(sched_cfg):
+    jobs = [FauxJob(30 * 60 - 5), FauxJob(5000)]
+    assert scheduler.next_decision_time(jobs, sched_cfg, 1000) == 1005
+
+def test_next_decision_time_stagger_passed(sched_cfg):
+    jobs = [FauxJob(30 * 60 + 5)]
+    assert scheduler.next_decision_time(jobs, sched_cfg, 1000) == 1020
+
+def test_crosses_milestone(sched_cfg):
+    assert scheduler.crosses_milestone(change((2, 0), (2, 1)), sched_cfg)
+    assert scheduler.crosses_milestone(change((None, None), (3, 2)), sched_cfg)
+    assert not scheduler.crosses_milestone(change((1, 6), (1, 7)), sched_cfg)
+    assert not scheduler.crosses_milestone(change((2, 1), (2, 2)), sched_cfg)
+
+def make_scheduler(sched_cfg, watcher):
+    s = scheduler.PlotScheduler.__new__(scheduler.PlotScheduler)
+    s.cfg = configuration.PlotmanConfig(
+        user_interface=None, directories=None, scheduling=sched_cfg, plotting=None)
+    s.config_path = None
+    s.config_mtime = None
+    s.watcher = watcher
+    s.jobs = [FauxJob(10, '/log/a.log')]
+    s.wait_reason = None
+    s.history = eta.PhaseHistory()
+    s.planner = planner.Planner(s.history)
+    s.disk_sampler = diskstats.DiskStatsSampler('/nonexistent')
+    s.priorities = priority.PriorityController()
+    s.throttle = throttle.Throttle('/nonexistent/throttle.json')
+    return s
+
+def test_wait_wakes_on_milestone(sched_cfg, mocker):
+    mocker.patch('time.time', return_value=1000)
+    watcher = FauxWatcher([
+        ([change((1, 6), (1, 7))], log_watcher.NO_ACTIVITY),
+        ([change((2, 0), (2, 1))], log_watcher.NO_ACTIVITY),
+    ])
+    s = make_scheduler(sched_cfg, watcher)
+    assert s.wait(1100) == 'phase milestone'
+    assert watcher.timeouts == [scheduler.CONFIG_CHECK_S] * 2
+
+def test_wait_wakes_on_job_exit(sched_cfg, mocker):
+    mocker.patch('time.time', return_value=1000)
+    # The closing of a logfile which doesn't belong to a known job doesn't count.
+    unknown = log_watcher.LogActivity(frozenset(), frozenset(['/log/b.log']), frozenset())
+    known = log_watcher.LogActivity(frozenset(), frozenset(['/log/a.log']), frozenset())
+    watcher = FauxWatcher([([], unknown), ([], known)])
+    s = make_scheduler(sched_cfg, watcher)
+    assert s.wait(1100) == 'job exit'
+    assert len(watcher.timeouts) == 2
+
+def test_wait_wakes_on_timer(sched_cfg, mocker):
+    mocker.patch('time.time', side_effect=[1000, 1002, 1003])
+    watcher = FauxWatcher([])
+    s = make_scheduler(sched_cfg, watcher)
+    assert s.wait(1003) == 'timer'
+    assert watcher.timeouts == [3, 1]
+
+def test_step_reports_wait_reason_once(sched_cfg, mocker, capsys):
+    mocker.patch('time.time', return_value=1000)
+    s = make_scheduler(sched_cfg, FauxWatcher([]))
+    mocker.patch.object(s, 'decide', return_value=([], 'stagger (10s/1800s)'))
+
+    assert s.step() == 1000 + 20
+    assert s.step() == 1000 + 20
+    assert capsys.readouterr().out == '...waiting: stagger (10s/1800s)\n'
+
+    # Nor when only its figures change.
+    s.decide.return_value = ([], 'stagger (600s/1800s)')
+    s.step()
+    assert capsys.readouterr().out == ''
+    s.decide.return_value = ([], 'max jobs (4)')
+    s.step()
+    assert capsys.readouterr().out == '...waiting: max jobs (4)\n'
+
+def test_reload_keeps_config_if_log_dir_unwatchable(sched_cfg, mocker, tmp_path, capsys):
+    config_path = tmp_path / 'plotman.yaml'
+    config_path.write_text('')
+    s = make_scheduler(sched_cfg, FauxWatcher([]))
+    s.cfg.directories = configuration.Directories(log='/log', tmp=['/t'], dst=['/d'])
+    s.config_path = str(config_path)
+    new_cfg = configuration.PlotmanConfig(
+        user_interface=None, scheduling=configuration.Scheduling(
+            global_max_jobs=1, global_stagger_m=1, polling_time_s=1,
+            tmpdir_stagger_phase_major=1, tmpdir_stagger_phase_minor=1,
+            tmpdir_max_jobs=1, log_watcher='bogus'),
+        directories=configuration.Directories(log=str(tmp_path), tmp=['/t'], dst=['/d']), plotting=None)
+    mocker.patch.object(configuration, 'get_validated_configs', return_value=new_cfg)
+
+    assert not s.reload_config_if_changed()
+    assert s.cfg.scheduling is sched_cfg
+    assert capsys.readouterr().out.startswith('...ignoring changed config: unknown log watcher backend')
@@ -0,0 +1,74 @@
+import importlib.resources
+import random
+
+import pytest
+
+from plotman import configuration, eta, simulator
+from plotman._tests import resources
+
+HOUR_PHASES = {1: 3600, 2: 3600, 3: 3600, 4: 3600}
+
+
+@pytest.fixture
+def dir_cfg():
+    return configuration.Directories(
+        log='/plots/log',
+        tmp=['/mnt/tmp/00', '/mnt/tmp/01'],
+        dst=['/mnt/dst/00'])
+
+@pytest.fixture
+def sched_cfg():
+    return configuration.Scheduling(
+        global_max_jobs=4,
+        global_stagger_m=0,
+        polling_time_s=20,
+        tmpdir_max_jobs=1,
+        tmpdir_stagger_phase_major=2,
+        tmpdir_stagger_phase_minor=1)
+
+
+def test_phase_milestones():
+    milestones = list(simulator.phase_milestones(100, HOUR_PHASES))
+    assert milestones[0] == (100 + 450, (1, 1))
+    assert milestones[-1] == (100 + 4 * 3600, eta.DONE)
+    assert [ph for (_, ph) in milestones] == sorted(ph for (_, ph) in milestones)
+    assert len(milestones) == sum(eta.N_SUBPHASES.values())
+
+def test_simulation_back_to_back(dir_cfg, sched_cfg):
+    sched_cfg.batch_admission = True
+    sim = simulator.Simulation(dir_cfg, sched_cfg, lambda tmpdir: HOUR_PHASES)
+    result = sim.run(simulator.DAY)
+
+    # One 4 hour job at a time on each tmp dir, started as soon as the last ends.
+    assert result.plots == 2 * 6
+    assert result.peak_jobs == 2
+    assert result.idle_frac_by_tmpdir == { '/mnt/tmp/00': 0.0, '/mnt/tmp/01': 0.0 }
+
+def test_simulation_global_stagger(dir_cfg, sched_cfg):
+    sched_cfg.global_stagger_m = 3 * 60
+    sim = simulator.Simulation(dir_cfg, sched_cfg, lambda tmpdir: HOUR_PHASES)
+    result = sim.run(simulator.DAY)
+
+    # A job every 3 hours, alternating between the tmp dirs, each of which
+    # then sits idle for 2 hours out of 6.
+    assert result.plots == 7
+    assert result.peak_jobs == 2
+    for idle_frac in result.idle_frac_by_tmpdir.values():
+        assert idle_frac == pytest.approx(1 / 3, abs=0.05)
+
+def test_simulate_from_history(dir_cfg, sched_cfg, tmp_path):
+    log_contents = importlib.resources.read_binary(resources, '2021-04-04-19:00:47.log')
+    tmp_path.joinpath('done.log').write_bytes(log_contents)
+    history = eta.PhaseHistory()
+    history.load_logdir(str(tmp_path))
+
+    random.seed(1)
+    expected = random.random()
+    random.seed(1)
+    result = simulator.simulate(dir_cfg, sched_cfg, history, days=10, seed=0)
+    # The seed is the simulation's own.
+    assert random.random() == expected
+    assert simulator.simulate(dir_cfg, sched_cfg, history, days=10, seed=0) == result
+    # The sample plot took 39945 seconds.
+    assert result.plots == 2 * int(10 * simulator.DAY / 39945)
+    assert 'plots/day' in simulator.result_report(result)
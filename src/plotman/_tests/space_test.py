@@ -0,0 +1,124 @@
+import pytest
+
+from plotman import configuration, job, manager, space
+from plotman.space import GIB
+
+
+class FakeUsage:
+    '''A job's bytes written so far, by dir.'''
+    def __init__(self, usage):
+        self.usage = usage
+
+    def plot_bytes(self, d, plot_id):
+        return self.usage.get(d, 0)
+
+def make_job(tmpdir, dstdir, k=32, tmp2dir='', phase=(1, 0)):
+    j = job.Job.__new__(job.Job)
+    j.phase = phase
+    j.tmpdir = tmpdir
+    j.tmp2dir = tmp2dir
+    j.dstdir = dstdir
+    j.k = k
+    j.plot_id = 'f' * 64
+    return j
+
+def make_ledger(free_gib, usage=None):
+    '''A ledger for k32 jobs over fake dirs: /mnt/tmp/NN and /mnt/dst/NN
+       are on device NN, and free_gib maps a device to its free space.'''
+    ledger = space.SpaceLedger(32, usage_cache=FakeUsage(usage or {}))
+    ledger.device = lambda d: int(d[-2:]) if d.startswith('/mnt/') else None
+    ledger.free = { dev: gib * GIB for (dev, gib) in free_gib.items() }
+    return ledger
+
+
+def test_plot_sizes():
+    assert space.plot_bytes(32) == int(101.4 * GIB)
+    assert space.tmp_peak_bytes(32) == 239 * GIB
+    # Scaled from k32 where not tabulated
+    assert space.plot_bytes(36) == int(space.plot_bytes(32) * 16 * 36 / 32)
+    assert space.job_k(make_job('/t', '/d', k=0)) == space.DEFAULT_K
+    assert space.job_k(make_job('/t', '/d', k='33')) == 33
+
+def test_reserved_bytes():
+    ledger = make_ledger({})
+    jobs = [make_job('/mnt/tmp/00', '/mnt/dst/01'),
+            make_job('/mnt/tmp/00', '/mnt/dst/01', tmp2dir='/mnt/tmp/02')]
+    assert ledger.reserved_bytes(jobs) == {
+        0: 2 * 239 * GIB,
+        1: 2 * space.plot_bytes(32),
+        2: space.plot_bytes(32) }
+
+def test_reserved_bytes_less_written():
+    ledger = make_ledger({}, { '/mnt/tmp/00': 200 * GIB, '/mnt/dst/01': 300 * GIB })
+    jobs = [make_job('/mnt/tmp/00', '/mnt/dst/01')]
+    # Nothing left to write to dst, but no credit for more than a plot.
+    assert ledger.reserved_bytes(jobs) == { 0: 39 * GIB, 1: 0 }
+
+def test_no_tmp_reserved_past_peak():
+    ledger = make_ledger({ 0: 512 }, { '/mnt/tmp/00': 100 * GIB })
+    jobs = [make_job('/mnt/tmp/00', '/mnt/dst/01', phase=(3, 2)),
+            make_job('/mnt/tmp/00', '/mnt/dst/01', phase=(2, 4))]
+    assert ledger.reserved_bytes(jobs).get(0, 0) == 0
+    assert ledger.fits(jobs, ledger.new_job_needs('/mnt/tmp/00'))
+
+    jobs.append(make_job('/mnt/tmp/00', '/mnt/dst/01', phase=(None, None)))
+    assert ledger.reserved_bytes(jobs)[0] == 139 * GIB
+
+def test_headroom():
+    ledger = make_ledger({ 0: 1000, 1: 500 })
+    jobs = [make_job('/mnt/tmp/00', '/mnt/dst/01')]
+    assert ledger.headroom('/mnt/tmp/00', jobs) == 761 * GIB
+    assert ledger.headroom('/mnt/dst/01', jobs) == 500 * GIB - space.plot_bytes(32)
+    assert ledger.headroom('/missing', jobs) is None
+
+def test_fits():
+    ledger = make_ledger({ 0: 500, 1: 150 })
+    jobs = [make_job('/mnt/tmp/00', '/mnt/dst/01')]
+    assert ledger.fits([], ledger.new_job_needs('/mnt/tmp/00', '/mnt/dst/01'))
+    # 261 GiB left on tmp, but a second plot won't fit on the dst.
+    assert ledger.fits(jobs, ledger.new_job_needs('/mnt/tmp/00'))
+    assert not ledger.fits(jobs, ledger.new_job_needs('/mnt/tmp/00', '/mnt/dst/01'))
+    # Needs on one device add up.
+    assert not ledger.fits([], ledger.new_job_needs('/mnt/tmp/01', '/mnt/dst/01'))
+    # Missing dirs are not ours to judge.
+    assert ledger.fits(jobs, ledger.new_job_needs('/missing', '/missing'))
+
+@pytest.fixture
+def sched_cfg():
+    return configuration.Scheduling(
+        global_max_jobs=4,
+        global_stagger_m=0,
+        polling_time_s=20,
+        tmpdir_max_jobs=2,
+        tmpdir_stagger_phase_major=2,
+        tmpdir_stagger_phase_minor=1)
+
+@pytest.fixture
+def dir_cfg():
+    return configuration.Directories(
+        log='/plots/log',
+        tmp=['/mnt/tmp/00', '/mnt/tmp/01'],
+        dst=['/mnt/dst/02', '/mnt/dst/03'])
+
+def test_select_new_plot_skips_full_dirs(sched_cfg, dir_cfg):
+    ledger = make_ledger({ 0: 1000, 1: 200, 2: 1000, 3: 50 })
+    for _ in range(10):
+        assert (manager.select_new_plot(dir_cfg, sched_cfg, [], space_ledger=ledger) ==
+                ('/mnt/tmp/00', '/mnt/dst/02', None))
+
+def test_select_new_plot_waits_for_space(sched_cfg, dir_cfg):
+    ledger = make_ledger({ 0: 300, 1: 200, 2: 150, 3: 50 })
+    assert (manager.select_new_plot(dir_cfg, sched_cfg, [], space_ledger=ledger) ==
+            ('/mnt/tmp/00', '/mnt/dst/02', None))
+
+    # The running job, still in phase 1, will fill both the tmp and the dst dir.
+    sched_cfg.tmpdir_stagger_phase_limit = 2
+    jobs = [manager.PendingJob('/mnt/tmp/00', '/mnt/dst/02', '/plots/log/x.log', k=32)]
+    jobs[0].start_time -= 3600
+    jobs[0].progress = lambda: (1, 5)
+    assert (manager.select_new_plot(dir_cfg, sched_cfg, jobs, space_ledger=ledger) ==
+            (None, None, 'no tmp space'))
+
+    ledger.free[0] = 1000 * GIB
+    assert (manager.select_new_plot(dir_cfg, sched_cfg, jobs, space_ledger=ledger) ==
+            (None, None, 'no dst space'))
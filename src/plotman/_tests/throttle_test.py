@@ -0,0 +1,160 @@
+import collections
+
+import pytest
+
+from plotman import configuration, discovery, diskstats, job, throttle
+from plotman._tests.helpers import FakeClock
+
+
+class FakeProc:
+    def __init__(self):
+        self.suspended = False
+
+    def suspend(self):
+        self.suspended = True
+
+    def resume(self):
+        self.suspended = False
+
+class FakeSampler:
+    '''/mnt/<device>/... dirs are on <device>, with the given utilizations.'''
+    def __init__(self, utilization):
+        self.utilization = utilization
+
+    def device(self, d):
+        return d.split('/')[2]
+
+    def load(self, d):
+        u = self.utilization.get(self.device(d))
+        return None if u is None else diskstats.DeviceLoad(u, 1.0, 1, 0.0, 0.0)
+
+def make_job(pid, phase, tmpdir='/mnt/ssd0/tmp', dstdir='/mnt/hdd0/dst'):
+    j = job.Job.__new__(job.Job)
+    j.proc = FakeProc()
+    j.process_key = discovery.ProcessKey(pid, 1617559247.5)
+    j.plot_id = '%08x' % pid + '0' * 56
+    j.phase = phase
+    j.tmpdir = tmpdir
+    j.dstdir = dstdir
+    return j
+
+@pytest.fixture
+def state_path(tmp_path):
+    return str(tmp_path / 'plotman' / 'throttle.json')
+
+def make_throttle(state_path, cpu):
+    clock = FakeClock()
+    return (throttle.Throttle(state_path, cpu_percent=lambda: cpu[0], clock=clock), clock)
+
+
+def test_cpu_suspend_and_resume_with_hysteresis(state_path):
+    cfg = configuration.Throttling(suspend_cpu_percent=95, resume_cpu_percent=70, min_suspend_s=60)
+    cpu = [99.0]
+    (t, clock) = make_throttle(state_path, cpu)
+    jobs = [make_job(1, (3, 2)), make_job(2, (1, 4)), make_job(3, (2, 1))]
+    sampler = FakeSampler({})
+
+    assert t.apply(cfg, jobs, sampler) == ['Suspended 00000002: cpu 99%']
+    assert jobs[1].proc.suspended
+    assert jobs[1].status_note == 'cpu 99%'
+
+    # Still busy: one more per pass, but never the last one running.
+    assert t.apply(cfg, jobs, sampler) == ['Suspended 00000003: cpu 99%']
+    assert t.apply(cfg, jobs, sampler) == []
+    assert not jobs[0].proc.suspended
+
+    # Between the thresholds nothing changes, and below the resume one jobs
+    # come back one at a time, once they've been suspended long enough.
+    cpu[0] = 80.0
+    clock.now += 120
+    assert t.apply(cfg, jobs, sampler) == []
+    cpu[0] = 50.0
+    assert t.apply(cfg, jobs, sampler) == ['Resumed 00000003 after cpu 99%']
+    assert t.apply(cfg, jobs, sampler) == ['Resumed 00000002 after cpu 99%']
+    assert not any(j.proc.suspended for j in jobs)
+    assert jobs[1].status_note == ''
+
+def test_min_suspend_time(state_path):
+    cfg = configuration.Throttling(suspend_cpu_percent=95, min_suspend_s=60)
+    cpu = [99.0]
+    (t, clock) = make_throttle(state_path, cpu)
+    jobs = [make_job(1, (3, 2)), make_job(2, (1, 4))]
+    t.apply(cfg, jobs, FakeSampler({}))
+
+    cpu[0] = 10.0
+    clock.now += 30
+    assert t.apply(cfg, jobs, FakeSampler({})) == []
+    clock.now += 30
+    assert t.apply(cfg, jobs, FakeSampler({})) == ['Resumed 00000002 after cpu 99%']
+
+def test_device_contention(state_path):
+    cfg = configuration.Throttling(suspend_device_utilization=0.9, resume_device_utilization=0.5,
+                                   min_suspend_s=0)
+    (t, _) = make_throttle(state_path, [0.0])
+    jobs = [make_job(1, (1, 2), tmpdir='/mnt/ssd0/a'), make_job(2, (1, 6), tmpdir='/mnt/ssd0/b'),
+            make_job(3, (1, 1), tmpdir='/mnt/ssd1/a')]
+    sampler = FakeSampler({ 'ssd0': 0.97, 'ssd1': 0.99 })
+
+    # ssd1 has only one job, which suspending would not help.
+    assert t.apply(cfg, jobs, sampler) == ['Suspended 00000001: tmp device 97% busy']
+
+    sampler.utilization['ssd0'] = 0.7
+    assert t.apply(cfg, jobs, sampler) == []
+    sampler.utilization['ssd0'] = 0.3
+    assert t.apply(cfg, jobs, sampler) == ['Resumed 00000001 after tmp device 97% busy']
+
+def test_dst_copy(state_path):
+    cfg = configuration.Throttling(suspend_for_dst_copy=True, min_suspend_s=0)
+    (t, _) = make_throttle(state_path, [0.0])
+    copying = make_job(1, (4, 0), dstdir='/mnt/hdd0/dst')
+    # Plots on the disk the other job's plot is about to be copied to.
+    victim = make_job(2, (1, 3), tmpdir='/mnt/hdd0/tmp')
+    bystander = make_job(3, (1, 2), tmpdir='/mnt/ssd0/tmp')
+    jobs = [copying, victim, bystander]
+
+    assert t.apply(cfg, jobs, FakeSampler({})) == ['Suspended 00000002: dst copy to /mnt/hdd0/dst']
+    assert t.apply(cfg, jobs, FakeSampler({})) == []
+
+    # The copying job is done.
+    jobs.remove(copying)
+    assert t.apply(cfg, jobs, FakeSampler({})) == [
+        'Resumed 00000002 after dst copy to /mnt/hdd0/dst']
+
+def test_state_survives_restart(state_path):
+    cfg = configuration.Throttling(suspend_cpu_percent=95, min_suspend_s=0)
+    (t, _) = make_throttle(state_path, [99.0])
+    jobs = [make_job(1, (3, 2)), make_job(2, (1, 4))]
+    t.apply(cfg, jobs, FakeSampler({}))
+
+    # Another process reports why.
+    fresh = [make_job(1, (3, 2)), make_job(2, (1, 4))]
+    throttle.load_notes(fresh, state_path)
+    assert [j.status_note for j in fresh] == ['', 'cpu 99%']
+
+    # A restarted plotman with throttling turned off resumes the job.
+    (t, _) = make_throttle(state_path, [99.0])
+    assert t.apply(None, jobs, FakeSampler({})) == ['Resumed 00000002 after cpu 99%']
+    assert throttle.load_state(state_path) == {}
+
+def test_forgets_exited_jobs(state_path):
+    cfg = configuration.Throttling(suspend_cpu_percent=95)
+    (t, _) = make_throttle(state_path, [99.0])
+    jobs = [make_job(1, (3, 2)), make_job(2, (1, 4))]
+    t.apply(cfg, jobs, FakeSampler({}))
+    assert list(t.suspended) == [jobs[1].process_key]
+
+    t.apply(cfg, jobs[:1], FakeSampler({}))
+    assert t.suspended == {}
+
+def test_cpu_percent_is_per_caller():
+    Times = collections.namedtuple('Times', ['user', 'system', 'idle', 'iowait'])
+    samples = iter([Times(0, 0, 0, 0), Times(0, 0, 0, 0),
+                    Times(90, 0, 10, 0), Times(90, 0, 10, 0),
+                    Times(90, 0, 30, 20)])
+    cpu_times = lambda: next(samples)
+    (a, b) = (throttle.CpuPercent(cpu_times), throttle.CpuPercent(cpu_times))
+
+    # Back to back in the same pass, both see the whole interval.
+    assert a() == 90.0
+    assert b() == 90.0
+    assert a() == 0.0
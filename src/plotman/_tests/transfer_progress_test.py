@@ -0,0 +1,128 @@
+import json
+
+import pytest
+
+from plotman import archive, reporting, transfer, transfer_progress
+
+
+RSYNC_OUTPUT = (
+    'plot-k32-a.plot\n'
+    '         32,768   0%    0.00kB/s    0:00:00  \r'
+    '  1,073,741,824   1%  100.00MB/s    0:17:12  \r'
+    ' 54,760,833,024  50%  110.50MB/s    0:07:36  ')
+
+
+def test_parse_rsync_progress():
+    assert transfer_progress.parse_progress(RSYNC_OUTPUT) == transfer_progress.Progress(
+        54760833024, 50, 110.5 * 2**20, 456)
+    assert transfer_progress.parse_progress('sending incremental file list\n') is None
+
+def test_parse_native_progress():
+    line = transfer.progress_line(2**30, 4 * 2**30, 100 * 2**20)
+    assert transfer_progress.parse_progress(line + '\n') == transfer_progress.Progress(
+        2**30, 25, 100 * 2**20, 30)
+
+@pytest.fixture
+def running(tmp_path, mocker):
+    plot = tmp_path / 'dst' / 'plot-k32-a.plot'
+    plot.parent.mkdir()
+    plot.write_bytes(b'\0' * 1000)
+    progress_dir = tmp_path / 'transfers'
+    progress_dir.mkdir()
+    (progress_dir / 'plot-k32-a.plot.progress').write_text(
+        '            400  40%    0.01kB/s    0:00:05  ')
+    mocker.patch('psutil.Process').return_value.create_time.return_value = 900.0
+    return (archive.ArchiveTransfer(10, [str(plot)], '/plotdir/000'), plot, str(progress_dir))
+
+def test_transfer_stats(running):
+    (t, plot, progress_dir) = running
+    s = transfer_progress.transfer_stats(t, progress_dir, now=1000.0)
+    assert (s.bytes, s.size, s.average_bytes_s, s.elapsed_s) == (400, 1000, 4.0, 100.0)
+    assert s.eta_s == int(600 / 10.24)
+
+    report = reporting.transfer_report([s], 120, str(plot.parent), '/plotdir')
+    assert report.splitlines()[1].split() == [
+        '10', plot.name, '000', '0.0', '40', '0.0', '0.0', '0:01:40', '0:00:58']
+
+def test_transfer_stats_of_batch(running, tmp_path):
+    (t, plot_a, progress_dir) = running
+    plot_b = plot_a.with_name('plot-k32-b.plot')
+    plot_b.write_bytes(b'\0' * 1000)
+    t = t._replace(plots=[str(plot_a), str(plot_b)])
+    sizes = {}
+    s = transfer_progress.transfer_stats(t, progress_dir, now=1000.0, sizes=sizes)
+    assert (s.plot, s.bytes, s.size) == (str(plot_a), 400, 2000)
+
+    # Sent, the first plot is removed, and the next goes on in the same
+    # progress file.
+    plot_a.unlink()
+    (tmp_path / 'transfers' / 'plot-k32-a.plot.progress').write_text(
+        '           1000 100%    0.01kB/s    0:00:00  \r'
+        '            200  20%    0.01kB/s    0:00:05  ')
+    s = transfer_progress.transfer_stats(t, progress_dir, now=1000.0, sizes=sizes)
+    assert (s.plot, s.bytes, s.size, s.average_bytes_s) == (str(plot_b), 1200, 2000, 12.0)
+    assert s.eta_s == int(800 / 10.24)
+    assert not transfer_progress.history_record(s, 1000.0)['complete']
+
+    # Without the sizes seen, a plot sent is taken to be as big as the others.
+    assert transfer_progress.transfer_stats(t, progress_dir, now=1000.0).size == 2000
+
+    plot_b.unlink()
+    s = transfer_progress.transfer_stats(t, progress_dir, now=1000.0, sizes=sizes)
+    assert (s.plot, s.bytes, s.size) == (str(plot_b), 2000, 2000)
+    assert transfer_progress.history_record(s, 1000.0)['complete']
+
+def test_monitor_records_history(running, tmp_path, mocker):
+    (t, plot, progress_dir) = running
+    history_path = str(tmp_path / 'history.jsonl')
+    monitor = transfer_progress.TransferMonitor(
+        progress_dir=progress_dir, history_path=history_path, clock=lambda: 1000.0)
+    monitor.watch([t])
+    monitor.poll()
+    assert [s.pid for s in monitor.stats()] == [10]
+
+    # Restarted with a new pid: the same transfer goes on, timed from its
+    # first start.
+    mocker.patch('psutil.Process').return_value.create_time.return_value = 990.0
+    monitor.watch([t._replace(pid=11)])
+    monitor.poll()
+    assert not (tmp_path / 'history.jsonl').exists()
+    assert monitor.stats()[0].elapsed_s == 100.0
+
+    plot.unlink()
+    monitor.watch([])
+    monitor.poll()
+    with open(history_path) as f:
+        assert [json.loads(line) for line in f] == [{
+            'finished': 1000.0, 'plots': [str(plot)], 'archdir': '/plotdir/000', 'bytes': 1000,
+            'seconds': 100.0, 'average_mb_s': 0.0, 'complete': True }]
+    assert monitor.stats() == []
+
+def test_monitor_follows_restarted_batch(running, tmp_path, mocker):
+    (t, plot_a, progress_dir) = running
+    plot_b = plot_a.with_name('plot-k32-b.plot')
+    plot_b.write_bytes(b'\0' * 1000)
+    history_path = str(tmp_path / 'history.jsonl')
+    monitor = transfer_progress.TransferMonitor(
+        progress_dir=progress_dir, history_path=history_path, clock=lambda: 1000.0)
+    monitor.watch([t._replace(plots=[str(plot_a), str(plot_b)])])
+    monitor.poll()
+
+    # Restarted with only the plot not sent yet.
+    plot_a.unlink()
+    (tmp_path / 'transfers' / 'plot-k32-b.plot.progress').write_text(
+        '            500  50%    0.01kB/s    0:00:05  ')
+    mocker.patch('psutil.Process').return_value.create_time.return_value = 990.0
+    monitor.watch([t._replace(pid=11, plots=[str(plot_b)])])
+    monitor.poll()
+    [s] = monitor.stats()
+    assert (s.plot, s.bytes, s.size, s.elapsed_s) == (str(plot_b), 1500, 2000, 100.0)
+
+    plot_b.unlink()
+    monitor.watch([])
+    monitor.poll()
+    with open(history_path) as f:
+        [record] = [json.loads(line) for line in f]
+    assert (record['plots'], record['bytes'], record['complete']) == (
+        [str(plot_a), str(plot_b)], 2000, True)
+    assert list((tmp_path / 'transfers').iterdir()) == []
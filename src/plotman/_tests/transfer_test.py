@@ -0,0 +1,125 @@
+import errno
+import os
+
+import pytest
+
+from plotman import transfer
+
+
+@pytest.fixture
+def plot(tmp_path):
+    (tmp_path / 'dst').mkdir()
+    (tmp_path / 'arch').mkdir()
+    path = tmp_path / 'dst' / 'plot-k32-a.plot'
+    path.write_bytes(bytes(range(256)) * 1000)
+    return path
+
+def test_copy(plot, tmp_path):
+    t = transfer.LocalTransfer(str(plot), str(tmp_path / 'arch'), chunk_bytes=4096)
+    seen = []
+    t.run(progress=lambda t: seen.append(t.bytes_done))
+
+    assert (tmp_path / 'arch' / plot.name).read_bytes() == plot.read_bytes()
+    assert os.listdir(str(tmp_path / 'arch')) == [plot.name]
+    assert seen[0] == 4096 and seen[-1] == 256000
+    assert t.method in transfer.COPY_METHODS
+
+def test_same_filesystem_is_renamed(plot, tmp_path):
+    data = plot.read_bytes()
+    t = transfer.LocalTransfer(str(plot), str(tmp_path / 'arch'))
+    t.run(remove_source=True)
+
+    assert t.method == 'rename'
+    assert not plot.exists()
+    assert (tmp_path / 'arch' / plot.name).read_bytes() == data
+
+def test_falls_back_to_next_method(plot, tmp_path, mocker):
+    real_copy_chunk = transfer.copy_chunk
+
+    def copy_chunk(method, *args):
+        if method != 'read':
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        return real_copy_chunk(method, *args)
+
+    mocker.patch.object(transfer, 'copy_chunk', side_effect=copy_chunk)
+    t = transfer.LocalTransfer(str(plot), str(tmp_path / 'arch'))
+    t.run()
+    assert t.method == 'read'
+    assert (tmp_path / 'arch' / plot.name).read_bytes() == plot.read_bytes()
+
+def test_failed_copy_cleans_up(plot, tmp_path, mocker):
+    mocker.patch.object(transfer, 'copy_chunk', side_effect=OSError(errno.ENOSPC, 'No space'))
+    t = transfer.LocalTransfer(str(plot), str(tmp_path / 'arch'))
+    with pytest.raises(OSError):
+        t.copy()
+    assert plot.exists()
+    assert os.listdir(str(tmp_path / 'arch')) == []
+
+def test_bwlimit(plot, tmp_path, mocker):
+    sleep = mocker.patch('time.sleep')
+    t = transfer.LocalTransfer(str(plot), str(tmp_path / 'arch'), bwlimit=100, clock=lambda: 0.0)
+    t.started = 0.0
+    t.bytes_done = 102400
+    t.limit_rate()
+    sleep.assert_called_once_with(1.0)
+
+def test_bwlimit_file(plot, tmp_path, mocker):
+    sleep = mocker.patch('time.sleep')
+    bwlimit_file = tmp_path / 'bwlimit.json'
+    bwlimit_file.write_text('{"%s": 50}' % plot.parent)
+    clock = [0.0]
+    t = transfer.LocalTransfer(str(plot), str(tmp_path / 'arch'), bwlimit=100,
+                               bwlimit_file=str(bwlimit_file), clock=lambda: clock[0])
+    t.started = 0.0
+    clock[0] = 10.0
+    t.bytes_done = 1024000
+    t.limit_rate()
+    assert t.bwlimit == 50
+    sleep.assert_not_called()
+
+    # The new limit counts from when it was read.
+    t.bytes_done += 102400
+    t.limit_rate()
+    sleep.assert_called_once_with(2.0)
+
+def test_main_logs_throughput(plot, tmp_path, capsys):
+    log = tmp_path / 'log' / 'archive.log'
+    transfer.main(['--remove-source-files', '--log', str(log), str(plot), str(tmp_path / 'arch')])
+
+    assert not plot.exists()
+    (line,) = log.read_text().splitlines()
+    assert '%s -> %s: 0.0 GiB in 0s' % (plot, tmp_path / 'arch') in line
+    assert line.endswith('(rename)')
+    assert capsys.readouterr().out.strip().endswith(line)
+
+def test_interrupted_copy_resumes(plot, tmp_path, mocker):
+    real_copy_chunk = transfer.copy_chunk
+    calls = []
+
+    def copy_chunk(*args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return real_copy_chunk(*args)
+
+    mocker.patch.object(transfer, 'copy_chunk', side_effect=copy_chunk)
+    t = transfer.LocalTransfer(str(plot), str(tmp_path / 'arch'), chunk_bytes=4096,
+                               checkpoint_bytes=8192)
+    with pytest.raises(KeyboardInterrupt):
+        t.copy()
+    assert (tmp_path / 'arch' / '.plot-k32-a.plot.tmp.checkpoint').read_text() == '8192'
+
+    mocker.patch.object(transfer, 'copy_chunk', side_effect=real_copy_chunk)
+    t = transfer.LocalTransfer(str(plot), str(tmp_path / 'arch'), chunk_bytes=4096)
+    t.copy()
+    assert t.resumed_from == 8192
+    assert (tmp_path / 'arch' / plot.name).read_bytes() == plot.read_bytes()
+    assert os.listdir(str(tmp_path / 'arch')) == [plot.name]
+
+def test_main_archives_several_plots(plot, tmp_path):
+    other = plot.parent / 'plot-k32-b.plot'
+    other.write_bytes(b'b' * 1000)
+    transfer.main(['--remove-source-files', str(plot), str(other), str(tmp_path / 'arch')])
+
+    assert not plot.exists() and not other.exists()
+    assert sorted(os.listdir(str(tmp_path / 'arch'))) == [plot.name, other.name]
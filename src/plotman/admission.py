@@ -0,0 +1,78 @@
+'''CPU and memory admission control for new plot jobs.
+
+Each `chia plots create` job is started with a thread count (-r) and a
+buffer size in MiB (-b).  Before starting another, check that the host has
+the cores and the memory for it on top of the running jobs':
+
+* threads: the -r of all running jobs plus the new one must not exceed the
+  host's CPUs times scheduling.cpu_oversubscription.
+* memory: MemAvailable, less the part of running jobs' buffers they have
+  not touched yet (and so may still grow into), must cover the new job's
+  buffer.'''
+
+import os
+
+import psutil
+
+MEMINFO_PATH = '/proc/meminfo'
+
+MIB = 2 ** 20
+
+# What chia uses when -r or -b are not on the command line.
+CHIA_DEFAULT_THREADS = 2
+CHIA_DEFAULT_BUFFER_MIB = 3389
+
+
+def host_cpus():
+    '''Number of CPUs this process (and so the jobs it starts) may run on.'''
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def mem_available_bytes(meminfo_path=MEMINFO_PATH):
+    '''The kernel's estimate of memory available for new work.'''
+    try:
+        with open(meminfo_path, 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+    return psutil.virtual_memory().available
+
+def job_threads(j):
+    return int(j.r) if j.r else CHIA_DEFAULT_THREADS
+
+def job_buffer_bytes(j):
+    return (int(j.b) if j.b else CHIA_DEFAULT_BUFFER_MIB) * MIB
+
+def job_rss_bytes(j):
+    '''Resident memory of a running job, 0 if unknown (e.g. a job which has
+       only just been started).'''
+    proc = getattr(j, 'proc', None)
+    if proc is None:
+        return 0
+    try:
+        return proc.memory_info().rss
+    except psutil.Error:
+        return 0
+
+def check(jobs, sched_cfg, plotting_cfg, cpus=None, mem_available=None):
+    '''Return why a new job with plotting_cfg's -r and -b may not start on
+       top of jobs, or None if it may.'''
+    cpus = host_cpus() if cpus is None else cpus
+    max_threads = int(cpus * sched_cfg.cpu_oversubscription)
+    committed_threads = sum(job_threads(j) for j in jobs)
+    if committed_threads + plotting_cfg.n_threads > max_threads:
+        return 'cpu (%d+%d/%d threads)' % (
+            committed_threads, plotting_cfg.n_threads, max_threads)
+
+    mem_available = mem_available_bytes() if mem_available is None else mem_available
+    untouched = sum(max(0, job_buffer_bytes(j) - job_rss_bytes(j)) for j in jobs)
+    headroom = mem_available - untouched
+    needed = plotting_cfg.job_buffer * MIB
+    if headroom < needed:
+        return 'memory (need %d MiB, %d MiB free)' % (
+            needed // MIB, max(0, headroom) // MIB)
+
+    return None
@@ -1,11 +1,10 @@
 import os
-import re
 import statistics
 import sys
 
 import texttable as tt
 
-from plotman import plot_util
+from plotman import log_parser, plot_util
 
 
 def analyze(logfilenames, clipterminals, bytmp, bybitfield):
@@ -19,50 +18,44 @@ def analyze(logfilenames, clipterminals, bytmp, bybitfield):
             n_uniform = 0
             is_first_last = False
 
-            # Read the logfile, triggering various behaviors on various
-            # regex matches.
-            for line in f:
+            # Read the logfile, triggering various behaviors on the various
+            # events logged in it.
+            for event in log_parser.parse_lines(f):
                 # Beginning of plot job.  We may encounter this multiple
                 # times, if a job was run with -n > 1.  Sample log line:
                 # 2021-04-08T13:33:43.542  chia.plotting.create_plots       : INFO     Starting plot 1/5
-                m = re.search(r'Starting plot (\d*)/(\d*)', line)
-                if m:
+                if isinstance(event, log_parser.PlotStarted):
                     # (re)-initialize data structures
                     sl = 'x'         # Slice key
                     phase_time = {}  # Map from phase index to time
                     n_sorts = 0
                     n_uniform = 0
 
-                    seq_num = int(m.group(1))
-                    seq_total = int(m.group(2))
-                    is_first_last = seq_num == 1 or seq_num == seq_total
+                    is_first_last = event.seq_num == 1 or event.seq_num == event.seq_total
 
                 # Temp dirs.  Sample log line:
                 # Starting plotting progress into temporary dirs: /mnt/tmp/01 and /mnt/tmp/a
-                m = re.search(r'^Starting plotting.*dirs: (.*) and (.*)', line)
-                if m:
+                elif isinstance(event, log_parser.TmpDirs):
                     # Record tmpdir, if slicing by it
                     if bytmp:
-                        tmpdir = m.group(1)
-                        sl += '-' + tmpdir
+                        sl += '-' + event.tmpdir
 
                 # Bitfield marker.  Sample log line(s):
                 # Starting phase 2/4: Backpropagation without bitfield into tmp files... Mon Mar  1 03:56:11 2021
                 #   or
                 # Starting phase 2/4: Backpropagation into tmp files... Fri Apr  2 03:17:32 2021
-                m = re.search(r'^Starting phase 2/4: Backpropagation', line)
-                if bybitfield and m:
-                    if 'without bitfield' in line:
-                        sl += '-nobitfield'
-                    else:
-                        sl += '-bitfield'
+                elif isinstance(event, log_parser.PhaseStarted):
+                    description = event.description or ''
+                    if bybitfield and event.phase == 2 and description.startswith('Backpropagation'):
+                        if 'without bitfield' in description:
+                            sl += '-nobitfield'
+                        else:
+                            sl += '-bitfield'
 
                 # Phase timing.  Sample log line:
                 # Time for phase 1 = 22796.7 seconds. CPU (98%) Tue Sep 29 17:57:19 2020
-                for phase in ['1', '2', '3', '4']:
-                    m = re.search(r'^Time for phase ' + phase + ' = (\d+.\d+) seconds..*', line)
-                    if m:
-                        phase_time[phase] = float(m.group(1))
+                elif isinstance(event, log_parser.PhaseTime):
+                    phase_time[str(event.phase)] = event.seconds
 
                 # Uniform sort.  Sample log line:
                 # Bucket 267 uniform sort. Ram: 0.920GiB, u_sort min: 0.688GiB, qs min: 0.172GiB.
@@ -70,26 +63,24 @@ def analyze(logfilenames, clipterminals, bytmp, bybitfield):
                 # ....?....
                 #   or
                 # Bucket 511 QS. Ram: 0.920GiB, u_sort min: 0.375GiB, qs min: 0.094GiB. force_qs: 1
-                m = re.search(r'Bucket \d+ ([^\.]+)\..*', line)
-                if m and not 'force_qs' in line:
-                    sorter = m.group(1)
-                    n_sorts += 1
-                    if sorter == 'uniform sort':
-                        n_uniform += 1
-                    elif sorter == 'QS':
-                        pass
-                    else:
-                        print ('Warning: unrecognized sort ' + sorter)
+                elif isinstance(event, log_parser.BucketSorted):
+                    if not event.forced:
+                        n_sorts += 1
+                        if event.sorter == 'uniform sort':
+                            n_uniform += 1
+                        elif event.sorter == 'QS':
+                            pass
+                        else:
+                            print ('Warning: unrecognized sort ' + event.sorter)
 
                 # Job completion.  Record total time in sliced data store.
                 # Sample log line:
                 # Total time = 49487.1 seconds. CPU (97.26%) Wed Sep 30 01:22:10 2020
-                m = re.search(r'^Total time = (\d+.\d+) seconds.*', line)
-                if m:
+                elif isinstance(event, log_parser.TotalTime):
                     if clipterminals and is_first_last:
                         pass  # Drop this data; omit from statistics.
                     else:
-                        data.setdefault(sl, {}).setdefault('total time', []).append(float(m.group(1)))
+                        data.setdefault(sl, {}).setdefault('total time', []).append(event.seconds)
                         for phase in ['1', '2', '3', '4']:
                             data.setdefault(sl, {}).setdefault('phase ' + phase, []).append(phase_time[phase])
                         data.setdefault(sl, {}).setdefault('%usort', []).append(100 * n_uniform // n_sorts)
@@ -4,14 +4,18 @@ import math
 import os
 import random
 import re
+import shlex
 import subprocess
 import sys
+import threading
+import time
 from datetime import datetime
+from typing import List, NamedTuple, Optional
 
-import psutil
+import appdirs
 import texttable as tt
 
-from plotman import manager, plot_util
+from plotman import manager, plot_util, processes, transfer, transfer_progress
 
 # TODO : write-protect and delete-protect archived plots
 
@@ -47,21 +51,140 @@ def compute_priority(phase, gb_free, n_plots):
 
     return priority
 
-def get_archdir_freebytes(arch_cfg):
+# How long ssh keeps the connection to the archive host open after its last
+# use, for the next query to reuse, in seconds.
+SSH_CONTROL_PERSIST_S = 600
+
+def ssh_args(arch_cfg):
+    '''ssh command line prefix for running commands on the archive host.
+       All plotman processes share one connection per host (OpenSSH
+       connection multiplexing), opened by the first and kept open for
+       SSH_CONTROL_PERSIST_S after the last use.'''
+    control_dir = os.path.join(appdirs.user_cache_dir('plotman'), 'ssh')
+    os.makedirs(control_dir, mode=0o700, exist_ok=True)
+    return ['ssh',
+            '-o', 'ControlMaster=auto',
+            '-o', 'ControlPath=%s' % os.path.join(control_dir, '%C'),
+            '-o', 'ControlPersist=%d' % SSH_CONTROL_PERSIST_S,
+            '-o', 'ConnectTimeout=%d' % arch_cfg.df_timeout_s,
+            '%s@%s' % (arch_cfg.rsyncd_user, arch_cfg.rsyncd_host)]
+
+def parse_df(output, rsyncd_path):
+    '''Return a map from archive dir (a mount point under rsyncd_path) to
+       its free bytes, from the output of `df -aBK`.'''
+    archdir_freebytes = {}
+    prefix = rsyncd_path.rstrip('/') + '/'
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) < 6 or not fields[5].startswith(prefix):
+            continue
+        if fields[3] == '-':
+            # not actually mounted
+            continue
+        freebytes = int(fields[3][:-1]) * 1024  # Strip the final 'K'
+        archdir_freebytes[fields[5]] = freebytes
+    return archdir_freebytes
+
+def get_local_archdir_freebytes(arch_cfg):
+    '''Return a map from archive dir to its free bytes, for archive mode
+       'local', in which every directory in rsyncd_path (or symlink to
+       one, e.g. on another drive) is an archive dir.'''
     archdir_freebytes = {}
-    df_cmd = ('ssh %s@%s df -aBK | grep " %s/"' %
-        (arch_cfg.rsyncd_user, arch_cfg.rsyncd_host, arch_cfg.rsyncd_path) )
-    with subprocess.Popen(df_cmd, shell=True, stdout=subprocess.PIPE) as proc:
-        for line in proc.stdout.readlines():
-            fields = line.split()
-            if fields[3] == b'-':
-                # not actually mounted
-                continue
-            freebytes = int(fields[3][:-1]) * 1024  # Strip the final 'K'
-            archdir = (fields[5]).decode('ascii')
-            archdir_freebytes[archdir] = freebytes
+    with contextlib.suppress(FileNotFoundError):
+        for entry in os.scandir(arch_cfg.rsyncd_path):
+            if entry.is_dir():
+                archdir_freebytes[entry.path] = plot_util.df_b(entry.path)
     return archdir_freebytes
 
+def get_archdir_freebytes(arch_cfg):
+    '''Ask the archive host for the free space of its archive dirs.  Return
+       an empty map if it doesn't answer within archive.df_timeout_s.'''
+    if arch_cfg.mode == 'local':
+        return get_local_archdir_freebytes(arch_cfg)
+    try:
+        result = subprocess.run(ssh_args(arch_cfg) + ['df', '-aBK'],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                stdin=subprocess.DEVNULL, timeout=arch_cfg.df_timeout_s)
+    except subprocess.TimeoutExpired:
+        return {}
+    return parse_df(result.stdout.decode('utf-8', 'replace'), arch_cfg.rsyncd_path)
+
+
+class ArchdirFreeSpace:
+    '''The free space of the archive dirs, queried at most every
+       archive.df_ttl_s seconds, less what we have started sending since
+       the query.
+
+       Queries run in a background thread.  freebytes() may wait for one to
+       finish (for up to the query timeout), or return what is known so far
+       at once, e.g. to keep a UI responsive while the archive host is slow
+       to answer.'''
+
+    def __init__(self, query=get_archdir_freebytes, clock=time.monotonic):
+        self.query = query
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.snapshot = None        # The last answer, or None
+        self.snapshot_time = None   # clock() when the query which answered it started
+        self.sent = []              # (clock(), archdir, bytes) of transfers since
+        self.thread = None
+
+    def _refresh(self, arch_cfg, started):
+        freebytes = self.query(arch_cfg)
+        with self.lock:
+            # An empty answer means the host didn't answer; keep what we had,
+            # and ask again next time rather than after df_ttl_s.
+            if freebytes:
+                self.snapshot = freebytes
+                self.snapshot_time = started
+                self.sent = [s for s in self.sent if s[0] >= started]
+            elif self.snapshot is None:
+                self.snapshot = {}
+
+    def freebytes(self, arch_cfg, wait=True):
+        '''Return a map from archive dir to its free bytes, or None if the
+           first query hasn't been answered and wait is False.'''
+        now = self.clock()
+        with self.lock:
+            stale = self.snapshot_time is None or now - self.snapshot_time >= arch_cfg.df_ttl_s
+            if stale and (self.thread is None or not self.thread.is_alive()):
+                self.thread = threading.Thread(
+                    target=self._refresh, args=(arch_cfg, now), daemon=True)
+                self.thread.start()
+            thread = self.thread
+        if wait and (stale or self.snapshot is None):
+            thread.join()
+
+        with self.lock:
+            if self.snapshot is None:
+                return None
+            freebytes = dict(self.snapshot)
+            for (_, archdir, nbytes) in self.sent:
+                if archdir in freebytes:
+                    freebytes[archdir] -= nbytes
+            return freebytes
+
+    def invalidate(self):
+        '''Query again on the next call to freebytes(), e.g. after a transfer
+           failed, which may have been because the host went away.'''
+        with self.lock:
+            self.snapshot_time = None
+
+    def sent_bytes(self, archdir):
+        '''Bytes we started sending to archdir since the last query.'''
+        with self.lock:
+            return sum(nbytes for (_, d, nbytes) in self.sent if d == archdir)
+
+    def record_sent(self, archdir, nbytes):
+        '''Count a transfer of nbytes to archdir against its free space
+           until the next query.'''
+        with self.lock:
+            self.sent.append((self.clock(), archdir, nbytes))
+
+# Where rsync keeps partly sent plots, relative to the archive dir, so the
+# farmer doesn't see them and the next transfer resumes from them.
+RSYNC_PARTIAL_DIR = '.plotman-partial'
+
 def rsync_dest(arch_cfg, arch_dir):
     rsync_path = arch_dir.replace(arch_cfg.rsyncd_path, arch_cfg.rsyncd_module)
     if rsync_path.startswith('/'):
@@ -70,71 +193,249 @@ def rsync_dest(arch_cfg, arch_dir):
             arch_cfg.rsyncd_user, arch_cfg.rsyncd_host, rsync_path)
     return rsync_url
 
-# TODO: maybe consolidate with similar code in job.py?
-def get_running_archive_jobs(arch_cfg):
+def archdir_from_rsync_dest(arch_cfg, url):
+    '''The archive dir an rsync_dest() URL points at, or None if it is not
+       one of ours.'''
+    prefix = rsync_dest(arch_cfg, '/')
+    if not url.startswith(prefix):
+        return None
+    rsync_path = url[len(prefix):].rstrip('/')
+    if not rsync_path.startswith(arch_cfg.rsyncd_module):
+        return None
+    return arch_cfg.rsyncd_path + rsync_path[len(arch_cfg.rsyncd_module):]
+
+class ArchiveTransfer(NamedTuple):
+    pid: int
+    plots: List[str]   # Source plot files, in dst dirs
+    archdir: str
+    bwlimit: Optional[int] = None   # KB/s, if limited
+
+
+def bwlimit_of(args):
+    '''The --bwlimit of a transfer's command line, or None.'''
+    for arg in args:
+        if arg.startswith('--bwlimit='):
+            with contextlib.suppress(ValueError):
+                return int(arg[len('--bwlimit='):])
+    return None
+
+
+def local_archdir_of(arch_cfg, args):
+    '''The archive dir of a plotman.transfer command line, or None if it is
+       not one of ours.'''
+    if transfer.__name__ not in args or not args[-1].startswith(
+            arch_cfg.rsyncd_path.rstrip('/') + '/'):
+        return None
+    return args[-1]
+
+def get_running_archive_transfers(arch_cfg, snapshot=None):
+    '''Look for running rsync jobs (or for archive mode 'local',
+       plotman.transfer processes) sending plots to our archive dirs, in the
+       given discovery.Snapshot or else a fresh one.  Return a list of
+       ArchiveTransfers.'''
+    if snapshot is None:
+        snapshot = processes.snapshot()
+    transfers = []
+    for (key, args) in snapshot.cmdlines(processes.ARCHIVE):
+        t = transfer_from_cmdline(arch_cfg, key.pid, args)
+        if t is not None:
+            transfers.append(t)
+    return transfers
+
+def transfer_from_cmdline(arch_cfg, pid, args):
+    '''The ArchiveTransfer of process pid with command line args, or None
+       if it is not sending plots to our archive dirs.'''
+    if not args:
+        return None
+    if arch_cfg.mode == 'local':
+        archdir = local_archdir_of(arch_cfg, args)
+    elif os.path.basename(args[0]) == 'rsync':
+        dest = rsync_dest(arch_cfg, '/')
+        archdirs = [archdir_from_rsync_dest(arch_cfg, arg)
+                    for arg in args if arg.startswith(dest)]
+        archdir = archdirs[0] if archdirs else None
+    else:
+        archdir = None
+    if archdir is None:
+        return None
+    plots = [arg for arg in args if arg.endswith('.plot')]
+    return ArchiveTransfer(pid, plots, archdir, bwlimit_of(args))
+
+def inflight_bytes(transfers):
+    '''Return a map from archive dir to the total size of the plots being
+       sent to it.  The plots are still whole in the dst dirs, and only
+       partly written to the archive dirs.'''
+    inflight = {}
+    for t in transfers:
+        for plot in t.plots:
+            with contextlib.suppress(FileNotFoundError):
+                inflight[t.archdir] = inflight.get(t.archdir, 0) + os.stat(plot).st_size
+    return inflight
+
+def get_running_archive_jobs(arch_cfg, snapshot=None):
     '''Look for running rsync jobs that seem to match the pattern we use for archiving
        them.  Return a list of PIDs of matching jobs.'''
-    jobs = []
-    dest = rsync_dest(arch_cfg, '/')
-    for proc in psutil.process_iter(['pid', 'name']):
-        with contextlib.suppress(psutil.NoSuchProcess):
-            if proc.name() == 'rsync':
-                args = proc.cmdline()
-                for arg in args:
-                    if arg.startswith(dest):
-                        jobs.append(proc.pid)
-    return jobs
+    return [t.pid for t in get_running_archive_transfers(arch_cfg, snapshot)]
 
-def archive(dir_cfg, all_jobs):
-    '''Configure one archive job.  Needs to know all jobs so it can avoid IO
-    contention on the plotting dstdir drives.  Returns either (False, <reason>) 
-    if we should not execute an archive job or (True, <cmd>) with the archive
-    command if we should.'''
+def dst_dir_of(plot, dstdirs):
+    '''The dst dir plot is in, or None.'''
+    d = os.path.dirname(plot)
+    for dstdir in dstdirs:
+        if os.path.normpath(dstdir) == os.path.normpath(d):
+            return dstdir
+    return None
+
+def plot_size(plot):
+    '''The size of a plot file about to be sent, or of a k32 plot if it is
+       gone.'''
+    with contextlib.suppress(FileNotFoundError):
+        return os.stat(plot).st_size
+    return plot_util.get_k32_plotsize()
+
+def archive_commands(dir_cfg, all_jobs, transfers=None, free_space=None, bandwidth=None,
+                     skip=()):
+    '''Configure as many new archive jobs as archive.max_transfers allows
+       on top of the running transfers (by default, looked up).  Each job
+       reads from a dst dir and writes to an archive dir which no other
+       transfer uses, so no drive serves two streams at once, and sends up
+       to archive.plots_per_transfer plots, leaving out those in skip (e.g.
+       waiting to be retried).  Needs to know
+       all jobs so it can avoid IO contention on the plotting dstdir drives.
+       With an ArchdirFreeSpace, archive dir free space comes from its cache
+       (without waiting for the archive host), and the new jobs are counted
+       against it; otherwise the archive host is asked.  With a
+       bandwidth.BandwidthController, each job is limited to the current
+       bandwidth of its dst dir.
+       Returns (the archive commands, why no more were configured).'''
     if dir_cfg.archive is None:
-        return (False, "No 'archive' settings declared in plotman.yaml")
+        return ([], "No 'archive' settings declared in plotman.yaml")
+    arch_cfg = dir_cfg.archive
+    if transfers is None:
+        transfers = get_running_archive_transfers(arch_cfg)
 
-    dir2ph = manager.dstdirs_to_furthest_phase(all_jobs)
-    best_priority = -100000000
-    chosen_plot = None
+    slots = arch_cfg.max_transfers - len(transfers)
+    if slots <= 0:
+        return ([], 'max transfers (%d) running' % arch_cfg.max_transfers)
 
+    busy_dstdirs = { dst_dir_of(plot, dir_cfg.dst) for t in transfers for plot in t.plots }
+    busy_archdirs = { t.archdir for t in transfers }
+
+    # The best plots of each idle dst dir, best dir first.
+    dir2ph = manager.dstdirs_to_furthest_phase(all_jobs)
+    candidates = []
     for d in dir_cfg.dst:
+        if d in busy_dstdirs:
+            continue
         ph = dir2ph.get(d, (0, 0))
         dir_plots = plot_util.list_k32_plots(d)
         gb_free = plot_util.df_b(d) / plot_util.GB
         n_plots = len(dir_plots)
         priority = compute_priority(ph, gb_free, n_plots) 
-        if priority >= best_priority and dir_plots:
-            best_priority = priority
-            chosen_plot = dir_plots[0]
+        batch = [plot for plot in dir_plots if plot not in skip][:arch_cfg.plots_per_transfer]
+        if batch:
+            candidates.append((priority, batch))
+    # Ties go to the later dst dir, as they always have.
+    candidates = [batch for (_, batch) in sorted(reversed(candidates), key=lambda c: -c[0])]
 
-    if not chosen_plot:
-        return (False, 'No plots found')
+    if not candidates:
+        return ([], 'No plots found')
 
     # TODO: sanity check that archive machine is available
     # TODO: filter drives mounted RO
 
     #
-    # Pick first archive dir with sufficient space
+    # Pick archive dirs with sufficient space, skipping forward up to
+    # 'index' of them
     #
-    archdir_freebytes = get_archdir_freebytes(dir_cfg.archive)
+    if free_space is None:
+        archdir_freebytes = get_archdir_freebytes(arch_cfg)
+    else:
+        archdir_freebytes = free_space.freebytes(arch_cfg, wait=False)
+        if archdir_freebytes is None:
+            return ([], 'Waiting for archive dir free space')
     if not archdir_freebytes:
-        return(False, 'No free archive dirs found.')
-    
-    archdir = ''
+        return ([], 'No free archive dirs found.')
+
+    # df doesn't yet count the rest of plots being sent.  Those started
+    # since the last query are already taken off by the cache.
+    for (d, inflight) in inflight_bytes(transfers).items():
+        if d in archdir_freebytes:
+            sent = free_space.sent_bytes(d) if free_space is not None else 0
+            archdir_freebytes[d] -= max(0, inflight - sent)
+
     available = [(d, space) for (d, space) in archdir_freebytes.items() if 
                  space > 1.2 * plot_util.get_k32_plotsize()]
-    if len(available) > 0:
-        index = min(dir_cfg.archive.index, len(available) - 1)
-        (archdir, freespace) = sorted(available)[index]
+    if not available:
+        return ([], 'No archive directories found with enough free space')
+    available = sorted(available)
+    index = min(arch_cfg.index, len(available) - 1)
+    available = [(d, space) for (d, space) in available[index:] + available[:index]
+                 if d not in busy_archdirs]
+    if not available:
+        return ([], 'All archive directories with enough free space are busy')
+
+    cmds = []
+    for (batch, (archdir, space)) in list(zip(candidates, available))[:slots]:
+        # As many of the batch as fit, with the same margin as for one.
+        n_fit = int(space / plot_util.get_k32_plotsize() - 0.2)
+        batch = batch[:max(1, n_fit)]
+        bwlimit = None
+        if bandwidth is not None:
+            bwlimit = bandwidth.limit(arch_cfg, dst_dir_of(batch[0], dir_cfg.dst))
+        cmds.append(transfer_command(arch_cfg, batch, archdir, bwlimit))
+        if free_space is not None:
+            free_space.record_sent(archdir, sum(plot_size(plot) for plot in batch))
 
-    if not archdir:
-        return(False, 'No archive directories found with enough free space')
-    
-    msg = 'Found %s with ~%d GB free' % (archdir, freespace / plot_util.GB)
+    if len(cmds) == slots:
+        reason = 'max transfers (%d) running' % arch_cfg.max_transfers
+    elif len(cmds) == len(candidates):
+        reason = 'No more plots found on idle dst dirs'
+    else:
+        reason = 'No more idle archive directories with enough free space'
+    return (cmds, reason)
 
-    bwlimit = dir_cfg.archive.rsyncd_bwlimit
+def transfer_command(arch_cfg, plots, archdir, bwlimit=None):
+    '''The shell command to archive a list of plots to archdir, limited to
+       bwlimit KB/s (by default, rsyncd_bwlimit).  An interrupted rsync
+       leaves what it has sent in a partial dir, from which the next one
+       resumes; plotman.transfer does the same with its temp file.'''
+    if bwlimit is None:
+        bwlimit = arch_cfg.rsyncd_bwlimit
     throttle_arg = ('--bwlimit=%d' % bwlimit) if bwlimit else ''
-    cmd = ('rsync %s --remove-source-files -P %s %s' %
-            (throttle_arg, chosen_plot, rsync_dest(dir_cfg.archive, archdir)))
+    # The command is run by a shell, and paths may have spaces (e.g. the
+    # data dir on macOS).
+    plots_arg = ' '.join(shlex.quote(plot) for plot in plots)
+    if arch_cfg.mode == 'local':
+        if arch_cfg.bandwidth is not None:
+            throttle_arg += ' ' + shlex.quote('--bwlimit-file=' + transfer.get_bwlimit_path())
+        return '%s -m %s --remove-source-files %s %s %s %s' % (
+            shlex.quote(sys.executable), transfer.__name__, throttle_arg,
+            shlex.quote('--log=' + transfer.get_log_path()), plots_arg, shlex.quote(archdir))
+    return 'rsync %s --remove-source-files -P --partial-dir=%s %s %s' % (
+        throttle_arg, RSYNC_PARTIAL_DIR, plots_arg, shlex.quote(rsync_dest(arch_cfg, archdir)))
+
+def start_transfer(cmd):
+    '''Start an archive command in the background, with its output going to
+       the progress file of its plot.'''
+    plots = [arg for arg in shlex.split(cmd) if arg.endswith('.plot')]
+    if not plots:
+        return subprocess.Popen(cmd, shell=True, stdout=subprocess.DEVNULL,
+                stderr=subprocess.STDOUT, start_new_session=True)
+    path = transfer_progress.progress_path(plots[0])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as progress_file:
+        return subprocess.Popen(cmd,
+                shell=True,
+                stdout=progress_file,
+                stderr=subprocess.STDOUT,
+                start_new_session=True)
 
-    return (True, cmd)
+def archive(dir_cfg, all_jobs):
+    '''Configure one archive job.  Needs to know all jobs so it can avoid IO
+    contention on the plotting dstdir drives.  Returns either (False, <reason>) 
+    if we should not execute an archive job or (True, <cmd>) with the archive
+    command if we should.'''
+    (cmds, reason) = archive_commands(dir_cfg, all_jobs)
+    if not cmds:
+        return (False, reason)
+    return (True, cmds[0])
@@ -0,0 +1,187 @@
+'''The archive daemon: completed plots archived as a queue, with retries.
+
+`plotman archive` and `plotman interactive` each call ArchiveDaemon.step()
+on their polling interval.  The queue is the completed plots in the dst
+dirs, taken best dir first (see archive.archive_commands), up to
+archive.plots_per_transfer at a time, so it survives a restart by being on
+disk already.  What else must survive one is kept in a state file (JSON) in
+plotman's data dir:
+
+* the transfers started, by their plots.  Once no running transfer has a
+  plot of one, it has finished: each of its plots which is gone from its
+  dst dir was archived, and each which is still there failed.  Transfers
+  found running which we didn't start (e.g. before a restart) are adopted.
+* the plots which failed, each with its attempts so far and when it may be
+  tried again: RETRY_MIN_S after the first failure, doubling with each
+  failure up to RETRY_MAX_S.  Until then, the queue passes over it.  While
+  a transfer is sending it again, its retry is parked (next_try None).
+
+An interrupted transfer is resumed from what it had sent: rsync keeps that
+in archive.RSYNC_PARTIAL_DIR, and plotman.transfer in its temporary file.
+So after the archive host goes away (e.g. the farmer reboots), archiving
+carries on from where it was RETRY_MIN_S after it is back.'''
+
+import contextlib
+import json
+import os
+import shlex
+import time
+
+import appdirs
+
+from plotman import archive, processes, transfer_progress
+
+RETRY_MIN_S = 30
+RETRY_MAX_S = 3600
+
+# How long `plotman archive` sleeps between steps with no retry due sooner.
+POLL_S = 60
+
+
+def get_state_path():
+    return os.path.join(appdirs.user_data_dir('plotman'), 'archive-state.json')
+
+def retry_delay_s(attempts):
+    '''How long to wait before trying a plot again after attempts failures.'''
+    return min(RETRY_MAX_S, RETRY_MIN_S * 2 ** (attempts - 1))
+
+def load_state(path):
+    '''The saved state at path, or an empty one.'''
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        state = {}
+    return { 'transfers': state.get('transfers', []), 'retries': state.get('retries', {}) }
+
+def save_state(path, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+class ArchiveDaemon:
+    def __init__(self, state_path=None, clock=time.time, start=archive.start_transfer,
+                 free_space=None, bandwidth=None, wait_for_free_space=False,
+                 progress_dir=None):
+        self.state_path = get_state_path() if state_path is None else state_path
+        self.clock = clock    # Wall clock time, as it is saved across reboots
+        self.start = start
+        self.free_space = archive.ArchdirFreeSpace() if free_space is None else free_space
+        self.bandwidth = bandwidth
+        self.wait_for_free_space = wait_for_free_space
+        self.progress_dir = progress_dir
+        state = load_state(self.state_path)
+        self.transfers = state['transfers']   # Dicts of plots, archdir, started
+        self.retries = state['retries']       # Map from plot to dict of attempts, next_try
+
+    def waiting(self, now):
+        '''The plots not to be tried again yet.'''
+        return { plot for (plot, r) in self.retries.items()
+                 if r['next_try'] is not None and r['next_try'] > now }
+
+    def seconds_until_retry(self):
+        '''Seconds until the next plot waiting to be retried may be, or None.
+           Plots which may be retried already wait only on the queue.'''
+        now = self.clock()
+        times = [self.retries[plot]['next_try'] - now for plot in self.waiting(now)]
+        return min(times) if times else None
+
+    def sleep_s(self):
+        '''How long `plotman archive` should wait before the next step.'''
+        retry_s = self.seconds_until_retry()
+        return POLL_S if retry_s is None else max(1, min(POLL_S, retry_s))
+
+    def reap(self, running, now):
+        '''Settle the transfers we know of which no longer run.  Return log
+           messages.'''
+        running_plots = { plot for t in running for plot in t.plots }
+        logmsgs = []
+        still_running = []
+        for t in self.transfers:
+            # A transfer restarted, e.g. with a new bandwidth limit, goes on.
+            if any(plot in running_plots for plot in t['plots']):
+                still_running.append(t)
+                continue
+            for plot in t['plots']:
+                # Only plotman interactive follows progress files, and it may
+                # not be running.  A restarted transfer's is of its first plot.
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(transfer_progress.progress_path(plot, self.progress_dir))
+                if not os.path.exists(plot):
+                    logmsgs.append('Archived %s to %s' % (plot, t['archdir']))
+                    self.retries.pop(plot, None)
+                    continue
+                attempts = self.retries.get(plot, {}).get('attempts', 0) + 1
+                delay_s = retry_delay_s(attempts)
+                self.retries[plot] = { 'attempts': attempts, 'next_try': now + delay_s }
+                logmsgs.append('Archiving %s to %s failed (attempt %d), retrying in %ds'
+                               % (plot, t['archdir'], attempts, delay_s))
+                # Perhaps the archive host went away; ask it afresh.
+                self.free_space.invalidate()
+        self.transfers = still_running
+
+        # Forget plots which were removed, or archived by hand.
+        for plot in list(self.retries):
+            if not os.path.exists(plot):
+                del self.retries[plot]
+        return logmsgs
+
+    def track(self, transfers, now):
+        '''Know of the given running ArchiveTransfers from now on.'''
+        known = { plot for t in self.transfers for plot in t['plots'] }
+        for t in transfers:
+            if t.plots and not known.intersection(t.plots):
+                self.transfers.append(
+                    { 'plots': list(t.plots), 'archdir': t.archdir, 'started': now })
+                known.update(t.plots)
+            # Park the retries of plots being sent again.
+            for plot in t.plots:
+                if plot in self.retries:
+                    self.retries[plot]['next_try'] = None
+
+    def step(self, dir_cfg, all_jobs, snapshot=None, disk_sampler=None):
+        '''Settle finished transfers, adjust the bandwidth of running ones (if
+           archive.bandwidth and a disk_sampler are given), and start as many
+           new ones as archive.max_transfers allows.  Return (log messages,
+           status, the transfers running before any were started).'''
+        arch_cfg = dir_cfg.archive
+        now = self.clock()
+        if snapshot is None:
+            snapshot = processes.snapshot()
+        transfers = archive.get_running_archive_transfers(arch_cfg, snapshot)
+        logmsgs = self.reap(transfers, now)
+
+        if self.bandwidth is not None and disk_sampler is not None:
+            bw_msgs = self.bandwidth.apply(dir_cfg, all_jobs, transfers, disk_sampler)
+            logmsgs.extend(bw_msgs)
+            if bw_msgs:
+                transfers = archive.get_running_archive_transfers(arch_cfg, processes.snapshot())
+        self.track(transfers, now)
+
+        if self.wait_for_free_space:
+            self.free_space.freebytes(arch_cfg)
+        (cmds, reason) = archive.archive_commands(
+            dir_cfg, all_jobs, transfers, self.free_space, self.bandwidth, self.waiting(now))
+        started = []
+        for cmd in cmds:
+            self.start(cmd)
+            logmsgs.append('Starting archive: ' + cmd)
+            t = archive.transfer_from_cmdline(arch_cfg, None, shlex.split(cmd))
+            if t is not None:
+                started.append(t)
+        self.track(started, now)
+        save_state(self.state_path, { 'transfers': self.transfers, 'retries': self.retries })
+
+        if transfers:
+            status = 'pid: ' + ', '.join(str(t.pid) for t in transfers)
+        elif cmds:
+            status = '<just started %d transfer(s)>' % len(cmds)
+        else:
+            status = reason
+        n_waiting = len(self.waiting(now))
+        if n_waiting:
+            status += ' (%d plot(s) waiting to retry)' % n_waiting
+        return (logmsgs, status, transfers)
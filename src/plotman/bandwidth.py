@@ -0,0 +1,151 @@
+'''Dynamic bandwidth limits for archive transfers.
+
+A static rsyncd_bwlimit must be low enough never to slow the copy of a new
+plot into the dst dir being archived from, and so wastes the link most of
+the time.  With archive.bandwidth, the limit for transfers out of each dst
+dir is instead adjusted every adjust_interval_s:
+
+* down to min_kbps while a job writing to the dst dir is at or past
+  slow_phase_major:slow_phase_minor, i.e. about to copy its plot there,
+* halved (but not below min_kbps) while the dst dir's device is being
+  written at more than busy_write_mb_s, as measured by
+  diskstats.DiskStatsSampler (transfers only read from it), and
+* otherwise raised by a quarter, up to max_kbps.
+
+Local transfers (archive mode 'local') pick up a new limit within seconds
+from a file the controller writes.  rsync can't change its --bwlimit, so an
+rsync transfer is restarted with the new limit, keeping what it has sent
+(-P implies --partial), but only if the limit has changed by at least
+RESTART_RATIO and the transfer hasn't been restarted in the last
+RESTART_INTERVAL_S.'''
+
+import contextlib
+import json
+import os
+import time
+
+import psutil
+
+from plotman import archive, manager, transfer
+
+RESTART_RATIO = 1.5
+RESTART_INTERVAL_S = 300
+
+# How long to wait for an rsync to exit before restarting it, in seconds.
+STOP_TIMEOUT_S = 10
+
+
+def initial_kbps(arch_cfg):
+    '''The limit of a dst dir before any adjustment.'''
+    bw_cfg = arch_cfg.bandwidth
+    kbps = arch_cfg.rsyncd_bwlimit or bw_cfg.max_kbps
+    return max(bw_cfg.min_kbps, min(bw_cfg.max_kbps, kbps))
+
+def next_kbps(bw_cfg, kbps, phase, load):
+    '''Return (the new limit, why) for a dst dir with limit kbps, the
+       furthest phase of the jobs writing to it, and its DeviceLoad (or
+       None).'''
+    # A job whose phase isn't known yet has only just started.
+    if phase[0] is None or phase[1] is None:
+        phase = (0, 0)
+    if phase >= (bw_cfg.slow_phase_major, bw_cfg.slow_phase_minor):
+        return (bw_cfg.min_kbps, 'a job is in phase %d:%d' % phase)
+    if load is not None and load.write_bytes_s > bw_cfg.busy_write_mb_s * 1e6:
+        return (max(bw_cfg.min_kbps, kbps // 2),
+                'dst device writing %d MB/s' % (load.write_bytes_s / 1e6))
+    return (min(bw_cfg.max_kbps, kbps + max(1, kbps // 4)), 'dst device idle')
+
+def save_kbps(path, rates):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(rates, f)
+    os.replace(tmp_path, path)
+
+def stop_transfer(pid):
+    '''Stop a transfer, waiting for it to exit.'''
+    with contextlib.suppress(psutil.NoSuchProcess):
+        proc = psutil.Process(pid)
+        proc.terminate()
+        proc.wait(timeout=STOP_TIMEOUT_S)
+
+
+class BandwidthController:
+    def __init__(self, rates_path=None, clock=time.monotonic,
+                 stop=stop_transfer, start=archive.start_transfer):
+        self.rates_path = transfer.get_bwlimit_path() if rates_path is None else rates_path
+        self.clock = clock
+        self.stop = stop
+        self.start = start
+        self.kbps = {}        # Map from dst dir to its limit
+        self.adjusted = {}    # Map from dst dir to clock() of its last adjustment
+        self.restarted = {}   # Map from a transfer's plots to clock() of its last restart
+
+    def limit(self, arch_cfg, dstdir):
+        '''The --bwlimit for a new transfer out of dstdir.'''
+        if arch_cfg.bandwidth is None:
+            return arch_cfg.rsyncd_bwlimit
+        return self.kbps.get(dstdir, initial_kbps(arch_cfg))
+
+    def apply(self, dir_cfg, all_jobs, transfers, disk_sampler):
+        '''Adjust the limits of the dst dirs being archived from, and restart
+           rsync transfers whose limit changed enough.  Return a log message
+           for each change.'''
+        arch_cfg = dir_cfg.archive
+        if arch_cfg is None or arch_cfg.bandwidth is None:
+            return []
+        bw_cfg = arch_cfg.bandwidth
+        now = self.clock()
+        dir2ph = manager.dstdirs_to_furthest_phase(all_jobs)
+
+        logmsgs = []
+        by_dstdir = {}
+        for t in transfers:
+            d = archive.dst_dir_of(t.plots[0], dir_cfg.dst) if t.plots else None
+            if d is not None:
+                by_dstdir.setdefault(d, []).append(t)
+
+        changed = False
+        for d in by_dstdir:
+            if now - self.adjusted.get(d, -bw_cfg.adjust_interval_s) < bw_cfg.adjust_interval_s:
+                continue
+            self.adjusted[d] = now
+            kbps = self.limit(arch_cfg, d)
+            (new_kbps, why) = next_kbps(bw_cfg, kbps, dir2ph.get(d, (0, 0)), disk_sampler.load(d))
+            if new_kbps != kbps:
+                logmsgs.append('Archive bandwidth from %s: %d -> %d KB/s (%s)' % (d, kbps, new_kbps, why))
+                changed = True
+            self.kbps[d] = new_kbps
+
+        # Forget dst dirs no longer archived from, so they start afresh.
+        for d in list(self.kbps):
+            if d not in by_dstdir:
+                del self.kbps[d]
+                self.adjusted.pop(d, None)
+                changed = True
+        if changed:
+            save_kbps(self.rates_path, self.kbps)
+
+        if arch_cfg.mode == 'rsync':
+            for (d, dir_transfers) in by_dstdir.items():
+                for t in dir_transfers:
+                    logmsgs.extend(self.maybe_restart(arch_cfg, t, self.kbps[d], now))
+        return logmsgs
+
+    def maybe_restart(self, arch_cfg, t, kbps, now):
+        key = tuple(t.plots)
+        current = t.bwlimit if t.bwlimit else None
+        if current is not None and max(current, kbps) / min(current, kbps) < RESTART_RATIO:
+            return []
+        if now - self.restarted.get(key, -RESTART_INTERVAL_S) < RESTART_INTERVAL_S:
+            return []
+        self.restarted[key] = now
+        try:
+            self.stop(t.pid)
+        except psutil.Error as e:
+            return ['Could not stop archive transfer %d to change its bandwidth: %s' % (t.pid, e)]
+        # Plots already sent are gone from their dst dir.
+        plots = [plot for plot in t.plots if os.path.exists(plot)] or t.plots
+        cmd = archive.transfer_command(arch_cfg, plots, t.archdir, kbps)
+        self.start(cmd)
+        return ['Restarted archive transfer %d at %d KB/s: %s' % (t.pid, kbps, cmd)]
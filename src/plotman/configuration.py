@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Dict, List, Optional
 
 import appdirs
@@ -32,24 +32,52 @@ def get_validated_configs():
             f"No 'plotman.yaml' file exists at expected location: '{config_file_path}'. To generate "
             f"default config file, run: 'plotman config generate'"
         ) from e
-    except marshmallow.exceptions.ValidationError as e:
+    except (yaml.YAMLError, marshmallow.exceptions.ValidationError) as e:
         raise ConfigurationException(f"Config file at: '{config_file_path}' is malformed") from e
 
 
 # Data models used to deserializing/formatting plotman.yaml files.
 
+@dataclass
+class ArchiveBandwidth:
+    max_kbps: int
+    min_kbps: int = 5000
+    slow_phase_major: int = 3
+    slow_phase_minor: int = 6
+    busy_write_mb_s: float = 20.0
+    adjust_interval_s: int = 60
+
 @dataclass
 class Archive:
-    rsyncd_module: str
     rsyncd_path: str
-    rsyncd_bwlimit: int
-    rsyncd_host: str
-    rsyncd_user: str
+    # Only needed with mode 'rsync'
+    rsyncd_module: Optional[str] = None
+    rsyncd_bwlimit: Optional[int] = None
+    rsyncd_host: Optional[str] = None
+    rsyncd_user: Optional[str] = None
+    mode: str = field(  # If not explicit, send plots to the rsync daemon
+        default='rsync',
+        metadata=desert.metadata(
+            marshmallow.fields.String(validate=marshmallow.validate.OneOf(['rsync', 'local']))))
     index: int = 0  # If not explicit, "index" will default to 0
+    max_transfers: int = 1  # If not explicit, archive one plot at a time
+    plots_per_transfer: int = 1
+    df_ttl_s: int = 300  # If not explicit, ask for archive free space every 5 minutes
+    df_timeout_s: int = 15
+    bandwidth: Optional[ArchiveBandwidth] = None  # If not explicit, rsyncd_bwlimit is fixed
+
+    def __post_init__(self):
+        if self.mode == 'rsync':
+            missing = [name for name in ['rsyncd_module', 'rsyncd_host', 'rsyncd_user']
+                       if getattr(self, name) is None]
+            if missing:
+                raise marshmallow.ValidationError(
+                    'archive mode rsync needs ' + ', '.join(missing))
 
 @dataclass
 class TmpOverrides:
     tmpdir_max_jobs: Optional[int] = None
+    numa_node: Optional[int] = None
 
 @dataclass
 class Directories:
@@ -60,6 +88,31 @@ class Directories:
     tmp_overrides: Optional[Dict[str, TmpOverrides]] = None
     archive: Optional[Archive] = None
 
+@dataclass
+class PhasePriority:
+    nice: int = 15  # If not explicit, jobs run at nice 15
+    ionice_class: Optional[str] = field(  # If not explicit, leave the I/O priority alone
+        default=None,
+        metadata=desert.metadata(marshmallow.fields.String(
+            allow_none=True,
+            validate=marshmallow.validate.OneOf(['none', 'realtime', 'best-effort', 'idle']))))
+    ionice_level: int = 4  # If not explicit, the kernel's default level
+
+@dataclass
+class Priority:
+    phases: Dict[int, PhasePriority] = field(default_factory=dict)  # By major phase
+    busy_nice: Optional[int] = None  # If not explicit, phase-1 jobs are not held back
+    busy_cpu_percent: float = 90.0  # If not explicit, the CPU is busy at 90% utilization
+
+@dataclass
+class Throttling:
+    suspend_cpu_percent: Optional[float] = None  # If not explicit, don't suspend jobs for CPU load
+    resume_cpu_percent: float = 75.0
+    suspend_device_utilization: Optional[float] = None  # If not explicit, don't suspend jobs for tmp device load
+    resume_device_utilization: float = 0.6
+    suspend_for_dst_copy: bool = False
+    min_suspend_s: int = 300  # If not explicit, keep jobs suspended for at least 5 minutes
+
 @dataclass
 class Scheduling:
     global_max_jobs: int
@@ -69,6 +122,16 @@ class Scheduling:
     tmpdir_stagger_phase_major: int
     tmpdir_stagger_phase_minor: int
     tmpdir_stagger_phase_limit: int = 1  # If not explicit, "tmpdir_stagger_phase_limit" will default to 1
+    log_watcher: str = 'auto'  # If not explicit, use inotify where available, else poll
+    batch_admission: bool = False  # If not explicit, start at most one job per pass
+    predictive_planning: bool = False  # If not explicit, plot to the oldest eligible tmpdir
+    max_device_utilization: Optional[float] = None  # If not explicit, ignore device load
+    admission_control: bool = False  # If not explicit, don't check for free CPUs and memory
+    cpu_oversubscription: float = 1.0  # If not explicit, allow one job thread per CPU
+    reserve_space: bool = True  # If not explicit, skip dirs without room for another plot
+    priority: Optional[Priority] = None  # If not explicit, start jobs at nice 15 and leave them be
+    numa_pinning: bool = False  # If not explicit, only pin jobs on tmpdirs with a numa_node
+    throttling: Optional[Throttling] = None  # If not explicit, never suspend jobs
 
 @dataclass
 class Plotting:
@@ -83,6 +146,7 @@ class Plotting:
 @dataclass
 class UserInterface:
     use_stty_size: bool
+    dir_usage_ttl_s: int = 0  # If not explicit, rescan dirs on every screen update
 
 @dataclass
 class PlotmanConfig:
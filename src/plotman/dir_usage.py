@@ -0,0 +1,74 @@
+'''Disk usage of plot files in tmp, tmp2 and dst dirs.
+
+Every job in the status report wants to know how much space its files take.
+Rather than have each job scan its dirs, DirUsageCache scans each dir once,
+buckets file sizes by plot ID, and answers every job from that snapshot until
+it is older than the cache's TTL.'''
+
+import os
+import re
+import time
+from typing import Dict, NamedTuple
+
+# Plot files are named e.g. plot-k32-2021-04-04-19-00-<64 hex digit ID>.plot,
+# with temp files adding suffixes such as .table1.tmp, .sort.tmp or .2.tmp.
+PLOT_ID_RE = re.compile(r'-([0-9a-f]{64})\.plot')
+
+
+class DirUsage(NamedTuple):
+    '''Snapshot of one directory (not recursive).'''
+    total_bytes: int
+    bytes_by_plot_id: Dict[str, int]
+    scan_time: float   # time.monotonic() at the end of the scan
+
+
+def scan_dir(d):
+    '''Return a DirUsage for d, which is empty if d does not exist.'''
+    total_bytes = 0
+    bytes_by_plot_id = {}
+    try:
+        with os.scandir(d) as it:
+            for entry in it:
+                try:
+                    size = entry.stat().st_size
+                except FileNotFoundError:
+                    # The file might disappear; this being an estimate we don't care
+                    continue
+                total_bytes += size
+                m = PLOT_ID_RE.search(entry.name)
+                if m:
+                    plot_id = m.group(1)
+                    bytes_by_plot_id[plot_id] = bytes_by_plot_id.get(plot_id, 0) + size
+    except FileNotFoundError:
+        pass
+    return DirUsage(total_bytes, bytes_by_plot_id, time.monotonic())
+
+
+class DirUsageCache:
+    '''Scans each dir at most once per ttl_s seconds.  With ttl_s=None a dir
+       is scanned once for the lifetime of the cache, which suits a single
+       report.  With ttl_s=0 a dir is scanned once per refresh(), e.g. once
+       per screen update however many jobs use it.'''
+
+    def __init__(self, ttl_s=None):
+        self.ttl_s = ttl_s
+        self.snapshots = {}
+
+    def usage(self, d):
+        snapshot = self.snapshots.get(d)
+        if snapshot is None or (
+                self.ttl_s and time.monotonic() - snapshot.scan_time > self.ttl_s):
+            snapshot = scan_dir(d)
+            self.snapshots[d] = snapshot
+        return snapshot
+
+    def refresh(self):
+        '''Start a new screen update.'''
+        if self.ttl_s == 0:
+            self.snapshots = {}
+
+    def plot_bytes(self, d, plot_id):
+        '''Total size of the files belonging to plot_id in dir d.'''
+        if not d:
+            return 0
+        return self.usage(d).bytes_by_plot_id.get(plot_id, 0)
@@ -0,0 +1,141 @@
+'''Fast discovery of processes of interest (e.g. plot jobs).
+
+Walking the process table with psutil and asking every process for its
+command line on every refresh is slow on big machines.  ProcessDiscovery
+instead reads /proc directly, and remembers how each process was classified.
+Processes are keyed by (pid, create time), so a reused PID is classified
+afresh; the command line is only read for processes not seen before.  Where
+/proc is not available (e.g. macOS) it falls back to psutil.
+
+Each refresh also leaves a Snapshot of the processes of interest, by kind,
+with their command lines, so that several consumers can share one walk of
+the process table.'''
+
+import os
+import time
+from typing import NamedTuple
+
+import psutil
+
+PROC_ROOT = '/proc'
+
+# A process that has just been forked may not have exec'd its final command
+# line yet.  Don't trust a negative classification until it is this old.
+MIN_NEGATIVE_CACHE_AGE_S = 5
+
+
+class ProcessKey(NamedTuple):
+    '''Identifies one process over its lifetime.  create_time is in whatever
+       units the discovery source uses, only compare keys from the same one.'''
+    pid: int
+    create_time: float
+
+
+class Snapshot:
+    '''The processes of interest found by one refresh, by kind.'''
+
+    def __init__(self, processes, taken):
+        self.processes = processes   # Map from ProcessKey to (kind, cmdline)
+        self.taken = taken           # time.monotonic() of the refresh
+
+    def keys(self, kind):
+        '''The keys of the processes of a kind, by pid.'''
+        return sorted(key for (key, (k, _)) in self.processes.items() if k == kind)
+
+    def cmdlines(self, kind):
+        '''(ProcessKey, command line) of the processes of a kind, by pid.'''
+        return [(key, self.processes[key][1]) for key in self.keys(kind)]
+
+
+class ProcessDiscovery:
+    '''Find processes whose command line satisfies classify(cmdline), which
+       returns the kind of process (e.g. True, or a name) or else None.'''
+
+    def __init__(self, classify, proc_root=PROC_ROOT):
+        self.classify = classify
+        self.proc_root = proc_root
+        self.use_proc = os.path.isdir(proc_root)
+        self.clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+        # Map from ProcessKey to (kind, command line), or (None, None) if
+        # the process didn't match.
+        self.classified = {}
+        self.last_snapshot = None
+
+        # Stats from the last refresh, for reporting.
+        self.last_refresh_s = 0.0
+        self.last_n_processes = 0
+        self.last_n_classified = 0
+
+    def refresh(self):
+        '''Scan the process table and return the keys of all matching processes.
+           Entries for processes which have disappeared are dropped.'''
+        start = time.perf_counter()
+        now = self._now()
+        classified = {}
+        n_classified = 0
+
+        for pid in self._pids():
+            try:
+                key = ProcessKey(pid, self._create_time(pid))
+                entry = self.classified.get(key)
+                if entry is None:
+                    cmdline = self._cmdline(pid)
+                    kind = self.classify(cmdline)
+                    n_classified += 1
+                    if not kind and now - key.create_time < MIN_NEGATIVE_CACHE_AGE_S:
+                        continue  # Look again next time
+                    entry = (kind, cmdline) if kind else (None, None)
+                classified[key] = entry
+            except (OSError, IndexError, ValueError, psutil.Error):
+                # Processes may terminate between listing and reading; others
+                # are off limits to us.  Either way, ignore them.
+                pass
+
+        self.classified = classified
+        self.last_refresh_s = time.perf_counter() - start
+        self.last_n_processes = len(classified)
+        self.last_n_classified = n_classified
+        self.last_snapshot = Snapshot(
+            { key: entry for (key, entry) in classified.items() if entry[0] },
+            time.monotonic())
+
+        return [key for (key, (kind, _)) in classified.items() if kind]
+
+    def snapshot(self, max_age_s=0):
+        '''A Snapshot no older than max_age_s seconds, refreshing if need be.'''
+        if (self.last_snapshot is None
+                or time.monotonic() - self.last_snapshot.taken > max_age_s):
+            self.refresh()
+        return self.last_snapshot
+
+    def _pids(self):
+        if self.use_proc:
+            return [int(name) for name in os.listdir(self.proc_root) if name.isdigit()]
+        return psutil.pids()
+
+    def _now(self):
+        '''The current time, in the same units as _create_time().'''
+        if self.use_proc:
+            with open(os.path.join(self.proc_root, 'uptime'), 'rb') as f:
+                return float(f.read().split()[0])
+        return time.time()
+
+    def _create_time(self, pid):
+        if self.use_proc:
+            with open(os.path.join(self.proc_root, str(pid), 'stat'), 'rb') as f:
+                stat = f.read()
+            # The command name may contain spaces and parentheses, so split
+            # after the last ')'.  Field 22, starttime, is then at index 19.
+            fields = stat[stat.rindex(b')') + 2:].split()
+            return int(fields[19]) / self.clock_ticks
+        return psutil.Process(pid).create_time()
+
+    def _cmdline(self, pid):
+        if self.use_proc:
+            with open(os.path.join(self.proc_root, str(pid), 'cmdline'), 'rb') as f:
+                args = f.read().split(b'\0')
+            if args and not args[-1]:
+                args.pop()
+            return [arg.decode('utf-8', errors='replace') for arg in args]
+        return psutil.Process(pid).cmdline()
@@ -0,0 +1,119 @@
+'''Block device load, from /proc/diskstats.
+
+DiskStatsSampler reads the kernel's cumulative I/O counters for every block
+device and, from the difference between two samples, works out how busy
+each device is: utilization (the fraction of time it had I/O in flight, as
+in iostat's %util), average queue depth, and read/write throughput.  Dirs
+are mapped to the device they live on by their st_dev.  Where there is no
+/proc/diskstats (e.g. macOS), no loads are known.'''
+
+import os
+import time
+from typing import NamedTuple
+
+DISKSTATS_PATH = '/proc/diskstats'
+
+SECTOR_BYTES = 512
+
+# Samples closer together than this are ignored, so loads are averaged over
+# a meaningful interval even if sample() is called in a tight loop.
+MIN_INTERVAL_S = 1.0
+
+
+class DiskCounters(NamedTuple):
+    '''The cumulative counters of one /proc/diskstats line that we use.'''
+    sectors_read: int
+    sectors_written: int
+    in_flight: int
+    io_ms: int
+    weighted_io_ms: int
+
+
+class DeviceLoad(NamedTuple):
+    '''How busy a device was between two samples.'''
+    utilization: float     # 0 to 1
+    queue_depth: float     # Average number of requests in flight
+    in_flight: int         # Requests in flight at the last sample
+    read_bytes_s: float
+    write_bytes_s: float
+
+
+def read_diskstats(path=DISKSTATS_PATH):
+    '''Return a map from (major, minor) to DiskCounters, empty if path
+       does not exist.'''
+    result = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 14:
+                    continue
+                # major minor name reads reads_merged sectors_read ms_reading
+                # writes writes_merged sectors_written ms_writing in_flight
+                # io_ms weighted_io_ms [discard and flush fields]
+                result[(int(fields[0]), int(fields[1]))] = DiskCounters(
+                    sectors_read=int(fields[5]),
+                    sectors_written=int(fields[9]),
+                    in_flight=int(fields[11]),
+                    io_ms=int(fields[12]),
+                    weighted_io_ms=int(fields[13]))
+    except FileNotFoundError:
+        pass
+    return result
+
+def device_load(before, after, interval_s):
+    '''The DeviceLoad implied by two DiskCounters interval_s apart.'''
+    interval_ms = interval_s * 1000
+    return DeviceLoad(
+        utilization=min(1.0, (after.io_ms - before.io_ms) / interval_ms),
+        queue_depth=(after.weighted_io_ms - before.weighted_io_ms) / interval_ms,
+        in_flight=after.in_flight,
+        read_bytes_s=(after.sectors_read - before.sectors_read) * SECTOR_BYTES / interval_s,
+        write_bytes_s=(after.sectors_written - before.sectors_written) * SECTOR_BYTES / interval_s)
+
+
+class DiskStatsSampler:
+    def __init__(self, path=DISKSTATS_PATH, clock=time.monotonic):
+        self.path = path
+        self.clock = clock
+        self.devices = {}         # Map from dir to (major, minor), or None
+        self.last_counters = None
+        self.last_sample_time = None
+        self.loads = {}           # Map from (major, minor) to DeviceLoad
+
+    def sample(self):
+        '''Read the counters, and update the loads if the previous sample is
+           at least MIN_INTERVAL_S old.'''
+        now = self.clock()
+        if self.last_sample_time is not None and now - self.last_sample_time < MIN_INTERVAL_S:
+            return
+        counters = read_diskstats(self.path)
+        if self.last_counters is not None:
+            interval_s = now - self.last_sample_time
+            self.loads = { dev: device_load(self.last_counters[dev], c, interval_s)
+                           for (dev, c) in counters.items() if dev in self.last_counters }
+        self.last_counters = counters
+        self.last_sample_time = now
+
+    def device(self, d):
+        '''(major, minor) of the device holding dir d, or None if d is missing.'''
+        if d not in self.devices:
+            try:
+                st_dev = os.stat(d).st_dev
+                self.devices[d] = (os.major(st_dev), os.minor(st_dev))
+            except FileNotFoundError:
+                return None
+        return self.devices[d]
+
+    def load(self, d):
+        '''The DeviceLoad of the device holding dir d, or None if unknown.'''
+        dev = self.device(d)
+        return self.loads.get(dev) if dev is not None else None
+
+    def saturated(self, d, max_utilization):
+        '''Whether the device holding dir d is busier than max_utilization.
+           Devices we know nothing about are not.'''
+        if max_utilization is None:
+            return False
+        load = self.load(d)
+        return load is not None and load.utilization > max_utilization
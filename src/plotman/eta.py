@@ -0,0 +1,177 @@
+'''Remaining-time estimates for running plot jobs.
+
+PhaseHistory collects how long each phase took in completed plots, from their
+logfiles.  Estimator combines that with when a running job reached its
+current phase/subphase (see Job.phase_time()) to predict when it will reach
+a later phase, when it will finish, and so when each dst dir will next have
+a plot written to it.'''
+
+import os
+import statistics
+import time
+
+from plotman import log_parser
+
+PHASES = (1, 2, 3, 4)
+
+# Number of subphases in each phase, see log_parser.TableComputed.  Progress
+# within a phase is estimated as if its subphases took equally long.
+N_SUBPHASES = {1: 8, 2: 6, 3: 7, 4: 1}
+
+# The phase tuple a job reaches when it is done, i.e. its plot is in dst.
+DONE = (5, 0)
+
+# Use per-tmpdir history once there are this many completed plots for a tmpdir.
+MIN_TMPDIR_SAMPLES = 3
+
+
+class PhaseHistory:
+    '''Per-phase durations of plots completed in the past.'''
+
+    def __init__(self):
+        # Map from logfile path to its (size, mtime) when loaded, and to the
+        # list of (tmpdir, {phase: seconds}) for the plots completed in it.
+        self.logfile_stats = {}
+        self.logfile_plots = {}
+        self._medians = {}
+        self._counts = {}
+
+    def load_logfile(self, path):
+        '''(Re)load the completed plots recorded in one logfile.'''
+        plots = []
+        tmpdir = None
+        phase_time = {}
+        with open(path, 'r', errors='replace') as f:
+            for event in log_parser.parse_lines(f):
+                if isinstance(event, log_parser.PlotStarted):
+                    phase_time = {}
+                elif isinstance(event, log_parser.TmpDirs):
+                    tmpdir = event.tmpdir
+                elif isinstance(event, log_parser.PhaseTime):
+                    phase_time[event.phase] = event.seconds
+                elif isinstance(event, log_parser.TotalTime):
+                    if all(p in phase_time for p in PHASES):
+                        plots.append((tmpdir, phase_time))
+                    phase_time = {}
+        self.logfile_plots[path] = plots
+        self._medians = {}
+        self._counts = {}
+
+    def load_logdir(self, logdir, exclude=()):
+        '''Load every logfile in logdir which is new or changed since it was
+           last loaded.  Pass the logfiles of running jobs as exclude, since
+           they hold no completed plots yet and change all the time.'''
+        try:
+            entries = list(os.scandir(logdir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.path in exclude or not entry.is_file():
+                continue
+            stat = entry.stat()
+            signature = (stat.st_size, stat.st_mtime)
+            if self.logfile_stats.get(entry.path) != signature:
+                self.load_logfile(entry.path)
+                self.logfile_stats[entry.path] = signature
+
+    def n_plots(self, tmpdir=None):
+        if tmpdir not in self._counts:
+            self._counts[tmpdir] = sum(1 for plots in self.logfile_plots.values()
+                                       for (d, _) in plots if tmpdir is None or d == tmpdir)
+        return self._counts[tmpdir]
+
+    def phase_times(self, tmpdir=None):
+        '''The {phase: seconds} of each completed plot made on tmpdir if there
+           are enough of them, otherwise of all completed plots.'''
+        if tmpdir is not None and self.n_plots(tmpdir) < MIN_TMPDIR_SAMPLES:
+            tmpdir = None
+        return [phase_time
+                for plots in self.logfile_plots.values()
+                for (d, phase_time) in plots
+                if tmpdir is None or d == tmpdir]
+
+    def expected_phase_s(self, phase, tmpdir=None):
+        '''Median duration of a phase, over plots made on tmpdir if there are
+           enough of them, otherwise over all plots.  None without history.'''
+        if tmpdir is not None and self.n_plots(tmpdir) < MIN_TMPDIR_SAMPLES:
+            tmpdir = None
+        key = (phase, tmpdir)
+        if key not in self._medians:
+            durations = [phase_time[phase] for phase_time in self.phase_times(tmpdir)]
+            self._medians[key] = statistics.median(durations) if durations else None
+        return self._medians[key]
+
+
+class Estimator:
+    '''Predicts job progress from a PhaseHistory.  All times are in seconds
+       since the epoch, durations in seconds.'''
+
+    def __init__(self, history):
+        self.history = history
+
+    def phase_offset_s(self, phase, tmpdir=None):
+        '''Expected time from the start of a job until it reaches the given
+           phase tuple, or None if the history is lacking.'''
+        (ph, subph) = phase
+        offset = 0.0
+        for p in PHASES:
+            if p > ph:
+                break
+            duration = self.history.expected_phase_s(p, tmpdir)
+            if duration is None:
+                return None
+            if p < ph:
+                offset += duration
+            else:
+                offset += duration * min(subph, N_SUBPHASES[p]) / N_SUBPHASES[p]
+        return offset
+
+    def time_to_phase(self, job, target, now=None):
+        '''Expected seconds until job reaches the target phase tuple: 0 if it
+           already has, None if we can't tell.'''
+        current = job.progress()
+        if current[0] is None or current[1] is None:
+            return None
+        if current >= target:
+            return 0.0
+
+        start = self.phase_offset_s(current, job.tmpdir)
+        end = self.phase_offset_s(target, job.tmpdir)
+        if start is None or end is None:
+            return None
+
+        # Credit the time already spent in the current subphase, but no more
+        # than that subphase is expected to take.
+        elapsed = 0.0
+        reached = job.phase_time(current)
+        if reached is not None and current[0] in N_SUBPHASES:
+            now = time.time() if now is None else now
+            subphase_s = (self.history.expected_phase_s(current[0], job.tmpdir)
+                          / N_SUBPHASES[current[0]])
+            elapsed = min(max(now - reached, 0.0), subphase_s)
+
+        return max(end - start - elapsed, 0.0)
+
+    def remaining_s(self, job, now=None):
+        '''Expected seconds until the job is done, or None.'''
+        return self.time_to_phase(job, DONE, now)
+
+    def finish_time(self, job, now=None):
+        '''Expected time at which the job is done, or None.'''
+        now = time.time() if now is None else now
+        remaining = self.remaining_s(job, now)
+        return None if remaining is None else now + remaining
+
+    def dst_write_etas(self, jobs, now=None):
+        '''Return a map from dst dir to the sorted expected times at which the
+           jobs writing to it will have put their plots there.  Jobs we can't
+           estimate are left out.'''
+        now = time.time() if now is None else now
+        result = {}
+        for j in jobs:
+            finish = self.finish_time(j, now)
+            if finish is not None:
+                result.setdefault(j.dstdir, []).append(finish)
+        for etas in result.values():
+            etas.sort()
+        return result
@@ -6,7 +6,7 @@ import os
 import subprocess
 import threading
 
-from plotman import archive, configuration, manager, reporting
+from plotman import archive_daemon, bandwidth, configuration, dir_usage, diskstats, eta, log_watcher, manager, placement, planner, priority, processes, reporting, throttle, transfer_progress
 from plotman.job import Job
 
 
@@ -81,6 +81,11 @@ def curses_main(stdscr):
     jobs_win = curses.newwin(1, 1, 1, 0)
     dirs_win = curses.newwin(1, 1, 1, 0)
 
+    # Jobs are updated as their logfiles are written to, rather than by
+    # re-reading every logfile on each refresh.  Start watching before the
+    # first scan so no output is missed.
+    watcher = log_watcher.LogWatcher(cfg.directories.log, cfg.scheduling.log_watcher)
+
     jobs = Job.get_running_jobs(cfg.directories.log)
     last_refresh = None
 
@@ -88,11 +93,43 @@ def curses_main(stdscr):
 
     archdir_freebytes = None
 
+    # Archives completed plots, retrying failed ones, and adjusts transfers'
+    # bandwidth under archive.bandwidth.  Archive dir free space is asked of
+    # the archive host in the background so a slow host doesn't hold up the
+    # screen.
+    archiver = archive_daemon.ArchiveDaemon(bandwidth=bandwidth.BandwidthController())
+
+    # Follows the running archive transfers' progress in the background.
+    transfer_monitor = transfer_progress.TransferMonitor()
+    if archiving_configured:
+        transfer_monitor.start()
+
+    # Shared by all jobs in the status report, so each dir is scanned once.
+    usage_cache = dir_usage.DirUsageCache(cfg.user_interface.dir_usage_ttl_s)
+
+    # Completed plots' phase timings, for job ETAs.  Only new logfiles are
+    # loaded on each full refresh.
+    history = eta.PhaseHistory()
+    estimator = eta.Estimator(history)
+    plot_planner = planner.Planner(history)
+
+    # Device load, for the dir reports and max_device_utilization.
+    disk_sampler = diskstats.DiskStatsSampler()
+
+    # Adjusts jobs' nice and ionice as they progress, for scheduling.priority.
+    priorities = priority.PriorityController()
+
+    # NUMA nodes, to show which one each job is pinned to.
+    topology = placement.read_topology()
+
+    # Suspends and resumes jobs under contention, for scheduling.throttling.
+    job_throttle = throttle.Throttle()
+
     while True:
 
-        # A full refresh scans for and reads info for running jobs from
-        # scratch (i.e., reread their logfiles).  Otherwise we'll only
-        # initialize new jobs, and mostly rely on cached info.
+        # A full refresh scans for running jobs and updates them with any
+        # new logfile output.  Otherwise we'll only initialize new jobs, and
+        # mostly rely on cached info.
         do_full_refresh = False
         elapsed = 0    # Time since last refresh, or zero if no prev. refresh
         if last_refresh is None:
@@ -101,47 +138,54 @@ def curses_main(stdscr):
             elapsed = (datetime.datetime.now() - last_refresh).total_seconds() 
             do_full_refresh = elapsed >= cfg.scheduling.polling_time_s
 
-        if not do_full_refresh:
-            jobs = Job.get_running_jobs(cfg.directories.log, cached_jobs=jobs)
-
-        else:
+        (phase_changes, _) = watcher.poll(jobs)
+        for change in phase_changes:
+            log.log('%s phase %s -> %s' % (change.job.plot_id[:8],
+                reporting.phase_str(change.old_phase), reporting.phase_str(change.new_phase)))
+
+        # One walk of the process table for the jobs and archive transfers.
+        snapshot = processes.snapshot()
+        jobs = Job.get_running_jobs(cfg.directories.log, cached_jobs=jobs, snapshot=snapshot)
+        disk_sampler.sample()
+        for msg in priorities.apply(cfg.scheduling.priority, jobs):
+            log.log(msg)
+        for msg in job_throttle.apply(cfg.scheduling.throttling, jobs, disk_sampler):
+            log.log(msg)
+
+        if do_full_refresh:
             last_refresh = datetime.datetime.now()
-            jobs = Job.get_running_jobs(cfg.directories.log)
+            history.load_logdir(cfg.directories.log, exclude={j.logfile for j in jobs})
 
             if plotting_active:
-                (started, msg) = manager.maybe_start_new_plot(
-                    cfg.directories, cfg.scheduling, cfg.plotting
+                choose_tmpdir = None
+                if cfg.scheduling.predictive_planning:
+                    choose_tmpdir = plot_planner.tmpdir_chooser(cfg.directories, cfg.scheduling)
+                (logmsgs, wait_reason) = manager.start_new_plots(
+                    cfg.directories, cfg.scheduling, cfg.plotting, jobs, choose_tmpdir,
+                    disk_sampler
                 )
-                if (started):
-                    log.log(msg)
-                    plotting_status = '<just started job>'
-                    jobs = Job.get_running_jobs(cfg.directories.log, cached_jobs=jobs)
+                if logmsgs:
+                    for msg in logmsgs:
+                        log.log(msg)
+                    plotting_status = '<just started %d job(s)>' % len(logmsgs)
+                    snapshot = processes.snapshot()
+                    jobs = Job.get_running_jobs(
+                        cfg.directories.log, cached_jobs=jobs, snapshot=snapshot)
                 else:
-                    plotting_status = msg
+                    plotting_status = wait_reason
 
             if archiving_configured:
                 if archiving_active:
-                    # Look for running archive jobs.  Be robust to finding more than one
-                    # even though the scheduler should only run one at a time.
-                    arch_jobs = archive.get_running_archive_jobs(cfg.directories.archive)
-                    if arch_jobs:
-                        archiving_status = 'pid: ' + ', '.join(map(str, arch_jobs))
-                    else:
-                        (should_start, status_or_cmd) = archive.archive(cfg.directories, jobs)
-                        if not should_start:
-                            archiving_status = status_or_cmd
-                        else:
-                            cmd = status_or_cmd
-                            log.log('Starting archive: ' + cmd)
-
-                            # TODO: do something useful with output instead of DEVNULL
-                            p = subprocess.Popen(cmd,
-                                    shell=True,
-                                    stdout=subprocess.DEVNULL,
-                                    stderr=subprocess.STDOUT,
-                                    start_new_session=True)
-
-                archdir_freebytes = archive.get_archdir_freebytes(cfg.directories.archive)
+                    # Start as many transfers as archive.max_transfers allows
+                    # on top of those running.
+                    (logmsgs, archiving_status, transfers) = archiver.step(
+                        cfg.directories, jobs, snapshot, disk_sampler)
+                    for msg in logmsgs:
+                        log.log(msg)
+                    transfer_monitor.watch(transfers)
+
+                archdir_freebytes = archiver.free_space.freebytes(
+                    cfg.directories.archive, wait=False)
 
 
         # Get terminal size.  Recommended method is stdscr.getmaxyx(), but this
@@ -182,15 +226,23 @@ def curses_main(stdscr):
 
         # Directory reports.
         tmp_report_1 = reporting.tmp_dir_report(
-            jobs, cfg.directories, cfg.scheduling, n_cols, 0, n_tmpdirs_half, tmp_prefix)
+            jobs, cfg.directories, cfg.scheduling, n_cols, 0, n_tmpdirs_half, tmp_prefix,
+            disk_sampler)
         tmp_report_2 = reporting.tmp_dir_report(
-            jobs, cfg.directories, cfg.scheduling, n_cols, n_tmpdirs_half, n_tmpdirs, tmp_prefix)
+            jobs, cfg.directories, cfg.scheduling, n_cols, n_tmpdirs_half, n_tmpdirs, tmp_prefix,
+            disk_sampler)
         dst_report = reporting.dst_dir_report(
-            jobs, cfg.directories.dst, n_cols, dst_prefix)
-        if archiving_configured:
+            jobs, cfg.directories.dst, n_cols, dst_prefix, disk_sampler)
+        if archiving_configured and archdir_freebytes is None:
+            arch_report = '<waiting for archive dir info>'
+        elif archiving_configured:
             arch_report = reporting.arch_dir_report(archdir_freebytes, n_cols, arch_prefix)
             if not arch_report:
                 arch_report = '<no archive dir info>'
+            transfer_stats = transfer_monitor.stats()
+            if transfer_stats:
+                arch_report += '\n' + reporting.transfer_report(
+                    transfer_stats, n_cols, dst_prefix, arch_prefix)
         else:
             arch_report = '<archiving not configured>'
 
@@ -239,7 +291,11 @@ def curses_main(stdscr):
         header_win.addnstr(0, 0, 'Plotman', linecap, curses.A_BOLD)
         timestamp = datetime.datetime.now().strftime("%H:%M:%S")
         refresh_msg = "now" if do_full_refresh else f"{int(elapsed)}s/{cfg.scheduling.polling_time_s}"
-        header_win.addnstr(f" {timestamp} (refresh {refresh_msg})", linecap)
+        scan_ms = int(processes.process_discovery.last_refresh_s * 1000)
+        n_other_chia = len(snapshot.keys(processes.CHIA))
+        other_chia_msg = f", other chia procs {n_other_chia}" if n_other_chia else ""
+        header_win.addnstr(f" {timestamp} (refresh {refresh_msg}, scan {scan_ms}ms, "
+                           f"logs {watcher.backend_name}{other_chia_msg})", linecap)
         header_win.addnstr('  |  <P>lotting: ', linecap, curses.A_BOLD)
         header_win.addnstr(
                 plotting_status_msg(plotting_active, plotting_status), linecap)
@@ -268,8 +324,9 @@ def curses_main(stdscr):
         
 
         # Jobs
+        usage_cache.refresh()
         jobs_win.addstr(0, 0, reporting.status_report(jobs, n_cols, jobs_h, 
-            tmp_prefix, dst_prefix))
+            tmp_prefix, dst_prefix, usage_cache, estimator, topology))
         jobs_win.chgat(0, 0, curses.A_REVERSE)
 
         # Dirs
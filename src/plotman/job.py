@@ -11,10 +11,14 @@ import time
 from datetime import datetime
 from enum import Enum, auto
 from subprocess import call
+from typing import NamedTuple, Optional
 
 import pendulum
 import psutil
 
+from plotman import dir_usage, log_parser, processes
+from plotman.processes import is_plotting_cmdline
+
 
 def job_phases_for_tmpdir(d, all_jobs):
     '''Return phase 2-tuples for jobs running on tmpdir d'''
@@ -24,15 +28,6 @@ def job_phases_for_dstdir(d, all_jobs):
     '''Return phase 2-tuples for jobs outputting to dstdir d'''
     return sorted([j.progress() for j in all_jobs if j.dstdir == d])
 
-def is_plotting_cmdline(cmdline):
-    return (
-        len(cmdline) >= 4
-        and 'python' in cmdline[0]
-        and cmdline[1].endswith('/chia')
-        and 'plots' == cmdline[2]
-        and 'create' == cmdline[3]
-    )
-
 # This is a cmdline argument fix for https://github.com/ericaltendorf/plotman/issues/41
 def cmdline_argfix(cmdline):
     known_keys = 'krbut2dne'
@@ -48,14 +43,30 @@ def cmdline_argfix(cmdline):
         else:
             yield i
 
+# Number of already-consumed logfile bytes to recheck on each incremental read.
+LOGFILE_TAIL_BYTES = 64
+
 def parse_chia_plot_time(s):
     # This will grow to try ISO8601 as well for when Chia logs that way
     return pendulum.from_format(s, 'ddd MMM DD HH:mm:ss YYYY', locale='en', tz=None)
 
-# TODO: be more principled and explicit about what we cache vs. what we look up
-# dynamically from the logfile
+class ProcMetrics(NamedTuple):
+    '''Process metrics of a job, sampled together by Job.sample_metrics().'''
+    time_wall: int
+    run_status: str
+    mem_usage: int
+    time_user: int
+    time_sys: int
+    time_iowait: Optional[int]
+
 class Job:
-    'Represents a plotter job'
+    '''Represents a plotter job.
+
+       Attributes fall into three groups: constants fixed when the job is
+       found, info cached from the logfile and updated incrementally by
+       update_from_logfile(), and process metrics which are looked up
+       dynamically, either one at a time with the get_*() methods or all at
+       once with sample_metrics().'''
 
     # These are constants, not updated during a run.
     k = 0
@@ -69,31 +80,61 @@ class Job:
     logfile = ''
     jobfile = ''
     job_id = 0
-    plot_id = '--------'
     proc = None   # will get a psutil.Process
+    process_key = None   # discovery.ProcessKey, identifies proc across PID reuse
+    create_time = None   # Process start, seconds since the epoch
     help = False
 
-    # These are dynamic, cached, and need to be udpated periodically
+    # These are cached from the logfile, and updated by update_from_logfile()
+    plot_id = '--------'
     phase = (None, None)   # Phase/subphase
+    start_time = None
+
+    # Logfile info not seen yet, e.g. {'plot_id', 'start_time'} for a job which
+    # has just started.  Updates fill these in as they get logged.
+    metadata_pending = frozenset()
 
-    def get_running_jobs(logroot, cached_jobs=()):
+    # These are dynamic; the last sample_metrics() result, or None
+    metrics = None
+
+    # Why the job is suspended, if plotman suspended it
+    status_note = ''
+
+    # Timing of phases, see reset_logfile_state()
+    phase_times = None
+    phase_durations = None
+    last_log_time = None
+
+    # Incremental logfile parsing state, see read_new_logfile_lines()
+    logfile_inode = None
+    logfile_offset = 0     # Bytes of the logfile consumed so far
+    logfile_tail = b''     # Last bytes consumed, to detect rewrites
+    logfile_partial = b''  # Incomplete last line, awaiting its newline
+    phase_subphases = None
+
+    def get_running_jobs(logroot, cached_jobs=(), snapshot=None):
         '''Return a list of running plot jobs.  If a cache of preexisting jobs is provided,
-           reuse those previous jobs without updating their information.  Always look for
-           new jobs not already in the cache.'''
+           reuse those previous jobs without updating their information (see
+           log_watcher.LogWatcher for that).  Always look for new jobs not
+           already in the cache.  Jobs are found in the given
+           discovery.Snapshot, or else in a fresh one.'''
         jobs = []
-        cached_jobs_by_pid = { j.proc.pid: j for j in cached_jobs }
+        cached_jobs_by_key = { j.process_key: j for j in cached_jobs }
+        if snapshot is None:
+            snapshot = processes.snapshot()
 
-        for proc in psutil.process_iter(['pid', 'cmdline']):
+        for key in snapshot.keys(processes.PLOT):
             # Ignore processes which most likely have terminated between the time of
-            # iteration and data access.
+            # discovery and data access.
             with contextlib.suppress(psutil.NoSuchProcess, psutil.AccessDenied):
-                if is_plotting_cmdline(proc.cmdline()):
-                    if proc.pid in cached_jobs_by_pid.keys():
-                        jobs.append(cached_jobs_by_pid[proc.pid])  # Copy from cache
-                    else:
-                        job = Job(proc, logroot)
-                        if not job.help:
-                            jobs.append(job)
+                if key in cached_jobs_by_key.keys():
+                    job = cached_jobs_by_key[key]  # Copy from cache
+                    jobs.append(job)
+                else:
+                    job = Job(psutil.Process(key.pid), logroot)
+                    job.process_key = key
+                    if not job.help:
+                        jobs.append(job)
 
         return jobs
 
@@ -103,6 +144,8 @@ class Job:
         self.proc = proc
 
         with self.proc.oneshot():
+            self.create_time = self.proc.create_time()
+
             # Parse command line args
             args = self.proc.cmdline()
             assert len(args) > 4
@@ -162,88 +205,129 @@ class Job:
 
     def init_from_logfile(self):
         '''Read plot ID and job start time from logfile.  Return true if we
-           find all the info as expected, false otherwise'''
+           find all the info as expected, false otherwise.  This never waits:
+           a job that is just getting started (e.g. still scanning existing plot
+           dirs, which is slow on NFS) may not have logged them yet, in which
+           case later updates fill them in as they appear.'''
         assert self.logfile
-        # Try reading for a while; it can take a while for the job to get started as it scans
-        # existing plot dirs (especially if they are NFS).
-        found_id = False
-        found_log = False
-        for attempt_number in range(3):
-            with open(self.logfile, 'r') as f:
-                for line in f:
-                    m = re.match('^ID: ([0-9a-f]*)', line)
-                    if m:
-                        self.plot_id = m.group(1)
-                        found_id = True
-                    m = re.match(r'^Starting phase 1/4:.*\.\.\. (.*)', line)
-                    if m:
-                        # Mon Nov  2 08:39:53 2020
-                        self.start_time = parse_chia_plot_time(m.group(1))
-                        found_log = True
-                        break  # Stop reading lines in file
-
-            if found_id and found_log:
-                break  # Stop trying
-            else:
-                time.sleep(1)  # Sleep and try again
+        self.metadata_pending = frozenset(['plot_id', 'start_time'])
+        with open(self.logfile, 'r') as f:
+            for event in log_parser.parse_lines(f):
+                if isinstance(event, log_parser.PlotId):
+                    self.plot_id = event.plot_id
+                    self.metadata_pending = self.metadata_pending - {'plot_id'}
+                elif (isinstance(event, log_parser.PhaseStarted)
+                        and event.phase == 1 and event.timestamp):
+                    # Mon Nov  2 08:39:53 2020
+                    self.start_time = parse_chia_plot_time(event.timestamp)
+                    self.metadata_pending = self.metadata_pending - {'start_time'}
+                    break  # Stop reading lines in file
 
         # If we couldn't find the line in the logfile, the job is probably just getting started
-        # (and being slow about it).  In this case, use the last metadata change as the start time.
-        # TODO: we never come back to this; e.g. plot_id may remain uninitialized.
-        # TODO: should we just use the process start time instead?
-        if not found_log:
+        # (and being slow about it).  In the meantime, use the last metadata change as the start time.
+        if 'start_time' in self.metadata_pending:
             self.start_time = datetime.fromtimestamp(os.path.getctime(self.logfile))
 
         # Load things from logfile that are dynamic
         self.update_from_logfile()
 
+        return not self.metadata_pending
+
     def update_from_logfile(self):
         self.set_phase_from_logfile()
 
-    def set_phase_from_logfile(self):
-        assert self.logfile
-
+    def reset_logfile_state(self):
+        '''Forget everything parsed so far, so the next update rereads the
+           logfile from the beginning.'''
+        self.logfile_inode = None
+        self.logfile_offset = 0
+        self.logfile_tail = b''
+        self.logfile_partial = b''
         # Map from phase number to subphase number reached in that phase.
         # Phase 1 subphases are <started>, table1, table2, ...
         # Phase 2 subphases are <started>, table7, table6, ...
         # Phase 3 subphases are <started>, tables1&2, tables2&3, ...
         # Phase 4 subphases are <started>
-        phase_subphases = {}
+        self.phase_subphases = {}
+        # Map from phase tuple to when the job reached it (seconds since the
+        # epoch), and from phase number to its duration as logged on completion.
+        self.phase_times = {}
+        self.phase_durations = {}
+        # The most recent time logged by chia, seconds since the epoch.
+        self.last_log_time = None
+
+    def read_new_logfile_lines(self):
+        '''Return the complete lines appended to the logfile since the last
+           call.  Parsing state is reset first if the logfile was truncated or
+           replaced (e.g. rotated) in the meantime.'''
+        try:
+            stat = os.stat(self.logfile)
+        except FileNotFoundError:
+            return []
+
+        if self.logfile_inode != stat.st_ino or stat.st_size < self.logfile_offset:
+            self.reset_logfile_state()
+            self.logfile_inode = stat.st_ino
+
+        if stat.st_size == self.logfile_offset:
+            return []
+
+        with open(self.logfile, 'rb') as f:
+            # Reread the last few bytes we already consumed.  If they changed,
+            # the file was truncated and rewritten past our offset.
+            f.seek(self.logfile_offset - len(self.logfile_tail))
+            if f.read(len(self.logfile_tail)) != self.logfile_tail:
+                self.reset_logfile_state()
+                self.logfile_inode = stat.st_ino
+                f.seek(0)
+            data = f.read()
+
+        if not data:
+            return []
+        self.logfile_offset += len(data)
+        self.logfile_tail = (self.logfile_tail + data)[-LOGFILE_TAIL_BYTES:]
+
+        # Hold back a trailing partial line until the rest of it is written.
+        lines = (self.logfile_partial + data).split(b'\n')
+        self.logfile_partial = lines.pop()
+        return [line.decode('utf-8', errors='replace') for line in lines]
 
-        with open(self.logfile, 'r') as f:
-            for line in f:
-                # "Starting phase 1/4: Forward Propagation into tmp files... Sat Oct 31 11:27:04 2020"
-                m = re.match(r'^Starting phase (\d).*', line)
-                if m:
-                    phase = int(m.group(1))
-                    phase_subphases[phase] = 0
-
-                # Phase 1: "Computing table 2"
-                m = re.match(r'^Computing table (\d).*', line)
-                if m:
-                    phase_subphases[1] = max(phase_subphases[1], int(m.group(1)))
-
-                # Phase 2: "Backpropagating on table 2"
-                m = re.match(r'^Backpropagating on table (\d).*', line)
-                if m:
-                    phase_subphases[2] = max(phase_subphases[2], 7 - int(m.group(1)))
-
-                # Phase 3: "Compressing tables 4 and 5"
-                m = re.match(r'^Compressing tables (\d) and (\d).*', line)
-                if m:
-                    phase_subphases[3] = max(phase_subphases[3], int(m.group(1)))
-
-                # TODO also collect timing info:
-
-                # "Time for phase 1 = 22796.7 seconds. CPU (98%) Tue Sep 29 17:57:19 2020"
-                # for phase in ['1', '2', '3', '4']:
-                    # m = re.match(r'^Time for phase ' + phase + ' = (\d+.\d+) seconds..*', line)
-                        # data.setdefault....
-
-                # Total time = 49487.1 seconds. CPU (97.26%) Wed Sep 30 01:22:10 2020
-                # m = re.match(r'^Total time = (\d+.\d+) seconds.*', line)
-                # if m:
-                    # data.setdefault(key, {}).setdefault('total time', []).append(float(m.group(1)))
+    def set_phase_from_logfile(self):
+        '''Update the phase from logfile output written since the last update.
+           Cost is proportional to the new output, not the size of the log.'''
+        assert self.logfile
+
+        if self.phase_subphases is None:
+            self.reset_logfile_state()
+
+        # Read first: this may reset the parsing state.
+        lines = self.read_new_logfile_lines()
+        phase_subphases = self.phase_subphases
+        for event in log_parser.parse_lines(lines):
+            # Only some lines carry a timestamp, but every table is started
+            # right after a line logging the time the previous step finished.
+            # Lines without one are timed by the last timestamp seen, or if
+            # there is none yet, by when we read them.
+            if isinstance(event, log_parser.TIMESTAMPED_EVENTS) and event.timestamp:
+                self.last_log_time = parse_chia_plot_time(event.timestamp).timestamp()
+            event_time = self.last_log_time if self.last_log_time is not None else time.time()
+
+            if isinstance(event, log_parser.PhaseStarted):
+                phase_subphases[event.phase] = 0
+                self.phase_times.setdefault((event.phase, 0), event_time)
+                if (event.phase == 1 and event.timestamp
+                        and 'start_time' in self.metadata_pending):
+                    self.start_time = parse_chia_plot_time(event.timestamp)
+                    self.metadata_pending = self.metadata_pending - {'start_time'}
+            elif isinstance(event, log_parser.PlotId) and 'plot_id' in self.metadata_pending:
+                self.plot_id = event.plot_id
+                self.metadata_pending = self.metadata_pending - {'plot_id'}
+            elif isinstance(event, log_parser.TableComputed):
+                phase_subphases[event.phase] = max(
+                    phase_subphases.get(event.phase, 0), event.subphase)
+                self.phase_times.setdefault((event.phase, event.subphase), event_time)
+            elif isinstance(event, log_parser.PhaseTime):
+                self.phase_durations[event.phase] = event.seconds
 
         if phase_subphases:
             phase = max(phase_subphases.keys())
@@ -255,6 +339,13 @@ class Job:
         '''Return a 2-tuple with the job phase and subphase (by reading the logfile)'''
         return self.phase
 
+    def phase_time(self, phase):
+        '''Return when the job reached the given phase tuple, in seconds since
+           the epoch, or None if it hasn't (or we don't know).'''
+        if not self.phase_times:
+            return None
+        return self.phase_times.get(phase)
+
     def plot_id_prefix(self):
         return self.plot_id[:8]
 
@@ -277,17 +368,25 @@ class Job:
     def get_mem_usage(self):
         return self.proc.memory_info().vms  # Total, inc swapped
 
-    def get_tmp_usage(self):
-        total_bytes = 0
-        with os.scandir(self.tmpdir) as it:
-            for entry in it:
-                if self.plot_id in entry.name:
-                    try:
-                        total_bytes += entry.stat().st_size
-                    except FileNotFoundError:
-                        # The file might disappear; this being an estimate we don't care
-                        pass
-        return total_bytes
+    def get_tmp_usage(self, usage_cache=None):
+        '''Bytes used by this job's files in its tmpdir.  Pass a shared
+           dir_usage.DirUsageCache when asking about several jobs.'''
+        if usage_cache is None:
+            usage_cache = dir_usage.DirUsageCache()
+        return usage_cache.plot_bytes(self.tmpdir, self.plot_id)
+
+    def get_tmp2_usage(self, usage_cache=None):
+        '''Bytes used by this job's files in its tmp2dir, if any.'''
+        if usage_cache is None:
+            usage_cache = dir_usage.DirUsageCache()
+        return usage_cache.plot_bytes(self.tmp2dir, self.plot_id)
+
+    def get_dst_usage(self, usage_cache=None):
+        '''Bytes used by this job's files in its dstdir, i.e. the final plot
+           file as it is being written.'''
+        if usage_cache is None:
+            usage_cache = dir_usage.DirUsageCache()
+        return usage_cache.plot_bytes(self.dstdir, self.plot_id)
 
     def get_run_status(self):
         '''Running, suspended, etc.'''
@@ -304,7 +403,7 @@ class Job:
             return self.proc.status()
 
     def get_time_wall(self):
-        create_time = datetime.fromtimestamp(self.proc.create_time())
+        create_time = datetime.fromtimestamp(self.create_time)
         return int((datetime.now() - create_time).total_seconds())
 
     def get_time_user(self):
@@ -321,12 +420,30 @@ class Job:
 
         return int(iowait)
 
+    def sample_metrics(self):
+        '''Look up all the dynamic process metrics at once, reading the
+           process's /proc entries once rather than once per metric.  The
+           result is also kept in self.metrics.'''
+        with self.proc.oneshot():
+            cpu_times = self.proc.cpu_times()
+            iowait = getattr(cpu_times, 'iowait', None)
+            self.metrics = ProcMetrics(
+                time_wall=self.get_time_wall(),
+                run_status=self.get_run_status(),
+                mem_usage=self.get_mem_usage(),
+                time_user=int(cpu_times.user),
+                time_sys=int(cpu_times.system),
+                time_iowait=int(iowait) if iowait is not None else None,
+            )
+        return self.metrics
+
     def suspend(self, reason=''):
         self.proc.suspend()
         self.status_note = reason
 
     def resume(self):
         self.proc.resume()
+        self.status_note = ''
 
     def get_temp_files(self):
         # Prevent duplicate file paths by using set.
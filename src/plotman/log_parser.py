@@ -0,0 +1,160 @@
+'''Grammar of `chia plots create` logfiles.
+
+Logfiles are turned into a stream of typed events which the job monitor and
+the analyzer both consume.  Lines are dispatched on their first few
+characters, so the vast majority of lines (bucket sorts, and output we don't
+care about) cost one dict lookup and at most one precompiled regex match.'''
+
+import re
+from typing import NamedTuple, Optional
+
+
+class PlotStarted(NamedTuple):
+    '''"Starting plot 1/5" -- a job run with -n > 1 logs several plots.'''
+    seq_num: int
+    seq_total: int
+
+class TmpDirs(NamedTuple):
+    '''"Starting plotting progress into temporary dirs: /mnt/tmp/01 and /mnt/tmp/a"'''
+    tmpdir: str
+    tmp2dir: str
+
+class PlotId(NamedTuple):
+    '''"ID: 3eb8a37981de1cc76187a36ed947ab4307943cf92967a7e166841186c7899e24"'''
+    plot_id: str
+
+class PhaseStarted(NamedTuple):
+    '''"Starting phase 2/4: Backpropagation into tmp files... Sun Apr  4 23:53:42 2021"'''
+    phase: int
+    description: Optional[str]
+    timestamp: Optional[str]   # As logged by chia, see job.parse_chia_plot_time()
+
+class TableComputed(NamedTuple):
+    '''Progress within a phase, as the subphase number used in phase tuples.
+       Phase 1: "Computing table 2" is subphase 2.
+       Phase 2: "Backpropagating on table 6" is subphase 1 (7 - table).
+       Phase 3: "Compressing tables 4 and 5" is subphase 4.'''
+    phase: int
+    subphase: int
+
+class BucketSorted(NamedTuple):
+    '''"Bucket 267 uniform sort. Ram: 0.920GiB, u_sort min: 0.688GiB, qs min: 0.172GiB."
+       or "Bucket 511 QS. Ram: ... force_qs: 1"'''
+    bucket: int
+    sorter: str
+    forced: bool
+
+class StepTime(NamedTuple):
+    '''Duration of a step within a phase, logged just before the next table is
+       started, e.g. "Forward propagation table time: 2305.238 seconds. CPU
+       (191.490%) Sun Apr  4 19:42:29 2021".  Also "F1 complete, time: ...",
+       "scanned time = ...", "sort time = ..." and "Total compress table time: ..."'''
+    seconds: float
+    timestamp: Optional[str]
+
+class PhaseTime(NamedTuple):
+    '''"Time for phase 1 = 22796.7 seconds. CPU (98%) Tue Sep 29 17:57:19 2020"'''
+    phase: int
+    seconds: float
+    timestamp: Optional[str]
+
+class TotalTime(NamedTuple):
+    '''"Total time = 49487.1 seconds. CPU (97.26%) Wed Sep 30 01:22:10 2020"'''
+    seconds: float
+    timestamp: Optional[str]
+
+
+_PLOT_STARTED = re.compile(r'Starting plot (\d+)/(\d+)')
+_TMP_DIRS = re.compile(r'Starting plotting.*dirs: (.*) and (.*)')
+_PLOT_ID = re.compile(r'ID: ([0-9a-f]*)')
+_PHASE_STARTED = re.compile(r'Starting phase (\d)(?:/\d+: (.*?) ?\.\.\. (.*))?')
+_COMPUTING = re.compile(r'Computing table (\d)')
+_BACKPROPAGATING = re.compile(r'Backpropagating on table (\d)')
+_COMPRESSING = re.compile(r'Compressing tables (\d) and (\d)')
+_BUCKET = re.compile(r'\s*Bucket (\d+) ([^.]+)\.')
+_STEP_TIME = re.compile(
+    r'(?:F1 complete, time:|Forward propagation table time:|scanned time =|sort time ='
+    r'|Total compress table time:) +(\d+(?:\.\d+)?) seconds\.(?:.*\) (.*))?')
+_PHASE_TIME = re.compile(r'Time for phase (\d) = (\d+(?:\.\d+)?) seconds\.(?:.*\) (.*))?')
+_TOTAL_TIME = re.compile(r'Total time = (\d+(?:\.\d+)?) seconds\.(?:.*\) (.*))?')
+
+
+def _plot_started(m, line):
+    return PlotStarted(int(m.group(1)), int(m.group(2)))
+
+def _tmp_dirs(m, line):
+    return TmpDirs(m.group(1), m.group(2))
+
+def _plot_id(m, line):
+    return PlotId(m.group(1))
+
+def _phase_started(m, line):
+    return PhaseStarted(int(m.group(1)), m.group(2), m.group(3))
+
+def _computing(m, line):
+    return TableComputed(1, int(m.group(1)))
+
+def _backpropagating(m, line):
+    return TableComputed(2, 7 - int(m.group(1)))
+
+def _compressing(m, line):
+    return TableComputed(3, int(m.group(1)))
+
+def _bucket(m, line):
+    return BucketSorted(int(m.group(1)), m.group(2), 'force_qs' in line)
+
+def _step_time(m, line):
+    return StepTime(float(m.group(1)), m.group(2))
+
+def _phase_time(m, line):
+    return PhaseTime(int(m.group(1)), float(m.group(2)), m.group(3))
+
+def _total_time(m, line):
+    return TotalTime(float(m.group(1)), m.group(2))
+
+
+# Map from the first four characters of a line to the (pattern, event builder)
+# pairs which may match it.  Patterns are tried in order with re.match().
+_DISPATCH = {
+    '\tBuc': ((_BUCKET, _bucket),),
+    'Buck': ((_BUCKET, _bucket),),
+    'Star': ((_PHASE_STARTED, _phase_started), (_TMP_DIRS, _tmp_dirs)),
+    'ID: ': ((_PLOT_ID, _plot_id),),
+    'Comp': ((_COMPUTING, _computing), (_COMPRESSING, _compressing)),
+    'Back': ((_BACKPROPAGATING, _backpropagating),),
+    'Time': ((_PHASE_TIME, _phase_time),),
+    'Tota': ((_TOTAL_TIME, _total_time), (_STEP_TIME, _step_time)),
+    'F1 c': ((_STEP_TIME, _step_time),),
+    'Forw': ((_STEP_TIME, _step_time),),
+    'scan': ((_STEP_TIME, _step_time),),
+    'sort': ((_STEP_TIME, _step_time),),
+}
+
+# Events carrying the time at which they were logged.
+TIMESTAMPED_EVENTS = (PhaseStarted, StepTime, PhaseTime, TotalTime)
+
+def parse_line(line):
+    '''Return the event logged by a single line, or None if there is none.'''
+    handlers = _DISPATCH.get(line[:4])
+    if handlers is not None:
+        for (pattern, build) in handlers:
+            m = pattern.match(line)
+            if m:
+                return build(m, line)
+        return None
+
+    # The plot sequence is logged by the python side of chia, with a
+    # timestamp and logger name in front of it.
+    if 'Starting plot ' in line:
+        m = _PLOT_STARTED.search(line)
+        if m:
+            return _plot_started(m, line)
+
+    return None
+
+def parse_lines(lines):
+    '''Generate the events logged by an iterable of lines, e.g. an open file.'''
+    for line in lines:
+        event = parse_line(line)
+        if event is not None:
+            yield event
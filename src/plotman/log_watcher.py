@@ -0,0 +1,268 @@
+'''Notification of plot job logfile activity.
+
+Rather than re-reading every job's logfile on a timer, LogWatcher waits for
+the log dir to report activity and only updates the jobs whose logfiles were
+written to.  On Linux this uses inotify (through ctypes, so no extra
+dependency), and a job's logfile being closed for writing tells us that the
+job has exited.  Elsewhere, or if inotify is unavailable (e.g. out of
+watches), it falls back to comparing the size and mtime of each job's
+logfile every poll_interval_s seconds.'''
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import NamedTuple, Tuple
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+
+_EVENT_HEADER = struct.Struct('iIII')   # wd, mask, cookie, len
+
+BACKENDS = ('auto', 'inotify', 'poll')
+
+# Without inotify, list the log dir for new logfiles at least this often, in
+# seconds, even if its mtime hasn't changed (e.g. a coarse-grained one).
+RESCAN_S = 60
+
+
+class PhaseChange(NamedTuple):
+    '''A job's phase tuple changed, as seen in its logfile.'''
+    job: object
+    old_phase: Tuple
+    new_phase: Tuple
+
+
+class LogActivity(NamedTuple):
+    '''What happened in the log dir while waiting.  overflow means some
+       events were lost, so any logfile may have changed.'''
+    modified: frozenset
+    closed: frozenset
+    created: frozenset
+    overflow: bool = False
+
+    def __bool__(self):
+        return bool(self.modified or self.closed or self.created or self.overflow)
+
+
+NO_ACTIVITY = LogActivity(frozenset(), frozenset(), frozenset())
+
+
+class InotifyBackend:
+    '''Watches a directory with the Linux inotify API.'''
+
+    def __init__(self, logdir):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.logdir = logdir
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO
+        if libc.inotify_add_watch(self.fd, os.fsencode(logdir), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno), logdir)
+
+    def fileno(self):
+        return self.fd
+
+    def wait(self, timeout, paths=None):
+        (readable, _, _) = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return NO_ACTIVITY
+
+        modified = set()
+        closed = set()
+        created = set()
+        overflow = False
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos + _EVENT_HEADER.size <= len(buf):
+                (_, mask, _, name_len) = _EVENT_HEADER.unpack_from(buf, pos)
+                pos += _EVENT_HEADER.size
+                name = buf[pos:pos + name_len].rstrip(b'\0')
+                pos += name_len
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                if not name:
+                    continue
+                path = os.path.join(self.logdir, os.fsdecode(name))
+                if mask & IN_MODIFY:
+                    modified.add(path)
+                if mask & IN_CLOSE_WRITE:
+                    closed.add(path)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    created.add(path)
+        return LogActivity(frozenset(modified), frozenset(closed),
+                           frozenset(created), overflow)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def stat_signature(path):
+    '''A file's (size, mtime), or None if it is gone.'''
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+class PollingBackend:
+    '''Compares the (size, mtime) of the files asked about every
+       poll_interval_s seconds.  The log dir, which may hold the logfiles of
+       thousands of old jobs, is only listed for new files when its own mtime
+       changes, or every RESCAN_S.  Can't tell when a logfile is closed.'''
+
+    def __init__(self, logdir, poll_interval_s=1.0):
+        self.logdir = logdir
+        self.poll_interval_s = poll_interval_s
+        self.signatures = {}    # Map from path to (size, mtime), of the files seen
+        self._rescan()
+
+    def _rescan(self):
+        '''List the log dir, and return the files new since the last time.'''
+        # Before listing it, so that a file created meanwhile changes it again.
+        self.dir_signature = stat_signature(self.logdir)
+        self.scanned = time.monotonic()
+        try:
+            paths = { os.path.join(self.logdir, name) for name in os.listdir(self.logdir) }
+        except FileNotFoundError:
+            paths = set()
+        created = set()
+        for path in paths - self.signatures.keys():
+            signature = stat_signature(path)
+            if signature is not None:
+                self.signatures[path] = signature
+                created.add(path)
+        for path in self.signatures.keys() - paths:
+            del self.signatures[path]
+        return frozenset(created)
+
+    def fileno(self):
+        return None
+
+    def wait(self, timeout, paths=None):
+        '''paths are the files to look for writes to, or None for all those
+           in the log dir.'''
+        deadline = time.monotonic() + timeout
+        while True:
+            created = frozenset()
+            if (time.monotonic() - self.scanned >= RESCAN_S
+                    or stat_signature(self.logdir) != self.dir_signature):
+                created = self._rescan()
+            modified = set()
+            for path in set(self.signatures if paths is None else paths) - created:
+                signature = stat_signature(path)
+                if signature is None:
+                    continue
+                if self.signatures.get(path, signature) != signature:
+                    modified.add(path)
+                self.signatures[path] = signature
+            if created or modified:
+                return LogActivity(frozenset(modified), frozenset(), created)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return NO_ACTIVITY
+            time.sleep(min(self.poll_interval_s, remaining))
+
+    def close(self):
+        pass
+
+
+def make_backend(logdir, backend='auto'):
+    '''Return a backend watching logdir: inotify if requested or, for 'auto',
+       if it works here; polling otherwise.'''
+    if backend not in BACKENDS:
+        raise ValueError('unknown log watcher backend %r, expected one of %s'
+                         % (backend, ', '.join(BACKENDS)))
+    if backend != 'poll':
+        try:
+            return InotifyBackend(logdir)
+        except (OSError, AttributeError):
+            if backend == 'inotify':
+                raise
+    return PollingBackend(logdir)
+
+
+class LogWatcher:
+    '''Turns activity in the log dir into updates of the matching jobs.'''
+
+    def __init__(self, logdir, backend='auto'):
+        # Jobs know their logfile by the path the plotter has open, which
+        # need not be spelled like directories.log is.
+        self.logdir = os.path.realpath(logdir)
+        self.backend = make_backend(self.logdir, backend)
+
+    @property
+    def backend_name(self):
+        return 'inotify' if isinstance(self.backend, InotifyBackend) else 'poll'
+
+    def fileno(self):
+        '''A file descriptor which becomes readable on activity, for use with
+           select(), or None if the backend has to poll.'''
+        return self.backend.fileno()
+
+    def wait(self, timeout, jobs=None):
+        '''Wait up to timeout seconds for activity, and return a LogActivity.
+           Without inotify, only the logfiles of jobs (if given) are checked
+           for writes.'''
+        paths = None
+        if jobs is not None:
+            paths = { os.path.realpath(j.logfile) for j in jobs if j.logfile }
+        return self.backend.wait(timeout, paths)
+
+    def jobs_for(self, jobs, paths):
+        '''The jobs whose logfiles are among paths (as reported in a
+           LogActivity).'''
+        return [j for j in jobs
+                if j.logfile and os.path.realpath(j.logfile) in paths]
+
+    def closed_jobs(self, jobs, activity):
+        '''The jobs whose logfiles were closed, which means they exited.'''
+        return self.jobs_for(jobs, activity.closed)
+
+    def update_jobs(self, jobs, activity):
+        '''Update the jobs whose logfiles were written to, according to
+           activity, and return the resulting PhaseChanges.  Other jobs'
+           logfiles are not touched.'''
+        if activity.overflow:
+            changed = list(jobs)
+        else:
+            changed = self.jobs_for(jobs, activity.modified | activity.closed)
+
+        phase_changes = []
+        for j in changed:
+            old_phase = j.progress()
+            j.update_from_logfile()
+            new_phase = j.progress()
+            if new_phase != old_phase:
+                phase_changes.append(PhaseChange(j, old_phase, new_phase))
+        return phase_changes
+
+    def poll(self, jobs, timeout=0):
+        '''Wait up to timeout seconds for activity, then update the affected
+           jobs.  Return (phase changes, LogActivity).'''
+        activity = self.wait(timeout, jobs)
+        if not activity:
+            return ([], activity)
+        return (self.update_jobs(jobs, activity), activity)
+
+    def close(self):
+        self.backend.close()
@@ -1,3 +1,4 @@
+import contextlib
 import logging
 import operator
 import os
@@ -15,7 +16,7 @@ import psutil
 # Plotman libraries
 from plotman import \
     archive  # for get_archdir_freebytes(). TODO: move to avoid import loop
-from plotman import job, plot_util
+from plotman import admission, configuration, job, placement, plot_util, priority, space
 
 # Constants
 MIN = 60    # Seconds
@@ -67,75 +68,214 @@ def phases_permit_new_job(phases, d, sched_cfg, dir_cfg):
 
     return True
 
-def maybe_start_new_plot(dir_cfg, sched_cfg, plotting_cfg):
-    jobs = job.Job.get_running_jobs(dir_cfg.log)
+class PendingJob:
+    '''Stands in for a job we just started, in the scheduler's view of the
+       running jobs, until it can be found in the process table.'''
 
-    wait_reason = None  # If we don't start a job this iteration, this says why.
+    plot_id = '--------'
 
-    youngest_job_age = min(jobs, key=job.Job.get_time_wall).get_time_wall() if jobs else MAX_AGE
+    def __init__(self, tmpdir, dstdir, logfile, k=0, r=0, b=0, tmp2dir='', cpus=None):
+        self.tmpdir = tmpdir
+        self.tmp2dir = tmp2dir
+        self.dstdir = dstdir
+        self.logfile = logfile
+        self.k = k
+        self.r = r
+        self.b = b
+        self.cpus = cpus
+        self.start_time = time.time()
+
+    def progress(self):
+        return (0, 0)
+
+    def get_time_wall(self):
+        return int(time.time() - self.start_time)
+
+    def phase_time(self, phase):
+        return None
+
+    # It hasn't written anything yet.
+    def get_tmp_usage(self, usage_cache=None):
+        return 0
+
+    def get_tmp2_usage(self, usage_cache=None):
+        return 0
+
+    def get_dst_usage(self, usage_cache=None):
+        return 0
+
+def oldest_tmpdir(tmpdir_phases):
+    '''Of (tmpdir, phases of its jobs), the tmpdir whose youngest job is
+       furthest along, or which has none.'''
+    rankable = [ (d, phases[0]) if phases else (d, (999, 999))
+            for (d, phases) in tmpdir_phases ]
+    return max(rankable, key=operator.itemgetter(1))[0]
+
+def select_new_plot(dir_cfg, sched_cfg, jobs, choose_tmpdir=None, disk_sampler=None,
+                    space_ledger=None, rng=random):
+    '''Scheduling logic: decide where a new job should plot, given the running
+       jobs.  Return (tmpdir, dstdir, None), or (None, None, wait_reason) if
+       no job may be started now.  choose_tmpdir(jobs, eligible tmpdirs) may
+       pick the tmpdir instead of the default rule, see planner.Planner.
+       With a diskstats.DiskStatsSampler, dirs on devices busier than
+       max_device_utilization are avoided.  With a space.SpaceLedger, dirs
+       without room for another plot on top of the running jobs' are.  Among
+       unused dst dirs, one is picked with rng (e.g. a seeded random.Random).'''
+    youngest_job_age = min(j.get_time_wall() for j in jobs) if jobs else MAX_AGE
     global_stagger = int(sched_cfg.global_stagger_m * MIN)
     if (youngest_job_age < global_stagger):
-        wait_reason = 'stagger (%ds/%ds)' % (youngest_job_age, global_stagger)
-    elif len(jobs) >= sched_cfg.global_max_jobs:
-        wait_reason = 'max jobs (%d)' % sched_cfg.global_max_jobs
+        return (None, None, 'stagger (%ds/%ds)' % (youngest_job_age, global_stagger))
+    if len(jobs) >= sched_cfg.global_max_jobs:
+        return (None, None, 'max jobs (%d)' % sched_cfg.global_max_jobs)
+
+    tmp_to_all_phases = [(d, job.job_phases_for_tmpdir(d, jobs)) for d in dir_cfg.tmp]
+    eligible = [ (d, phases) for (d, phases) in tmp_to_all_phases
+            if phases_permit_new_job(phases, d, sched_cfg, dir_cfg) ]
+
+    if not eligible:
+        return (None, None, 'no eligible tempdirs')
+
+    def busy(d):
+        return (disk_sampler is not None and
+                disk_sampler.saturated(d, sched_cfg.max_device_utilization))
+
+    # A busy tmp device would slow the new job and those already on it, so
+    # plot elsewhere, or wait.
+    if dir_cfg.tmp2 is not None and busy(dir_cfg.tmp2):
+        return (None, None, 'tmp2 device busy')
+    eligible = [ (d, phases) for (d, phases) in eligible if not busy(d) ]
+    if not eligible:
+        return (None, None, 'eligible tmp devices busy')
+
+    def fits(tmpdir, dstdir=None):
+        return (space_ledger is None or space_ledger.fits(
+            jobs, space_ledger.new_job_needs(tmpdir, dstdir, dir_cfg.tmp2)))
+
+    eligible = [ (d, phases) for (d, phases) in eligible if fits(d) ]
+    if not eligible:
+        return (None, None, 'no tmp space')
+
+    if choose_tmpdir is not None:
+        tmpdir = choose_tmpdir(jobs, [d for (d, _) in eligible])
+    else:
+        tmpdir = oldest_tmpdir(eligible)
+
+    # Select the dst dir least recently selected, avoiding busy devices
+    # unless they all are.  The plot won't be written for hours, so there
+    # is no point in waiting for one.
+    dstdirs = [d for d in dir_cfg.dst if fits(tmpdir, d)]
+    if not dstdirs:
+        return (None, None, 'no dst space')
+    dstdirs = [d for d in dstdirs if not busy(d)] or dstdirs
+    dir2ph = { d:ph for (d, ph) in dstdirs_to_youngest_phase(jobs).items()
+              if d in dstdirs }
+    unused_dirs = [d for d in dstdirs if d not in dir2ph.keys()]
+    dstdir = ''
+    if unused_dirs: 
+        dstdir = rng.choice(unused_dirs)
     else:
-        tmp_to_all_phases = [(d, job.job_phases_for_tmpdir(d, jobs)) for d in dir_cfg.tmp]
-        eligible = [ (d, phases) for (d, phases) in tmp_to_all_phases
-                if phases_permit_new_job(phases, d, sched_cfg, dir_cfg) ]
-        rankable = [ (d, phases[0]) if phases else (d, (999, 999))
-                for (d, phases) in eligible ]
-        
-        if not eligible:
-            wait_reason = 'no eligible tempdirs'
-        else:
-            # Plot to oldest tmpdir.
-            tmpdir = max(rankable, key=operator.itemgetter(1))[0]
-
-            # Select the dst dir least recently selected
-            dir2ph = { d:ph for (d, ph) in dstdirs_to_youngest_phase(jobs).items()
-                      if d in dir_cfg.dst }
-            unused_dirs = [d for d in dir_cfg.dst if d not in dir2ph.keys()]
-            dstdir = ''
-            if unused_dirs: 
-                dstdir = random.choice(unused_dirs)
-            else:
-                dstdir = max(dir2ph, key=dir2ph.get)
-
-            logfile = os.path.join(
-                dir_cfg.log, datetime.now().strftime('%Y-%m-%d-%H:%M:%S.log')
-            )
-
-            plot_args = ['chia', 'plots', 'create',
-                    '-k', str(plotting_cfg.k),
-                    '-r', str(plotting_cfg.n_threads),
-                    '-u', str(plotting_cfg.n_buckets),
-                    '-b', str(plotting_cfg.job_buffer),
-                    '-t', tmpdir,
-                    '-d', dstdir ]
-            if plotting_cfg.e:
-                plot_args.append('-e')
-            if plotting_cfg.farmer_pk is not None:
-                plot_args.append('-f')
-                plot_args.append(plotting_cfg.farmer_pk)
-            if plotting_cfg.pool_pk is not None:
-                plot_args.append('-p')
-                plot_args.append(plotting_cfg.pool_pk)
-            if dir_cfg.tmp2 is not None:
-                plot_args.append('-2')
-                plot_args.append(dir_cfg.tmp2)
-
-            logmsg = ('Starting plot job: %s ; logging to %s' % (' '.join(plot_args), logfile))
-
-            # start_new_sessions to make the job independent of this controlling tty.
-            p = subprocess.Popen(plot_args,
-                stdout=open(logfile, 'w'),
-                stderr=subprocess.STDOUT,
-                start_new_session=True)
-
-            psutil.Process(p.pid).nice(15)
-            return (True, logmsg)
-
-    return (False, wait_reason)
+        dstdir = max(dir2ph, key=dir2ph.get)
+
+    return (tmpdir, dstdir, None)
+
+def open_new_logfile(logdir):
+    '''Create and open a logfile named after the current time.  Jobs started
+       within the same second get a numeric suffix.'''
+    base = datetime.now().strftime('%Y-%m-%d-%H:%M:%S')
+    n = 1
+    while True:
+        logfile = os.path.join(logdir, base + ('-%d' % n if n > 1 else '') + '.log')
+        try:
+            return (logfile, open(logfile, 'x'))
+        except FileExistsError:
+            n += 1
+
+def start_plot(dir_cfg, plotting_cfg, tmpdir, dstdir, job_priority=None, job_placement=None):
+    '''Start a plot job on the given dirs, at the given
+       configuration.PhasePriority (by default, nice 15), and pinned to the
+       CPUs of the given placement.Placement, if any.  Return (a PendingJob
+       for it, log message).'''
+    (logfile, log) = open_new_logfile(dir_cfg.log)
+
+    plot_args = ['chia', 'plots', 'create',
+            '-k', str(plotting_cfg.k),
+            '-r', str(plotting_cfg.n_threads),
+            '-u', str(plotting_cfg.n_buckets),
+            '-b', str(plotting_cfg.job_buffer),
+            '-t', tmpdir,
+            '-d', dstdir ]
+    if plotting_cfg.e:
+        plot_args.append('-e')
+    if plotting_cfg.farmer_pk is not None:
+        plot_args.append('-f')
+        plot_args.append(plotting_cfg.farmer_pk)
+    if plotting_cfg.pool_pk is not None:
+        plot_args.append('-p')
+        plot_args.append(plotting_cfg.pool_pk)
+    if dir_cfg.tmp2 is not None:
+        plot_args.append('-2')
+        plot_args.append(dir_cfg.tmp2)
+
+    logmsg = ('Starting plot job: %s ; logging to %s' % (' '.join(plot_args), logfile))
+
+    cpus = None
+    if job_placement is not None:
+        cpus = job_placement.cpus
+        logmsg += ' ; on node %d cpus %s' % (
+            job_placement.node, placement.format_cpulist(cpus))
+
+    # start_new_sessions to make the job independent of this controlling tty.
+    with log:
+        p = subprocess.Popen(plot_args,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True)
+
+    proc = psutil.Process(p.pid)
+    if cpus is not None:
+        # Pinned from here, as chia is only just starting, rather than in the
+        # child before exec (preexec_fn), which may deadlock in a process
+        # running threads as interactive mode does.
+        with contextlib.suppress(psutil.NoSuchProcess):
+            proc.cpu_affinity(cpus)
+    if job_priority is None:
+        job_priority = configuration.PhasePriority()
+    priority.set_start_priority(proc, job_priority)
+    pending_job = PendingJob(tmpdir, dstdir, logfile, k=plotting_cfg.k,
+                             r=plotting_cfg.n_threads, b=plotting_cfg.job_buffer,
+                             tmp2dir=dir_cfg.tmp2 or '', cpus=cpus)
+    return (pending_job, logmsg)
+
+def start_new_plots(dir_cfg, sched_cfg, plotting_cfg, jobs=None, choose_tmpdir=None,
+                    disk_sampler=None):
+    '''Start new plot jobs as the scheduling rules allow: one, or with
+       batch_admission as many as the limits permit, each started job being
+       counted against the limits for the next.  Pass the current jobs if
+       they are already at hand, to avoid rescanning and rereading logs.
+       choose_tmpdir and disk_sampler are passed on to select_new_plot().
+       Return (log messages of the jobs started, why no more were started).'''
+    if jobs is None:
+        jobs = job.Job.get_running_jobs(dir_cfg.log)
+    jobs = list(jobs)
+    space_ledger = space.SpaceLedger(plotting_cfg.k) if sched_cfg.reserve_space else None
+    topology = placement.read_topology()
+
+    logmsgs = []
+    while True:
+        (tmpdir, dstdir, wait_reason) = select_new_plot(
+            dir_cfg, sched_cfg, jobs, choose_tmpdir, disk_sampler, space_ledger)
+        if wait_reason is None and sched_cfg.admission_control:
+            wait_reason = admission.check(jobs, sched_cfg, plotting_cfg)
+        if wait_reason is not None:
+            return (logmsgs, wait_reason)
+        (pending_job, logmsg) = start_plot(
+            dir_cfg, plotting_cfg, tmpdir, dstdir,
+            priority.phase_priority(sched_cfg.priority, 1),
+            placement.place_job(dir_cfg, sched_cfg, plotting_cfg, tmpdir, jobs, topology))
+        logmsgs.append(logmsg)
+        if not sched_cfg.batch_admission:
+            return (logmsgs, 'one job per pass')
+        jobs.append(pending_job)
 
 def select_jobs_by_partial_id(jobs, partial_id):
     selected = []
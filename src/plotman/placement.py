@@ -0,0 +1,134 @@
+'''NUMA-aware CPU pinning of plot jobs.
+
+On a multi-socket machine the kernel may move a job's threads between NUMA
+nodes, away from the memory they have been using.  With
+scheduling.numa_pinning, each new job is pinned (with sched_setaffinity, as
+soon as it has been started) to n_threads CPUs of one node: the node whose
+CPUs are least loaded by the jobs already pinned there, or the numa_node of
+its tmpdir's overrides.  Memory is then allocated on that node too, as Linux
+allocates pages on the node of the CPU which first touches them.
+
+The topology is read from /sys/devices/system/node.  On machines with a
+single node (or none listed), jobs are only pinned to a tmpdir's numa_node.'''
+
+import os
+from typing import List, NamedTuple
+
+import psutil
+
+NODE_ROOT = '/sys/devices/system/node'
+
+
+class Placement(NamedTuple):
+    node: int
+    cpus: List[int]
+
+
+def parse_cpulist(s):
+    '''Parse a kernel CPU list such as '0-3,8-11' into a list of CPUs.'''
+    cpus = []
+    for part in s.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            (first, last) = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def format_cpulist(cpus):
+    '''The inverse of parse_cpulist().'''
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(a) if a == b else '%d-%d' % (a, b) for (a, b) in ranges)
+
+def read_topology(root=NODE_ROOT):
+    '''Return a map from NUMA node to its CPUs, empty if root does not exist.
+       Nodes without CPUs (e.g. memory-only nodes) are left out.'''
+    topology = {}
+    try:
+        entries = os.listdir(root)
+    except FileNotFoundError:
+        return topology
+    for entry in entries:
+        if not (entry.startswith('node') and entry[4:].isdigit()):
+            continue
+        try:
+            with open(os.path.join(root, entry, 'cpulist'), 'r') as f:
+                cpus = parse_cpulist(f.read())
+        except FileNotFoundError:
+            continue
+        if cpus:
+            topology[int(entry[4:])] = cpus
+    return topology
+
+def job_cpus(j):
+    '''The CPUs job j may run on, or None if unknown.'''
+    cpus = getattr(j, 'cpus', None)
+    if cpus is not None:
+        return set(cpus)
+    proc = getattr(j, 'proc', None)
+    if proc is None or not hasattr(proc, 'cpu_affinity'):
+        return None
+    try:
+        return set(proc.cpu_affinity())
+    except psutil.Error:
+        return None
+
+def job_node(j, topology):
+    '''The node job j is pinned to, or None if it may run on several.'''
+    cpus = job_cpus(j)
+    if not cpus:
+        return None
+    for (node, node_cpus) in topology.items():
+        if cpus <= set(node_cpus):
+            return node
+    return None
+
+def place(topology, jobs, n_threads, node=None):
+    '''Return the Placement of a new job with n_threads threads, on the
+       given node or else the least loaded one, or None if there is no
+       such node.  A CPU's load is the number of pinned jobs which may run
+       on it, and a node's the mean of its CPUs'.'''
+    if node is None and len(topology) < 2:
+        return None
+    if node is not None and node not in topology:
+        return None
+
+    cpu_load = {}
+    for j in jobs:
+        if job_node(j, topology) is not None:
+            for cpu in job_cpus(j):
+                cpu_load[cpu] = cpu_load.get(cpu, 0) + 1
+
+    def node_load(n):
+        return sum(cpu_load.get(cpu, 0) for cpu in topology[n]) / len(topology[n])
+
+    if node is None:
+        node = min(sorted(topology), key=node_load)
+    cpus = sorted(topology[node], key=lambda cpu: (cpu_load.get(cpu, 0), cpu))[:n_threads]
+    return Placement(node, sorted(cpus))
+
+def tmpdir_node(dir_cfg, tmpdir):
+    '''The numa_node configured for tmpdir, or None.'''
+    if dir_cfg.tmp_overrides is not None and tmpdir in dir_cfg.tmp_overrides:
+        return dir_cfg.tmp_overrides[tmpdir].numa_node
+    return None
+
+def place_job(dir_cfg, sched_cfg, plotting_cfg, tmpdir, jobs, topology):
+    '''The Placement of a new job on tmpdir under the config, or None if it
+       should not be pinned.'''
+    node = tmpdir_node(dir_cfg, tmpdir)
+    if node is None and not sched_cfg.numa_pinning:
+        return None
+    return place(topology, jobs, plotting_cfg.n_threads, node)
+
+def node_str(j, topology):
+    '''The node job j is pinned to, for status reports, or '-'.'''
+    node = job_node(j, topology)
+    return str(node) if node is not None else '-'
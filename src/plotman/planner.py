@@ -0,0 +1,116 @@
+'''History-driven planning of plot job starts.
+
+The stagger rules in manager.phases_permit_new_job() only look at the jobs'
+current phases.  Planner looks ahead instead: it projects the running jobs
+forward with eta.Estimator, and simulates (see simulator.Simulation) the
+starts the scheduler would make over the next horizon_s seconds, with each
+new job taking as long as plots on its tmpdir usually do.
+
+With scheduling.predictive_planning, when several tmpdirs may take a job the
+scheduler picks the one whose choice the simulation projects to finish the
+most plots within the horizon, and it wakes up when the plan says the next
+job can start.  The plan is shown by `plotman dsched` either way.'''
+
+import time
+from typing import NamedTuple
+
+from plotman import eta, job, manager, simulator
+
+DEFAULT_HORIZON_S = 24 * manager.HR
+
+
+class PlannedStart(NamedTuple):
+    time: float   # Seconds since the epoch
+    tmpdir: str
+    dstdir: str
+
+
+class Planner:
+    def __init__(self, history, horizon_s=DEFAULT_HORIZON_S):
+        self.history = history
+        self.estimator = eta.Estimator(history)
+        self.horizon_s = horizon_s
+
+    def expected_phase_s(self, tmpdir):
+        '''{phase: median seconds} for plots on tmpdir, or None without history.'''
+        phase_s = { p: self.history.expected_phase_s(p, tmpdir) for p in eta.PHASES }
+        if None in phase_s.values():
+            return None
+        return phase_s
+
+    def expected_plot_s(self, tmpdir):
+        phase_s = self.expected_phase_s(tmpdir)
+        return None if phase_s is None else sum(phase_s.values())
+
+    def fastest_tmpdir(self, jobs, eligible):
+        '''The tmpdir on which a plot is expected to finish soonest.'''
+        return min(eligible, key=lambda d: self.expected_plot_s(d))
+
+    def project_job(self, clock, j, now):
+        '''A SimJob following the expected future of running job j.'''
+        sim_job = simulator.SimJob(clock, j.tmpdir, j.dstdir)
+        sim_job.start_time = now - j.get_time_wall()
+        current = j.progress()
+        if current[0] is None or current[1] is None:
+            current = (0, 0)
+        sim_job.phase = current
+
+        # The rest of the phase tuples a job goes through, see
+        # simulator.phase_milestones().
+        milestones = []
+        for (t, phase) in simulator.phase_milestones(
+                sim_job.start_time, self.expected_phase_s(j.tmpdir)):
+            if phase > current:
+                remaining = self.estimator.time_to_phase(j, phase, now)
+                # Without a known phase (e.g. its logfile isn't in the log
+                # dir), a job is projected from its start time.
+                at = now + remaining if remaining is not None else max(now, t)
+                milestones.append((round(at), phase))
+        sim_job.set_milestones(milestones)
+        return sim_job
+
+    def simulation(self, dir_cfg, sched_cfg, jobs, now):
+        '''A Simulation starting from the running jobs, or None if there is
+           not enough history to project them.'''
+        if any(self.expected_phase_s(d) is None
+               for d in set(dir_cfg.tmp) | {j.tmpdir for j in jobs}):
+            return None
+        choose_tmpdir = self.fastest_tmpdir if sched_cfg.predictive_planning else None
+        sim = simulator.Simulation(dir_cfg, sched_cfg, self.expected_phase_s,
+                                   choose_tmpdir, start_time=round(now))
+        for j in jobs:
+            sim.add_job(self.project_job(sim.clock, j, now))
+        return sim
+
+    def plan(self, dir_cfg, sched_cfg, jobs, now=None):
+        '''Return the PlannedStarts the scheduler is expected to make within
+           the horizon, or None if there is not enough history.'''
+        now = time.time() if now is None else now
+        sim = self.simulation(dir_cfg, sched_cfg, jobs, now)
+        if sim is None:
+            return None
+        sim.run(self.horizon_s)
+        return [PlannedStart(*start) for start in sim.starts]
+
+    def choose_tmpdir(self, dir_cfg, sched_cfg, jobs, eligible, now=None):
+        '''Of the eligible tmpdirs, return the one for which the simulation
+           projects the most plots finished within the horizon (and, among
+           those, the earliest finishes).  Falls back to the default rule of
+           select_new_plot() without enough history.'''
+        now = time.time() if now is None else now
+        best = None
+        for d in eligible:
+            sim = self.simulation(dir_cfg, sched_cfg, jobs, now)
+            if sim is None:
+                return manager.oldest_tmpdir(
+                    [(d, job.job_phases_for_tmpdir(d, jobs)) for d in eligible])
+            sim.start_job(d, '')
+            sim.run(self.horizon_s)
+            score = (sim.plots, -sum(sim.finishes))
+            if best is None or score > best[0]:
+                best = (score, d)
+        return best[1]
+
+    def tmpdir_chooser(self, dir_cfg, sched_cfg):
+        '''A choose_tmpdir function for manager.start_new_plots().'''
+        return lambda jobs, eligible: self.choose_tmpdir(dir_cfg, sched_cfg, jobs, eligible)
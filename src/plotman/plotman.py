@@ -3,11 +3,12 @@ import importlib
 import importlib.resources
 import os
 import random
+from datetime import datetime
 from shutil import copyfile
 import time
 
 # Plotman libraries
-from plotman import analyzer, archive, configuration, interactive, manager, plot_util, reporting
+from plotman import analyzer, archive_daemon, bandwidth, configuration, diskstats, eta, interactive, manager, placement, planner, plot_util, processes, reporting, scheduler, simulator, throttle
 from plotman import resources as plotman_resources
 from plotman.job import Job
 
@@ -74,6 +75,13 @@ class PlotmanArgParser:
         p_analyze.add_argument('logfile', type=str, nargs='+',
                 help='logfile(s) to analyze')
 
+        p_simulate = sp.add_parser('simulate',
+                help='simulate the scheduling config, with job durations from past logs')
+        p_simulate.add_argument('--days', type=float, default=30,
+                help='how many days to simulate (default 30)')
+        p_simulate.add_argument('--seed', type=int, default=None,
+                help='random seed, for repeatable results')
+
         args = parser.parse_args()
         return args
 
@@ -86,6 +94,16 @@ def get_term_width():
         columns = 120  # 80 is typically too narrow.  TODO: make a command line arg.
     return columns
 
+def load_history(logdir, jobs):
+    'Return an eta.PhaseHistory of the completed plots in logdir.'
+    history = eta.PhaseHistory()
+    history.load_logdir(logdir, exclude={j.logfile for j in jobs})
+    return history
+
+def load_estimator(logdir, jobs):
+    'Return an eta.Estimator using the history of completed plots in logdir.'
+    return eta.Estimator(load_history(logdir, jobs))
+
 def main():
     random.seed()
 
@@ -139,14 +157,7 @@ def main():
     #
     if args.cmd == 'plot':
         print('...starting plot loop')
-        while True:
-            wait_reason = manager.maybe_start_new_plot(cfg.directories, cfg.scheduling, cfg.plotting)
-
-            # TODO: report this via a channel that can be polled on demand, so we don't spam the console
-            if wait_reason:
-                print('...sleeping %d s: %s' % (cfg.scheduling.polling_time_s, wait_reason))
-
-            time.sleep(cfg.scheduling.polling_time_s)
+        scheduler.PlotScheduler(cfg, configuration.get_path()).run_forever()
 
     #
     # Analysis of completed jobs
@@ -156,16 +167,35 @@ def main():
         analyzer.analyze(args.logfile, args.clipterminals,
                 args.bytmp, args.bybitfield)
 
+    #
+    # What-if analysis of the scheduling config
+    #
+    elif args.cmd == 'simulate':
+        history = eta.PhaseHistory()
+        history.load_logdir(cfg.directories.log)
+        if not history.n_plots():
+            print('No completed plots in %s to take job durations from.' % cfg.directories.log)
+            return 1
+        print('Job durations from %d completed plots' % history.n_plots())
+        result = simulator.simulate(cfg.directories, cfg.scheduling, history,
+                args.days, args.seed)
+        print(simulator.result_report(result))
+
     else:
-        jobs = Job.get_running_jobs(cfg.directories.log)
+        snapshot = processes.snapshot()
+        jobs = Job.get_running_jobs(cfg.directories.log, snapshot=snapshot)
 
         # Status report
         if args.cmd == 'status':
-            print(reporting.status_report(jobs, get_term_width()))
+            throttle.load_notes(jobs)
+            print(reporting.status_report(jobs, get_term_width(),
+                estimator=load_estimator(cfg.directories.log, jobs),
+                topology=placement.read_topology()))
 
         # Directories report
         elif args.cmd == 'dirs':
-            print(reporting.dirs_report(jobs, cfg.directories, cfg.scheduling, get_term_width()))
+            print(reporting.dirs_report(jobs, cfg.directories, cfg.scheduling, get_term_width(),
+                                        snapshot))
 
         elif args.cmd == 'interactive':
             interactive.run_interactive()
@@ -173,19 +203,43 @@ def main():
         # Start running archival
         elif args.cmd == 'archive':
             print('...starting archive loop')
+            archiver = archive_daemon.ArchiveDaemon(
+                bandwidth=bandwidth.BandwidthController(), wait_for_free_space=True)
+            disk_sampler = diskstats.DiskStatsSampler()
             firstit = True
             while True:
                 if not firstit:
-                    print('Sleeping 60s until next iteration...')
-                    time.sleep(60)
-                    jobs = Job.get_running_jobs(cfg.directories.log)
+                    sleep_s = archiver.sleep_s()
+                    print('Sleeping %ds until next iteration...' % sleep_s)
+                    time.sleep(sleep_s)
+                    snapshot = processes.snapshot()
+                    jobs = Job.get_running_jobs(cfg.directories.log, cached_jobs=jobs,
+                                                snapshot=snapshot)
                 firstit = False
-                archive.archive(cfg.directories, jobs)
+                disk_sampler.sample()
+                (logmsgs, status, _) = archiver.step(cfg.directories, jobs, snapshot, disk_sampler)
+                for msg in logmsgs:
+                    print(msg)
+                print('Archiving: ' + status)
 
         # Debugging: show the destination drive usage schedule
         elif args.cmd == 'dsched':
+            history = load_history(cfg.directories.log, jobs)
+            dst_etas = eta.Estimator(history).dst_write_etas(jobs)
             for (d, ph) in manager.dstdirs_to_furthest_phase(jobs).items():
-                print('  %s : %s' % (d, str(ph)))
+                etas = ', '.join(datetime.fromtimestamp(t).strftime('%m-%d %H:%M')
+                                 for t in dst_etas.get(d, []))
+                print('  %s : %s  writes expected: %s' % (d, str(ph), etas or '-'))
+
+            plan = planner.Planner(history).plan(cfg.directories, cfg.scheduling, jobs)
+            if plan is None:
+                print('Planned starts: no completed plots to plan from')
+            else:
+                print('Planned starts (next %d h):' % (planner.DEFAULT_HORIZON_S // manager.HR))
+                for start in plan:
+                    print('  %s  %s -> %s' % (
+                        datetime.fromtimestamp(start.time).strftime('%m-%d %H:%M'),
+                        start.tmpdir, start.dstdir))
         
         #
         # Job control commands
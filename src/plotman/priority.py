@@ -0,0 +1,134 @@
+'''Phase-aware CPU and I/O priority of plot jobs.
+
+Jobs used to be started at nice 15 and left there.  With a
+scheduling.priority policy, each job's nice value and (on Linux) I/O
+scheduling class and level follow its major phase instead, e.g. to let jobs
+in phases 3 and 4 finish, and free their tmp space, sooner.  While the CPU
+is saturated, phase-1 jobs can also be held at a lower priority
+(busy_nice), so they don't hold back the others.
+
+PriorityController.apply() is called on each scheduling pass, and returns a
+message for every change it makes.  Raising a job's priority (lowering its
+nice value, or the realtime I/O class) needs privileges plotman may not
+have; a change which is denied is reported once per job and not retried.'''
+
+import contextlib
+import dataclasses
+
+import psutil
+
+from plotman import configuration, throttle
+
+IONICE_CLASSES = {
+    'none': getattr(psutil, 'IOPRIO_CLASS_NONE', 0),
+    'realtime': getattr(psutil, 'IOPRIO_CLASS_RT', 1),
+    'best-effort': getattr(psutil, 'IOPRIO_CLASS_BE', 2),
+    'idle': getattr(psutil, 'IOPRIO_CLASS_IDLE', 3),
+}
+IONICE_CLASS_NAMES = { int(v): k for (k, v) in IONICE_CLASSES.items() }
+
+# Only these classes have levels.
+LEVELED_IONICE_CLASSES = { 'realtime', 'best-effort' }
+
+
+def job_phase(j):
+    '''The major phase of j for the policy.  Jobs whose phase isn't known
+       yet have only just started.'''
+    phase = j.progress()[0]
+    return phase if phase else 1
+
+def phase_priority(policy, phase, cpu_busy=False):
+    '''The configuration.PhasePriority for a job in the given major phase.'''
+    if policy is None:
+        return configuration.PhasePriority()
+    prio = policy.phases.get(phase, configuration.PhasePriority())
+    if phase == 1 and cpu_busy and policy.busy_nice is not None:
+        prio = dataclasses.replace(prio, nice=max(prio.nice, policy.busy_nice))
+    return prio
+
+def ionice_str(ioclass, level):
+    return ioclass + ('/%d' % level if ioclass in LEVELED_IONICE_CLASSES else '')
+
+def get_ionice(proc):
+    '''(class name, level) of proc's I/O priority.'''
+    (ioclass, level) = proc.ionice()
+    return (IONICE_CLASS_NAMES[int(ioclass)], level)
+
+def set_ionice(proc, ioclass, level):
+    if ioclass in LEVELED_IONICE_CLASSES:
+        proc.ionice(IONICE_CLASSES[ioclass], level)
+    else:
+        proc.ionice(IONICE_CLASSES[ioclass])
+
+def target_ionice(prio):
+    '''(class name, level) to set for prio, or None to leave it alone.'''
+    if prio.ionice_class is None or not hasattr(psutil.Process, 'ionice'):
+        return None
+    level = prio.ionice_level if prio.ionice_class in LEVELED_IONICE_CLASSES else 0
+    return (prio.ionice_class, level)
+
+def set_start_priority(proc, prio):
+    '''Set the priority of a job which has just been started.  Whatever we
+       may not set is left to PriorityController to report.'''
+    with contextlib.suppress(psutil.AccessDenied):
+        proc.nice(prio.nice)
+    ionice = target_ionice(prio)
+    if ionice is not None:
+        with contextlib.suppress(psutil.AccessDenied):
+            set_ionice(proc, *ionice)
+
+
+class PriorityController:
+    def __init__(self, cpu_percent=None):
+        # Our own measure, as throttle.Throttle takes one in the same pass.
+        self.cpu_percent = throttle.CpuPercent() if cpu_percent is None else cpu_percent
+        # (pid, setting, value) of changes we were denied.
+        self.denied = set()
+
+    def cpu_busy(self, policy):
+        '''Whether the CPU has been saturated since the last call.'''
+        return self.cpu_percent() >= policy.busy_cpu_percent
+
+    def apply(self, policy, jobs):
+        '''Bring the jobs' priorities in line with the policy.  Return a log
+           message for each change made or denied.'''
+        if policy is None:
+            return []
+        cpu_busy = policy.busy_nice is not None and self.cpu_busy(policy)
+        logmsgs = []
+        for j in jobs:
+            if getattr(j, 'proc', None) is None:
+                continue
+            with contextlib.suppress(psutil.NoSuchProcess):
+                phase = job_phase(j)
+                logmsgs.extend(self.set_priority(j, phase, phase_priority(policy, phase, cpu_busy)))
+        return logmsgs
+
+    def set_priority(self, j, phase, prio):
+        proc = j.proc
+        who = '%s (pid %d, phase %d)' % (j.plot_id[:8], proc.pid, phase)
+        logmsgs = []
+
+        changes = []
+        nice = proc.nice()
+        if nice != prio.nice:
+            changes.append(('nice', str(nice), str(prio.nice),
+                            lambda: proc.nice(prio.nice)))
+        ionice = target_ionice(prio)
+        if ionice is not None:
+            current = get_ionice(proc)
+            if current != ionice:
+                changes.append(('ionice', ionice_str(*current), ionice_str(*ionice),
+                                lambda: set_ionice(proc, *ionice)))
+
+        for (setting, old, new, change) in changes:
+            key = (proc.pid, setting, new)
+            if key in self.denied:
+                continue
+            try:
+                change()
+                logmsgs.append('%s: %s %s -> %s' % (who, setting, old, new))
+            except psutil.AccessDenied:
+                self.denied.add(key)
+                logmsgs.append('%s: %s %s -> %s denied' % (who, setting, old, new))
+        return logmsgs
@@ -0,0 +1,55 @@
+'''The processes plotman cares about, found in one walk of the process table.
+
+A single discovery.ProcessDiscovery classifies every process as a plot job,
+an archive transfer (rsync, or plotman.transfer, sending a plot), some other
+chia process, or none of these.  Job.get_running_jobs() and
+archive.get_running_archive_transfers() each take a view of a
+discovery.Snapshot; passing both the same one costs one walk rather than
+two, and they see the same moment.'''
+
+import os
+
+from plotman import discovery
+
+PLOT = 'plot'
+ARCHIVE = 'archive'
+CHIA = 'chia'
+
+
+def is_plotting_cmdline(cmdline):
+    return (
+        len(cmdline) >= 4
+        and 'python' in cmdline[0]
+        and cmdline[1].endswith('/chia')
+        and 'plots' == cmdline[2]
+        and 'create' == cmdline[3]
+    )
+
+def is_archive_cmdline(cmdline):
+    '''Whether cmdline is of an rsync or plotman.transfer sending a plot.
+       Which archive it sends to is up to archive.py.'''
+    return ((os.path.basename(cmdline[0]) == 'rsync' or 'plotman.transfer' in cmdline)
+            and any(arg.endswith('.plot') for arg in cmdline))
+
+def is_chia_cmdline(cmdline):
+    return any(os.path.basename(arg).startswith('chia') for arg in cmdline[:2])
+
+def classify(cmdline):
+    '''The kind of process of cmdline, or None.'''
+    if not cmdline:
+        return None
+    if is_plotting_cmdline(cmdline):
+        return PLOT
+    if is_archive_cmdline(cmdline):
+        return ARCHIVE
+    if is_chia_cmdline(cmdline):
+        return CHIA
+    return None
+
+# Shared by all callers, so processes already classified are not examined
+# again.
+process_discovery = discovery.ProcessDiscovery(classify)
+
+def snapshot(max_age_s=0):
+    '''A Snapshot of the processes of interest, no older than max_age_s.'''
+    return process_discovery.snapshot(max_age_s)
@@ -4,7 +4,7 @@ import os
 import psutil
 import texttable as tt  # from somewhere?
 
-from plotman import archive, job, manager, plot_util
+from plotman import archive, dir_usage, job, manager, placement, plot_util, transfer_progress
 
 
 def abbr_path(path, putative_prefix):
@@ -61,9 +61,19 @@ def job_viz(jobs):
     result += n_to_char(n_at_ph(jobs, (4, 0)))
     return result
 
-def status_report(jobs, width, height=None, tmp_prefix='', dst_prefix=''):
+def status_report(jobs, width, height=None, tmp_prefix='', dst_prefix='', usage_cache=None,
+        estimator=None, topology=None):
     '''height, if provided, will limit the number of rows in the table,
-       showing first and last rows, row numbers and an elipsis in the middle.'''
+       showing first and last rows, row numbers and an elipsis in the middle.
+       usage_cache, if provided, is a dir_usage.DirUsageCache to read tmp
+       usage from; otherwise each tmpdir is scanned once for this report.
+       estimator, if provided, is an eta.Estimator used to fill in the
+       expected remaining time of each job.  topology, if provided, is a
+       placement.read_topology() map, used to show the NUMA node each job
+       is pinned to on machines with several.'''
+    if usage_cache is None:
+        usage_cache = dir_usage.DirUsageCache()
+
     abbreviate_jobs_list = False
     n_begin_rows = 0
     n_end_rows = 0
@@ -76,18 +86,28 @@ def status_report(jobs, width, height=None, tmp_prefix='', dst_prefix=''):
         n_end_rows = n_rows - n_begin_rows
 
     tab = tt.Texttable()
-    headings = ['plot id', 'k', 'tmp', 'dst', 'wall', 'phase', 'tmp',
+    show_nodes = topology is not None and len(topology) > 1
+    headings = ['plot id', 'k', 'tmp', 'dst', 'wall', 'phase', 'eta', 'tmp',
             'pid', 'stat', 'mem', 'user', 'sys', 'io']
+    if show_nodes:
+        node_column = headings.index('pid') + 1
+        headings.insert(node_column, 'node')
+    # Why plotman suspended jobs, if it did.
+    show_notes = any(getattr(j, 'status_note', '') for j in jobs)
+    if show_notes:
+        headings.append('note')
+    n_job_columns = len(headings)
     if height:
         headings.insert(0, '#')
     tab.header(headings)
     tab.set_cols_dtype('t' * len(headings))
     tab.set_cols_align('r' * len(headings))
     tab.set_header_align('r' * len(headings))
+    # Wall time comes from the cached process create time, so sorting is cheap.
     for i, j in enumerate(sorted(jobs, key=job.Job.get_time_wall)):
         # Elipsis row
         if abbreviate_jobs_list and i == n_begin_rows:
-            row = ['...'] + ([''] * 13)
+            row = ['...'] + ([''] * n_job_columns)
         # Omitted row
         elif abbreviate_jobs_list and i > n_begin_rows and i < (len(jobs) - n_end_rows):
             continue
@@ -95,23 +115,29 @@ def status_report(jobs, width, height=None, tmp_prefix='', dst_prefix=''):
         # Regular row
         else:
             try:
+                metrics = j.sample_metrics()
                 row = [j.plot_id[:8],
                     j.k,
                     abbr_path(j.tmpdir, tmp_prefix),
                     abbr_path(j.dstdir, dst_prefix),
-                    plot_util.time_format(j.get_time_wall()),
+                    plot_util.time_format(metrics.time_wall),
                     phase_str(j.progress()),
-                    plot_util.human_format(j.get_tmp_usage(), 0),
+                    plot_util.time_format(estimator.remaining_s(j) if estimator else None),
+                    plot_util.human_format(j.get_tmp_usage(usage_cache), 0),
                     j.proc.pid,
-                    j.get_run_status(),
-                    plot_util.human_format(j.get_mem_usage(), 1),
-                    plot_util.time_format(j.get_time_user()),
-                    plot_util.time_format(j.get_time_sys()),
-                    plot_util.time_format(j.get_time_iowait())
+                    metrics.run_status,
+                    plot_util.human_format(metrics.mem_usage, 1),
+                    plot_util.time_format(metrics.time_user),
+                    plot_util.time_format(metrics.time_sys),
+                    plot_util.time_format(metrics.time_iowait)
                     ]
+                if show_nodes:
+                    row.insert(node_column, placement.node_str(j, topology))
+                if show_notes:
+                    row.append(j.status_note)
             except psutil.NoSuchProcess:
                 # In case the job has disappeared
-                row = [j.plot_id[:8]] + (['--'] * 12)
+                row = [j.plot_id[:8]] + (['--'] * (n_job_columns - 1))
 
             if height:
                 row.insert(0, '%3d' % i)
@@ -123,10 +149,19 @@ def status_report(jobs, width, height=None, tmp_prefix='', dst_prefix=''):
     # return ('tmp dir prefix: %s ; dst dir prefix: %s\n' % (tmp_prefix, dst_prefix)
     return tab.draw()
 
-def tmp_dir_report(jobs, dir_cfg, sched_cfg, width, start_row=None, end_row=None, prefix=''):
-    '''start_row, end_row let you split the table up if you want'''
+def util_str(disk_sampler, d):
+    '''Utilization of the device holding d as a percentage, or '-'.'''
+    load = disk_sampler.load(d) if disk_sampler is not None else None
+    return '-' if load is None else '%d%%' % round(100 * load.utilization)
+
+def tmp_dir_report(jobs, dir_cfg, sched_cfg, width, start_row=None, end_row=None, prefix='',
+                   disk_sampler=None):
+    '''start_row, end_row let you split the table up if you want.  With a
+       diskstats.DiskStatsSampler, also show device utilization.'''
     tab = tt.Texttable()
     headings = ['tmp', 'ready', 'phases']
+    if disk_sampler is not None:
+        headings.insert(2, 'util')
     tab.header(headings)
     tab.set_cols_dtype('t' * len(headings))
     tab.set_cols_align('r' * (len(headings) - 1) + 'l')
@@ -136,6 +171,8 @@ def tmp_dir_report(jobs, dir_cfg, sched_cfg, width, start_row=None, end_row=None
         phases = sorted(job.job_phases_for_tmpdir(d, jobs))
         ready = manager.phases_permit_new_job(phases, d, sched_cfg, dir_cfg)
         row = [abbr_path(d, prefix), 'OK' if ready else '--', phases_str(phases)]
+        if disk_sampler is not None:
+            row.insert(2, util_str(disk_sampler, d))
         tab.add_row(row)
 
     tab.set_max_width(width)
@@ -143,11 +180,13 @@ def tmp_dir_report(jobs, dir_cfg, sched_cfg, width, start_row=None, end_row=None
     tab.set_deco(0)  # No borders
     return tab.draw()
  
-def dst_dir_report(jobs, dstdirs, width, prefix=''):
+def dst_dir_report(jobs, dstdirs, width, prefix='', disk_sampler=None):
     tab = tt.Texttable()
     dir2oldphase = manager.dstdirs_to_furthest_phase(jobs)
     dir2newphase = manager.dstdirs_to_youngest_phase(jobs)
     headings = ['dst', 'plots', 'GBfree', 'inbnd phases', 'pri']
+    if disk_sampler is not None:
+        headings.append('util')
     tab.header(headings)
     tab.set_cols_dtype('t' * len(headings))
 
@@ -163,6 +202,8 @@ def dst_dir_report(jobs, dstdirs, width, prefix=''):
         priority = archive.compute_priority(eldest_ph, gb_free, n_plots) 
         row = [abbr_path(d, prefix), n_plots, gb_free,
                 phases_str(phases, 5), priority]
+        if disk_sampler is not None:
+            row.append(util_str(disk_sampler, d))
         tab.add_row(row)
     tab.set_max_width(width)
     tab.set_deco(tt.Texttable.BORDER | tt.Texttable.HEADER )
@@ -184,12 +225,44 @@ def arch_dir_report(archdir_freebytes, width, prefix=''):
     tab.set_deco(tt.Texttable.VLINES)
     return tab.draw()
 
+def duration_str(s):
+    if s is None:
+        return '-'
+    s = int(s)
+    return '%d:%02d:%02d' % (s // 3600, s // 60 % 60, s % 60)
+
+def rate_str(bytes_s):
+    return '-' if bytes_s is None else '%.1f' % (bytes_s / 1e6)
+
+def transfer_report(transfer_stats, width, dst_prefix='', arch_prefix=''):
+    '''A table of the progress of archive transfers, from their
+       transfer_progress.TransferStats.'''
+    tab = tt.Texttable()
+    headings = ['pid', 'plot', 'archive', 'GB sent', '%', 'MB/s', 'avg MB/s', 'elapsed', 'eta']
+    tab.header(headings)
+    tab.set_cols_dtype('t' * len(headings))
+    for s in transfer_stats:
+        percent = '-' if not s.size else '%d' % min(100, 100 * s.bytes // s.size)
+        tab.add_row([s.pid, abbr_path(s.plot, dst_prefix), abbr_path(s.archdir, arch_prefix),
+                     '%.1f' % (s.bytes / plot_util.GB), percent, rate_str(s.bytes_s),
+                     rate_str(s.average_bytes_s), duration_str(s.elapsed_s),
+                     duration_str(s.eta_s)])
+    tab.set_max_width(width)
+    tab.set_deco(0)  # No borders
+    return tab.draw()
+
 # TODO: remove this
-def dirs_report(jobs, dir_cfg, sched_cfg, width):
-    return (
+def dirs_report(jobs, dir_cfg, sched_cfg, width, snapshot=None):
+    report = (
         tmp_dir_report(jobs, dir_cfg, sched_cfg, width) + '\n' +
         dst_dir_report(jobs, dir_cfg.dst, width) + '\n' +
         'archive dirs free space:\n' +
         arch_dir_report(archive.get_archdir_freebytes(dir_cfg.archive), width) + '\n'
     )
+    transfers = archive.get_running_archive_transfers(dir_cfg.archive, snapshot)
+    if transfers:
+        report += ('archive transfers:\n' +
+                   transfer_report([transfer_progress.transfer_stats(t) for t in transfers],
+                                   width) + '\n')
+    return report
 
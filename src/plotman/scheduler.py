@@ -0,0 +1,186 @@
+'''The `plotman plot` loop.
+
+Instead of trying to start a job every polling_time_s seconds, PlotScheduler
+sleeps until something happens which could change its decision: a job
+reaching the tmpdir stagger milestone (seen in its logfile by the
+LogWatcher), a job exiting (its logfile being closed), the global stagger
+timer running out, or the config file changing.  polling_time_s remains as
+an upper bound on the time between decisions, as a safety net.'''
+
+import os
+import time
+
+from plotman import configuration, discovery, diskstats, eta, job, log_watcher, manager, planner, priority, throttle
+
+# Look for config file changes at least this often, in seconds.
+CONFIG_CHECK_S = 5
+
+# After starting a job, give it this long to appear in the process table
+# before deciding again, so it is counted against the limits.
+START_SETTLE_S = discovery.MIN_NEGATIVE_CACHE_AGE_S
+
+
+def next_decision_time(jobs, sched_cfg, now):
+    '''Return the time at which the decision to start a job may change even
+       if no job progresses or exits: when the global stagger runs out, or
+       polling_time_s from now at the latest.'''
+    deadline = now + sched_cfg.polling_time_s
+    if jobs:
+        youngest_age = min(j.get_time_wall() for j in jobs)
+        stagger = sched_cfg.global_stagger_m * manager.MIN
+        if youngest_age < stagger:
+            deadline = min(deadline, now + stagger - youngest_age)
+    return deadline
+
+def crosses_milestone(change, sched_cfg):
+    '''Whether a PhaseChange takes a job past the tmpdir stagger milestone,
+       which may make its tmpdir eligible for another job.'''
+    milestone = (sched_cfg.tmpdir_stagger_phase_major, sched_cfg.tmpdir_stagger_phase_minor)
+    (old, new) = (change.old_phase, change.new_phase)
+    if new[0] is None or new[1] is None or new < milestone:
+        return False
+    return old[0] is None or old[1] is None or old < milestone
+
+def changes_major_phase(change):
+    '''Whether a PhaseChange takes a job to another major phase, which may
+       change its priority under scheduling.priority.'''
+    return change.old_phase[0] != change.new_phase[0]
+
+
+def reason_key(reason):
+    '''A wait reason without the figures in parentheses, which may change
+       on every wake (e.g. the age of the youngest job, for the stagger).'''
+    return reason.split(' (')[0] if reason is not None else None
+
+
+class PlotScheduler:
+    '''Starts plot jobs according to the scheduling config, as soon as they
+       are allowed to start.'''
+
+    def __init__(self, cfg, config_path=None, watcher=None):
+        self.cfg = cfg
+        self.config_path = config_path
+        self.config_mtime = self._config_mtime()
+        if watcher is None:
+            watcher = log_watcher.LogWatcher(cfg.directories.log, cfg.scheduling.log_watcher)
+        self.watcher = watcher
+        self.jobs = []
+        self.wait_reason = None
+
+        # Completed plots' phase timings, for scheduling.predictive_planning.
+        self.history = eta.PhaseHistory()
+        self.planner = planner.Planner(self.history)
+
+        # Device load, sampled while we wait, for max_device_utilization.
+        self.disk_sampler = diskstats.DiskStatsSampler()
+
+        # Adjusts jobs' nice and ionice as they progress, for scheduling.priority.
+        self.priorities = priority.PriorityController()
+
+        # Suspends and resumes jobs under contention, for scheduling.throttling.
+        self.throttle = throttle.Throttle()
+
+    def _config_mtime(self):
+        if self.config_path is None:
+            return None
+        try:
+            return os.stat(self.config_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reload_config_if_changed(self):
+        '''Reload the config file if it changed; return whether it did.  A
+           broken config is reported and the previous one kept.'''
+        mtime = self._config_mtime()
+        if mtime == self.config_mtime:
+            return False
+        self.config_mtime = mtime
+        try:
+            cfg = configuration.get_validated_configs()
+        except configuration.ConfigurationException as e:
+            print('...ignoring changed config: %s' % e)
+            return False
+
+        if cfg.directories.log != self.cfg.directories.log:
+            try:
+                watcher = log_watcher.LogWatcher(cfg.directories.log, cfg.scheduling.log_watcher)
+            except (OSError, ValueError) as e:
+                print('...ignoring changed config: %s' % e)
+                return False
+            self.watcher.close()
+            self.watcher = watcher
+            self.jobs = []
+        self.cfg = cfg
+        print('...reloaded config')
+        return True
+
+    def decide(self):
+        '''Update the running jobs and start new ones if allowed.  Return
+           (log messages of the jobs started, wait reason), like
+           manager.start_new_plots().'''
+        self.jobs = job.Job.get_running_jobs(self.cfg.directories.log, cached_jobs=self.jobs)
+        choose_tmpdir = None
+        if self.cfg.scheduling.predictive_planning:
+            self.history.load_logdir(self.cfg.directories.log,
+                                     exclude={j.logfile for j in self.jobs})
+            choose_tmpdir = self.planner.tmpdir_chooser(
+                self.cfg.directories, self.cfg.scheduling)
+        self.disk_sampler.sample()
+        return manager.start_new_plots(
+            self.cfg.directories, self.cfg.scheduling, self.cfg.plotting, self.jobs,
+            choose_tmpdir, self.disk_sampler)
+
+    def planned_start_time(self, now):
+        '''When the planner expects the next job to start, or None.'''
+        if not self.cfg.scheduling.predictive_planning:
+            return None
+        plan = self.planner.plan(self.cfg.directories, self.cfg.scheduling, self.jobs, now)
+        return min((start.time for start in plan or () if start.time > now), default=None)
+
+    def wait(self, until):
+        '''Sleep until the given time, or until something happens which may
+           allow a new job.  Return what woke us.'''
+        while True:
+            now = time.time()
+            if now >= until:
+                return 'timer'
+            timeout = min(until - now, CONFIG_CHECK_S)
+            (phase_changes, activity) = self.watcher.poll(self.jobs, timeout)
+            self.disk_sampler.sample()
+            if activity.overflow or self.watcher.closed_jobs(self.jobs, activity):
+                return 'job exit'
+            if any(crosses_milestone(c, self.cfg.scheduling) for c in phase_changes):
+                return 'phase milestone'
+            if (self.cfg.scheduling.priority is not None and
+                    any(changes_major_phase(c) for c in phase_changes)):
+                return 'phase change'
+            if self.reload_config_if_changed():
+                return 'config change'
+
+    def step(self):
+        '''Make one decision, and return the time by which to make the next
+           one if nothing happens sooner.'''
+        (logmsgs, wait_reason) = self.decide()
+        for msg in self.priorities.apply(self.cfg.scheduling.priority, self.jobs):
+            print(msg)
+        for msg in self.throttle.apply(self.cfg.scheduling.throttling, self.jobs, self.disk_sampler):
+            print(msg)
+        now = time.time()
+        if logmsgs:
+            for msg in logmsgs:
+                print(msg)
+            self.wait_reason = None
+            return now + START_SETTLE_S
+
+        # Only say why we're waiting when the reason changes, so we don't
+        # spam the console.
+        if reason_key(wait_reason) != self.wait_reason:
+            print('...waiting: %s' % wait_reason)
+            self.wait_reason = reason_key(wait_reason)
+        deadline = next_decision_time(self.jobs, self.cfg.scheduling, now)
+        planned = self.planned_start_time(now)
+        return deadline if planned is None else min(deadline, planned)
+
+    def run_forever(self):
+        while True:
+            self.wait(self.step())
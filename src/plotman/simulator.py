@@ -0,0 +1,255 @@
+'''Discrete-event simulation of the plot scheduler.
+
+Runs the real scheduling decisions (manager.select_new_plot(), and so
+phases_permit_new_job()) against simulated jobs, to see what a Scheduling
+config would achieve without trying it on a plotter.  Each simulated job
+takes as long in each phase as a plot completed in the past, picked at
+random from the history of its tmpdir (see eta.PhaseHistory.phase_times()).
+
+Like PlotScheduler, the simulation only makes a decision when it could
+change: when a job crosses the tmpdir stagger milestone or finishes, or the
+global stagger runs out.  Jobs' durations don't depend on how many others
+are running, so results are optimistic for configs which load the machine
+more than the history did.'''
+
+import heapq
+import random
+from typing import Dict, NamedTuple
+
+from plotman import eta, log_watcher, manager, scheduler
+
+DAY = 24 * manager.HR
+
+
+class SimClock:
+    '''Simulated time, in whole seconds since the start of the simulation
+       (or since the epoch, when planning from the present).'''
+    now = 0
+
+
+class SimJob:
+    '''Looks enough like a job.Job to the scheduling logic.'''
+
+    plot_id = '--------'
+    logfile = ''
+
+    def __init__(self, clock, tmpdir, dstdir, phase_s=None):
+        self.clock = clock
+        self.tmpdir = tmpdir
+        self.dstdir = dstdir
+        self.start_time = clock.now
+        self.phase = (1, 0)
+        self.milestones = []
+        if phase_s is not None:
+            self.set_milestones(phase_milestones(self.start_time, phase_s))
+
+    def set_milestones(self, milestones):
+        '''Set the (time, phase tuple) the job will reach, in order.'''
+        self.milestones = list(milestones)
+        self.milestones.reverse()
+
+    def progress(self):
+        return self.phase
+
+    def get_time_wall(self):
+        return self.clock.now - self.start_time
+
+    def next_milestone(self):
+        '''(time, phase tuple) of the next phase the job will reach, or None.'''
+        return self.milestones[-1] if self.milestones else None
+
+    def advance(self):
+        '''Move on to the next phase, returning the previous one.'''
+        old = self.phase
+        (_, self.phase) = self.milestones.pop()
+        return old
+
+def phase_milestones(start_time, phase_s):
+    '''Generate (time, phase tuple) for each phase/subphase a job started at
+       start_time reaches after (1, 0), ending with eta.DONE.  Subphases of a
+       phase are taken to be equally long.'''
+    t = start_time
+    for p in eta.PHASES:
+        n = eta.N_SUBPHASES[p]
+        for subphase in range(n):
+            if (p, subphase) != (1, 0):
+                yield (round(t), (p, subphase))
+            t += phase_s[p] / n
+    yield (round(t), eta.DONE)
+
+
+class SimResult(NamedTuple):
+    days: float
+    plots: int
+    plots_per_day: float
+    peak_jobs: int
+    mean_jobs: float
+    peak_jobs_by_tmpdir: Dict[str, int]
+    idle_frac_by_tmpdir: Dict[str, float]
+
+
+class Simulation:
+    '''Simulates plotting with the given Directories and Scheduling configs.
+       sample_phase_s(tmpdir) returns the {phase: seconds} for a new job, and
+       choose_tmpdir and rng (a random.Random, by default a private one) are
+       passed on to manager.select_new_plot().'''
+
+    def __init__(self, dir_cfg, sched_cfg, sample_phase_s, choose_tmpdir=None, start_time=0,
+                 rng=None):
+        self.dir_cfg = dir_cfg
+        self.sched_cfg = sched_cfg
+        self.sample_phase_s = sample_phase_s
+        self.choose_tmpdir = choose_tmpdir
+        self.rng = random.Random() if rng is None else rng
+        self.clock = SimClock()
+        self.clock.now = start_time
+        self.start_time = start_time
+
+        self.jobs = []
+        self.plots = 0
+        # (time, tmpdir, dstdir) of each job started, and time of each finish.
+        self.starts = []
+        self.finishes = []
+        # Events are (time, seq, job), with job None for a decision timer.
+        self.events = []
+        self.seq = 0
+        self.timers = set()
+
+        self.peak_jobs = 0
+        self.job_seconds = 0
+        self.jobs_by_tmpdir = { d: 0 for d in dir_cfg.tmp }
+        self.peak_jobs_by_tmpdir = { d: 0 for d in dir_cfg.tmp }
+        self.idle_s_by_tmpdir = { d: 0 for d in dir_cfg.tmp }
+        self.idle_since = { d: start_time for d in dir_cfg.tmp }
+
+    def push(self, t, j):
+        heapq.heappush(self.events, (t, self.seq, j))
+        self.seq += 1
+
+    def set_timer(self, t):
+        if t not in self.timers:
+            self.timers.add(t)
+            self.push(t, None)
+
+    def advance_clock(self, t):
+        self.job_seconds += len(self.jobs) * (t - self.clock.now)
+        self.clock.now = t
+
+    def tmpdir_jobs_changed(self, d, delta):
+        if d not in self.jobs_by_tmpdir:
+            return   # A running job on a tmpdir no longer configured
+        n = self.jobs_by_tmpdir[d]
+        if n == 0:
+            self.idle_s_by_tmpdir[d] += self.clock.now - self.idle_since[d]
+        n += delta
+        if n == 0:
+            self.idle_since[d] = self.clock.now
+        self.jobs_by_tmpdir[d] = n
+        self.peak_jobs_by_tmpdir[d] = max(self.peak_jobs_by_tmpdir[d], n)
+
+    def add_job(self, j):
+        '''Add a SimJob, e.g. one projecting a running job.'''
+        self.jobs.append(j)
+        self.peak_jobs = max(self.peak_jobs, len(self.jobs))
+        self.tmpdir_jobs_changed(j.tmpdir, 1)
+        if j.next_milestone() is not None:
+            self.push(j.next_milestone()[0], j)
+
+    def start_job(self, tmpdir, dstdir):
+        self.starts.append((self.clock.now, tmpdir, dstdir))
+        self.add_job(SimJob(self.clock, tmpdir, dstdir, self.sample_phase_s(tmpdir)))
+
+    def decide(self):
+        '''Start jobs as PlotScheduler would, and set a timer for the next
+           decision which doesn't wait for a job to progress.'''
+        while True:
+            (tmpdir, dstdir, wait_reason) = manager.select_new_plot(
+                self.dir_cfg, self.sched_cfg, self.jobs, self.choose_tmpdir, rng=self.rng)
+            if wait_reason is not None:
+                break
+            self.start_job(tmpdir, dstdir)
+            if not self.sched_cfg.batch_admission:
+                self.set_timer(self.clock.now + scheduler.START_SETTLE_S)
+                return
+
+        stagger = self.sched_cfg.global_stagger_m * manager.MIN
+        if self.jobs:
+            youngest_age = min(j.get_time_wall() for j in self.jobs)
+            if youngest_age < stagger:
+                self.set_timer(self.clock.now + stagger - youngest_age)
+
+    def run(self, duration_s):
+        '''Simulate duration_s seconds from the current state.'''
+        end = self.clock.now + duration_s
+        self.decide()
+        while self.events and self.events[0][0] <= end:
+            (t, _, j) = heapq.heappop(self.events)
+            self.advance_clock(t)
+
+            if j is None:
+                self.timers.discard(t)
+                self.decide()
+                continue
+
+            old = j.advance()
+            if j.phase == eta.DONE:
+                self.jobs.remove(j)
+                self.plots += 1
+                self.finishes.append(t)
+                self.tmpdir_jobs_changed(j.tmpdir, -1)
+                self.decide()
+                continue
+
+            self.push(j.next_milestone()[0], j)
+            if scheduler.crosses_milestone(
+                    log_watcher.PhaseChange(j, old, j.phase), self.sched_cfg):
+                self.decide()
+
+        self.advance_clock(end)
+        return self.result()
+
+    def result(self):
+        now = self.clock.now
+        idle_s = { d: s + (now - self.idle_since[d] if self.jobs_by_tmpdir[d] == 0 else 0)
+                   for (d, s) in self.idle_s_by_tmpdir.items() }
+        elapsed = now - self.start_time
+        days = elapsed / DAY
+        return SimResult(
+            days=days,
+            plots=self.plots,
+            plots_per_day=self.plots / days if days else 0.0,
+            peak_jobs=self.peak_jobs,
+            mean_jobs=self.job_seconds / elapsed if elapsed else 0.0,
+            peak_jobs_by_tmpdir=dict(self.peak_jobs_by_tmpdir),
+            idle_frac_by_tmpdir={ d: s / elapsed if elapsed else 0.0
+                                  for (d, s) in idle_s.items() })
+
+
+def history_sampler(history, rng=random):
+    '''Return a sample_phase_s function for Simulation, which picks the phase
+       durations of a past plot from history at random.'''
+    phase_times = {}
+    def sample_phase_s(tmpdir):
+        if tmpdir not in phase_times:
+            phase_times[tmpdir] = history.phase_times(tmpdir)
+        return rng.choice(phase_times[tmpdir])
+    return sample_phase_s
+
+def simulate(dir_cfg, sched_cfg, history, days, seed=None):
+    '''Simulate the given number of days of plotting, drawing job durations
+       from history, which must hold at least one completed plot.'''
+    rng = random.Random(seed)
+    sim = Simulation(dir_cfg, sched_cfg, history_sampler(history, rng), rng=rng)
+    return sim.run(int(days * DAY))
+
+def result_report(result):
+    lines = [
+        'Simulated %.1f days: %d plots, %.2f plots/day' % (
+            result.days, result.plots, result.plots_per_day),
+        'Jobs: peak %d, mean %.2f' % (result.peak_jobs, result.mean_jobs),
+        'Tmp dirs:',
+    ]
+    for d in sorted(result.idle_frac_by_tmpdir):
+        lines.append('  %s : peak %d jobs, idle %.1f%%' % (
+            d, result.peak_jobs_by_tmpdir[d], 100 * result.idle_frac_by_tmpdir[d]))
+    return '\n'.join(lines)
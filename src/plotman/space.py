@@ -0,0 +1,147 @@
+'''Free space accounting for tmp, tmp2 and dst dirs.
+
+statvfs only shows the space plot jobs have used so far.  A job in phase 1
+will go on to fill its tmpdir up to the peak temp footprint for its k (past
+phase 1, its temp files only shrink), and all jobs eventually write a whole
+plot to their tmp2 (if any) and dst dirs.
+SpaceLedger reserves that future growth of the running jobs against the free
+space of each filesystem, and says whether a new job still fits on top.
+
+Dirs are grouped by filesystem (st_dev), so jobs with e.g. their tmpdir and
+dstdir on one disk are counted against it once for each.'''
+
+import os
+
+from plotman import dir_usage, plot_util
+
+GIB = 2 ** 30
+
+# chia's default, for jobs started without -k.
+DEFAULT_K = 32
+
+# Final plot size and peak temp space use (with bitfield) per k, as
+# published for chia's plotter.
+PLOT_BYTES = {
+    25: int(0.6 * GIB),
+    32: int(101.4 * GIB),
+    33: int(208.8 * GIB),
+    34: int(429.8 * GIB),
+    35: int(884.1 * GIB),
+}
+TMP_PEAK_BYTES = {
+    25: int(1.8 * GIB),
+    32: 239 * GIB,
+    33: 521 * GIB,
+    34: 1041 * GIB,
+    35: 2175 * GIB,
+}
+
+
+# The first major phase in which a job's temp files no longer grow.
+TMP_PEAK_DONE_PHASE = 2
+
+
+def job_k(j):
+    k = getattr(j, 'k', 0)
+    return int(k) if k else DEFAULT_K
+
+def scaled_from_k32(table, k):
+    '''Look up k in table, or scale the k32 entry: a plot of size k holds
+       2^k entries of about k bits each.'''
+    if k in table:
+        return table[k]
+    return int(table[32] * 2 ** (k - 32) * k / 32)
+
+def past_tmp_peak(j):
+    phase = j.progress()[0]
+    return phase is not None and phase >= TMP_PEAK_DONE_PHASE
+
+def plot_bytes(k):
+    '''Expected size of a finished plot of size k.'''
+    return scaled_from_k32(PLOT_BYTES, k)
+
+def tmp_peak_bytes(k):
+    '''Expected peak size of the temp files of a plot of size k.'''
+    return scaled_from_k32(TMP_PEAK_BYTES, k)
+
+
+class SpaceLedger:
+    '''Free space per filesystem, less what running jobs have yet to write,
+       for deciding where a new job of size k fits.  Free space and dir usage
+       are read once for the lifetime of the ledger, so make a new one for
+       each scheduling decision.'''
+
+    def __init__(self, k=DEFAULT_K, usage_cache=None, df=plot_util.df_b):
+        self.k = k
+        self.usage_cache = dir_usage.DirUsageCache() if usage_cache is None else usage_cache
+        self.df = df
+        self.devices = {}   # Map from dir to st_dev, or None if missing
+        self.free = {}      # Map from st_dev to free bytes
+
+    def device(self, d):
+        if d not in self.devices:
+            try:
+                self.devices[d] = os.stat(d).st_dev
+            except FileNotFoundError:
+                self.devices[d] = None
+        return self.devices[d]
+
+    def free_bytes(self, d):
+        '''Free bytes on the filesystem of dir d, or None if d is missing.'''
+        dev = self.device(d)
+        if dev is None:
+            return None
+        if dev not in self.free:
+            self.free[dev] = self.df(d)
+        return self.free[dev]
+
+    def job_needs(self, j):
+        '''Generate (dir, bytes) that job j has yet to write.'''
+        k = job_k(j)
+        if not past_tmp_peak(j):
+            yield (j.tmpdir, tmp_peak_bytes(k) - j.get_tmp_usage(self.usage_cache))
+        if j.tmp2dir:
+            yield (j.tmp2dir, plot_bytes(k) - j.get_tmp2_usage(self.usage_cache))
+        yield (j.dstdir, plot_bytes(k) - j.get_dst_usage(self.usage_cache))
+
+    def reserved_bytes(self, jobs):
+        '''Map from st_dev to the bytes jobs have yet to write to it.'''
+        reserved = {}
+        for j in jobs:
+            for (d, needed) in self.job_needs(j):
+                dev = self.device(d)
+                if dev is not None:
+                    reserved[dev] = reserved.get(dev, 0) + max(0, needed)
+        return reserved
+
+    def headroom(self, d, jobs):
+        '''Free bytes on the filesystem of dir d once jobs are done, or None
+           if d is missing.'''
+        free = self.free_bytes(d)
+        if free is None:
+            return None
+        return free - self.reserved_bytes(jobs).get(self.device(d), 0)
+
+    def fits(self, jobs, needs):
+        '''Whether (dir, bytes) needs fit on top of jobs.  Dirs we can't
+           stat are taken to have room, leaving the error to the plotter.'''
+        needed_by_dev = {}
+        for (d, needed) in needs:
+            dev = self.device(d)
+            if dev is not None:
+                (_, total) = needed_by_dev.get(dev, (d, 0))
+                needed_by_dev[dev] = (d, total + needed)
+        if not needed_by_dev:
+            return True
+        reserved = self.reserved_bytes(jobs)
+        return all(self.free_bytes(d) - reserved.get(dev, 0) >= needed
+                   for (dev, (d, needed)) in needed_by_dev.items())
+
+    def new_job_needs(self, tmpdir, dstdir=None, tmp2dir=None):
+        '''The (dir, bytes) a new job will write.'''
+        needs = [(tmpdir, tmp_peak_bytes(self.k))]
+        if tmp2dir is not None:
+            needs.append((tmp2dir, plot_bytes(self.k)))
+        if dstdir is not None:
+            needs.append((dstdir, plot_bytes(self.k)))
+        return needs
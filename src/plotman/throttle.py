@@ -0,0 +1,226 @@
+'''Automatic suspension of plot jobs under contention.
+
+With scheduling.throttling, the plotting loop suspends the least progressed
+job (leaving at least one running) when:
+
+* the CPU is busier than suspend_cpu_percent,
+* a tmp device is busier than suspend_device_utilization (as measured by
+  diskstats.DiskStatsSampler), and more than one job plots on it, or
+* with suspend_for_dst_copy, a job in phase 4 is about to copy its plot to
+  a dst dir on the device another job, in phase 1 or 2, plots on.
+
+At most one job is suspended per rule and pass, as the effect of one takes
+a while to show.  A job is resumed once its cause has cleared, to below the
+separate resume_* thresholds, and it has been suspended for min_suspend_s,
+so jobs don't flap.  Only jobs suspended by the throttle are ever resumed
+by it.
+
+Which jobs are suspended, and why, is kept in a state file, so that
+`plotman status` can show the reason and a restarted plotman resumes them.'''
+
+import json
+import os
+import time
+from typing import NamedTuple
+
+import appdirs
+import psutil
+
+from plotman import discovery
+
+
+def get_state_path():
+    return os.path.join(appdirs.user_data_dir('plotman'), 'throttle.json')
+
+
+class Suspension(NamedTuple):
+    kind: str      # 'cpu', 'device' or 'dst copy'
+    device: str    # The contended dir for 'device' and 'dst copy', else ''
+    note: str      # For the status report
+    since: float   # time.time() of the suspension
+
+
+def state_key(key):
+    return '%d:%r' % (key.pid, key.create_time)
+
+def load_state(path):
+    '''Map from ProcessKey to Suspension, empty if path does not exist.'''
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    suspended = {}
+    for (key, suspension) in state.items():
+        (pid, create_time) = key.split(':')
+        suspended[discovery.ProcessKey(int(pid), float(create_time))] = Suspension(**suspension)
+    return suspended
+
+def save_state(path, suspended):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({ state_key(key): s._asdict() for (key, s) in suspended.items() }, f)
+    os.replace(tmp_path, path)
+
+def load_notes(jobs, path=None):
+    '''Set the status_note of jobs suspended by the throttle, for reports
+       from another plotman process.'''
+    suspended = load_state(get_state_path() if path is None else path)
+    for j in jobs:
+        if j.process_key in suspended:
+            j.status_note = suspended[j.process_key].note
+
+def busy_percent(before, after):
+    '''How busy the CPU was between two psutil.cpu_times(), as
+       psutil.cpu_percent() works it out.'''
+    def busy_and_total(t):
+        # Guest time is already counted in user time.
+        total = sum(t) - getattr(t, 'guest', 0) - getattr(t, 'guest_nice', 0)
+        return (total - t.idle - getattr(t, 'iowait', 0), total)
+    (busy_before, total_before) = busy_and_total(before)
+    (busy_after, total_after) = busy_and_total(after)
+    if total_after <= total_before:
+        return 0.0
+    return max(0.0, min(100.0, 100 * (busy_after - busy_before) / (total_after - total_before)))
+
+
+class CpuPercent:
+    '''psutil.cpu_percent() since this one's last call.  psutil keeps one
+       last sample per thread, so two callers of psutil.cpu_percent() in the
+       same pass would each see the time since the other's call, i.e. next
+       to none.'''
+
+    def __init__(self, cpu_times=psutil.cpu_times):
+        self.cpu_times = cpu_times
+        self.last = cpu_times()
+
+    def __call__(self):
+        (before, self.last) = (self.last, self.cpu_times())
+        return busy_percent(before, self.last)
+
+
+def progress(j):
+    phase = j.progress()
+    return phase if phase[0] is not None and phase[1] is not None else (0, 0)
+
+
+class Throttle:
+    def __init__(self, state_path=None, cpu_percent=None, clock=time.time):
+        self.state_path = get_state_path() if state_path is None else state_path
+        self.cpu_percent = CpuPercent() if cpu_percent is None else cpu_percent
+        self.clock = clock
+        self.suspended = load_state(self.state_path)
+
+    def apply(self, throttling, jobs, disk_sampler):
+        '''Suspend and resume jobs per the configuration.Throttling, with
+           device loads from disk_sampler.  Return a log message for each.'''
+        if throttling is None and not self.suspended:
+            return []
+        now = self.clock()
+        jobs = [j for j in jobs if getattr(j, 'process_key', None) is not None]
+        jobs_by_key = { j.process_key: j for j in jobs }
+
+        before = dict(self.suspended)
+        self.suspended = { key: s for (key, s) in self.suspended.items() if key in jobs_by_key }
+        cpu_percent = self.cpu_percent()
+
+        # Resume the most progressed jobs first, and for CPU or device load
+        # only one at a time, as for suspending.
+        logmsgs = []
+        resumed = set()
+        for (key, s) in sorted(self.suspended.items(), key=lambda item: progress(jobs_by_key[item[0]]),
+                               reverse=True):
+            if (s.kind, s.device) in resumed:
+                continue
+            if throttling is None or (now - s.since >= throttling.min_suspend_s and
+                                      self.cleared(throttling, s, jobs, cpu_percent, disk_sampler)):
+                logmsgs.append(self.resume(jobs_by_key[key]))
+                if s.kind != 'dst copy':
+                    resumed.add((s.kind, s.device))
+
+        if throttling is not None:
+            for (j, kind, device, note) in self.contended(throttling, jobs, cpu_percent, disk_sampler):
+                logmsgs.append(self.suspend(j, Suspension(kind, device, note, now)))
+
+        for j in jobs:
+            s = self.suspended.get(j.process_key)
+            j.status_note = s.note if s is not None else ''
+        if self.suspended != before:
+            save_state(self.state_path, self.suspended)
+        return logmsgs
+
+    def suspend(self, j, suspension):
+        try:
+            j.suspend(suspension.note)
+        except psutil.Error as e:
+            return 'Could not suspend %s (%s): %s' % (j.plot_id[:8], suspension.note, e)
+        self.suspended[j.process_key] = suspension
+        return 'Suspended %s: %s' % (j.plot_id[:8], suspension.note)
+
+    def resume(self, j):
+        s = self.suspended.pop(j.process_key)
+        try:
+            j.resume()
+        except psutil.Error as e:
+            return 'Could not resume %s: %s' % (j.plot_id[:8], e)
+        return 'Resumed %s after %s' % (j.plot_id[:8], s.note)
+
+    def cleared(self, throttling, s, jobs, cpu_percent, disk_sampler):
+        '''Whether the cause of a Suspension is gone.'''
+        if s.kind == 'cpu':
+            return cpu_percent < throttling.resume_cpu_percent
+        if s.kind == 'device':
+            load = disk_sampler.load(s.device)
+            return load is None or load.utilization < throttling.resume_device_utilization
+        if s.kind == 'dst copy':
+            return not any(self.copying_to(j, s.device, disk_sampler) for j in jobs)
+        return True
+
+    def copying_to(self, j, d, disk_sampler):
+        '''Whether j is about to copy its plot to the device of dir d.'''
+        return (j.process_key not in self.suspended and progress(j) >= (4, 0)
+                and disk_sampler.device(j.dstdir) == disk_sampler.device(d))
+
+    def contended(self, throttling, jobs, cpu_percent, disk_sampler):
+        '''Generate (job, kind, device, note) for the jobs to suspend.'''
+        running = sorted((j for j in jobs if j.process_key not in self.suspended), key=progress)
+        chosen = set()
+
+        def least_progressed(candidates):
+            for j in candidates:
+                if j.process_key not in chosen and len(running) - len(chosen) > 1:
+                    chosen.add(j.process_key)
+                    return j
+            return None
+
+        if (throttling.suspend_cpu_percent is not None
+                and cpu_percent > throttling.suspend_cpu_percent):
+            j = least_progressed(running)
+            if j is not None:
+                yield (j, 'cpu', '', 'cpu %d%%' % cpu_percent)
+
+        if throttling.suspend_device_utilization is not None:
+            by_device = {}
+            for j in running:
+                by_device.setdefault(disk_sampler.device(j.tmpdir), []).append(j)
+            for (device, device_jobs) in by_device.items():
+                load = disk_sampler.load(device_jobs[0].tmpdir)
+                if (device is None or len(device_jobs) < 2 or load is None
+                        or load.utilization <= throttling.suspend_device_utilization):
+                    continue
+                j = least_progressed(device_jobs)
+                if j is not None:
+                    yield (j, 'device', j.tmpdir,
+                           'tmp device %d%% busy' % (100 * load.utilization))
+
+        if throttling.suspend_for_dst_copy:
+            for copying in running:
+                if progress(copying) < (4, 0) or disk_sampler.device(copying.dstdir) is None:
+                    continue
+                j = least_progressed(
+                    j for j in running if progress(j) < (3, 0) and
+                    disk_sampler.device(j.tmpdir) == disk_sampler.device(copying.dstdir))
+                if j is not None:
+                    yield (j, 'dst copy', copying.dstdir,
+                           'dst copy to %s' % copying.dstdir)
@@ -0,0 +1,290 @@
+'''Archiving of plots to local archive dirs, without rsync.
+
+With archive.mode set to 'local', the archive dirs are directories on this
+machine (drives of a farmer running on the plotter, or mounted over a local
+bus), and each plot is archived by a process running
+
+    python -m plotman.transfer --remove-source-files [--bwlimit=KBPS] PLOT... ARCHDIR
+
+which archives its plots one after another.  If a plot and the archive dir
+are on the same filesystem, the plot is simply renamed.  Otherwise it is
+copied by the kernel, without passing through this process (copy_file_range,
+or else sendfile, or else read and write where neither is available), in
+large chunks, to a temporary file which is preallocated, fsynced, and
+renamed into place once complete.  Only then is the source removed.
+Progress is printed as the copy goes, and the throughput of each finished
+transfer is appended to --log.
+
+Every CHECKPOINT_BYTES, the temporary file is fsynced and how much of it is
+good is written next to it.  A copy which is interrupted (stopped, or cut
+off by a reboot) leaves both behind, and the next transfer of the plot
+resumes from there, as rsync does from its --partial-dir.  A copy which
+fails for any other reason removes them.
+
+The copy is limited to --bwlimit, or to the limit for the plot's dir in
+--bwlimit-file (a JSON map from dst dir to KB/s, written by
+bandwidth.BandwidthController), which is checked every BWLIMIT_CHECK_S.'''
+
+import argparse
+import contextlib
+import errno
+import json
+import os
+import signal
+import sys
+import time
+from datetime import datetime
+
+import appdirs
+
+# Copy this much at a time.  A multiple of any page or block size.
+CHUNK_BYTES = 64 * 1024 * 1024
+
+# Print progress at most this often, in seconds.
+PROGRESS_INTERVAL_S = 5
+
+# Check --bwlimit-file this often, in seconds.
+BWLIMIT_CHECK_S = 5
+
+# Make the copy resumable from every this many bytes.
+CHECKPOINT_BYTES = 1024 * 1024 * 1024
+
+# Copy methods, fastest first, and the errors which mean one can't be used
+# between two files (e.g. on an older kernel, or across filesystems which
+# copy_file_range doesn't support), so the next should be tried.
+COPY_METHODS = [m for m in ['copy_file_range', 'sendfile'] if hasattr(os, m)] + ['read']
+UNSUPPORTED_ERRNOS = { errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                       errno.ENOTSUP }
+
+
+def get_log_path():
+    return os.path.join(appdirs.user_data_dir('plotman'), 'archive.log')
+
+def get_bwlimit_path():
+    return os.path.join(appdirs.user_data_dir('plotman'), 'archive-bwlimit.json')
+
+def read_bwlimit(path, src):
+    '''The limit for plot src in the bwlimit file at path, or None.'''
+    try:
+        with open(path, 'r') as f:
+            limits = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    src_dir = os.path.normpath(os.path.dirname(src))
+    for (d, kbps) in limits.items():
+        if os.path.normpath(d) == src_dir:
+            return kbps
+    return None
+
+def copy_chunk(method, fin, fout, offset, count):
+    '''Copy up to count bytes at offset from fin to fout.  Return how many
+       were copied.'''
+    if method == 'copy_file_range':
+        return os.copy_file_range(fin, fout, count, offset, offset)
+    if method == 'sendfile':
+        os.lseek(fout, offset, os.SEEK_SET)
+        return os.sendfile(fout, fin, offset, count)
+    return os.pwrite(fout, os.pread(fin, count, offset), offset)
+
+def read_checkpoint(path, size):
+    '''How many bytes of a temporary file are good, according to its
+       checkpoint file at path, or 0.'''
+    try:
+        with open(path, 'r') as f:
+            offset = int(f.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+    return offset if 0 <= offset <= size else 0
+
+def fsync_dir(d):
+    fd = os.open(d, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class LocalTransfer:
+    '''The transfer of one plot to a local archive dir.  Its counters may be
+       read while run() goes.'''
+
+    def __init__(self, src, archdir, bwlimit=None, bwlimit_file=None, chunk_bytes=CHUNK_BYTES,
+                 clock=time.monotonic, checkpoint_bytes=CHECKPOINT_BYTES):
+        self.src = src
+        self.archdir = archdir
+        self.dst = os.path.join(archdir, os.path.basename(src))
+        self.bwlimit = bwlimit   # KB/s, as rsync's --bwlimit
+        self.bwlimit_file = bwlimit_file
+        self.bwlimit_checked = None
+        self.bwlimit_since = (0.0, 0)   # (elapsed(), bytes_done) when bwlimit was set
+        self.chunk_bytes = chunk_bytes
+        self.checkpoint_bytes = checkpoint_bytes
+        self.clock = clock
+        self.size = os.stat(src).st_size
+        self.bytes_done = 0
+        self.resumed_from = 0   # Bytes kept from an interrupted transfer
+        self.method = None
+        self.started = None
+        self.finished = None
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished if self.finished is not None else self.clock()) - self.started
+
+    def rate(self):
+        '''Average bytes per second so far.'''
+        elapsed = self.elapsed()
+        return (self.bytes_done - self.resumed_from) / elapsed if elapsed > 0 else 0.0
+
+    def run(self, remove_source=False, progress=None):
+        '''Transfer the plot, calling progress(self) after each chunk.'''
+        self.started = self.clock()
+        if remove_source and os.stat(self.src).st_dev == os.stat(self.archdir).st_dev:
+            self.method = 'rename'
+            os.rename(self.src, self.dst)
+            fsync_dir(self.archdir)
+            self.bytes_done = self.size
+        else:
+            self.copy(progress)
+            if remove_source:
+                os.remove(self.src)
+        self.finished = self.clock()
+
+    def copy(self, progress=None):
+        tmp = os.path.join(self.archdir, '.%s.tmp' % os.path.basename(self.src))
+        checkpoint = tmp + '.checkpoint'
+        methods = list(COPY_METHODS)
+        fin = os.open(self.src, os.O_RDONLY)
+        try:
+            fout = os.open(tmp, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                self.resumed_from = read_checkpoint(checkpoint, self.size)
+                self.bytes_done = self.resumed_from
+                self.bwlimit_since = (self.elapsed(), self.bytes_done)
+                next_checkpoint = self.bytes_done + self.checkpoint_bytes
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(fin, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                if hasattr(os, 'posix_fallocate') and self.size:
+                    # Keep the plot in one piece, and fail now if it won't fit.
+                    os.posix_fallocate(fout, 0, self.size)
+
+                while self.bytes_done < self.size:
+                    count = min(self.chunk_bytes, self.size - self.bytes_done)
+                    try:
+                        n = copy_chunk(methods[0], fin, fout, self.bytes_done, count)
+                    except OSError as e:
+                        if e.errno not in UNSUPPORTED_ERRNOS or len(methods) == 1:
+                            raise
+                        methods.pop(0)
+                        continue
+                    if n == 0:
+                        raise OSError(errno.EIO, '%s ended after %d of %d bytes'
+                                      % (self.src, self.bytes_done, self.size))
+                    self.method = methods[0]
+                    self.bytes_done += n
+                    if self.bytes_done >= next_checkpoint and self.bytes_done < self.size:
+                        os.fsync(fout)
+                        with open(checkpoint, 'w') as f:
+                            f.write(str(self.bytes_done))
+                        next_checkpoint = self.bytes_done + self.checkpoint_bytes
+                    self.limit_rate()
+                    if progress is not None:
+                        progress(self)
+
+                os.fsync(fout)
+                if hasattr(os, 'posix_fadvise'):
+                    # Leave the page cache to the plot jobs.
+                    os.posix_fadvise(fin, 0, 0, os.POSIX_FADV_DONTNEED)
+                    os.posix_fadvise(fout, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fout)
+        except (KeyboardInterrupt, SystemExit):
+            # Interrupted: keep what has been checkpointed for the next try.
+            raise
+        except BaseException:
+            for path in [tmp, checkpoint]:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            raise
+        finally:
+            os.close(fin)
+        os.rename(tmp, self.dst)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(checkpoint)
+        fsync_dir(self.archdir)
+
+    def limit_rate(self):
+        elapsed = self.elapsed()
+        if self.bwlimit_file is not None and (
+                self.bwlimit_checked is None or elapsed - self.bwlimit_checked >= BWLIMIT_CHECK_S):
+            self.bwlimit_checked = elapsed
+            bwlimit = read_bwlimit(self.bwlimit_file, self.src)
+            if bwlimit is not None and bwlimit != self.bwlimit:
+                self.bwlimit = bwlimit
+                self.bwlimit_since = (elapsed, self.bytes_done)
+        if self.bwlimit:
+            (since, bytes_since) = self.bwlimit_since
+            ahead = (self.bytes_done - bytes_since) / (self.bwlimit * 1024) - (elapsed - since)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def format_rate(bytes_per_s):
+    return '%.1f MB/s' % (bytes_per_s / 1e6)
+
+def progress_line(bytes_done, size, bytes_per_s):
+    '''A progress line in the format of rsync -P, so both can be read alike
+       (see transfer_progress).'''
+    eta_s = int((size - bytes_done) / bytes_per_s) if bytes_per_s > 0 else 0
+    return '%15s %3d%% %7.2fMB/s %4d:%02d:%02d' % (
+        '{:,}'.format(bytes_done), 100 * bytes_done // max(size, 1), bytes_per_s / 2**20,
+        eta_s // 3600, eta_s // 60 % 60, eta_s % 60)
+
+def summary(t):
+    '''One line on a finished transfer, for the log.'''
+    return '%s %s -> %s: %.1f GiB in %ds, %s (%s)' % (
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'), t.src, t.archdir,
+        t.size / 2**30, t.elapsed(), format_rate(t.rate()), t.method)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m plotman.transfer',
+                                     description='Archive plots to a local archive dir.')
+    parser.add_argument('--remove-source-files', action='store_true',
+                        help='remove each plot once archived')
+    parser.add_argument('--bwlimit', type=int, default=None,
+                        help='limit the copy to this many KB/s')
+    parser.add_argument('--bwlimit-file', default=None,
+                        help='follow the limit for each plot\'s dir in this file')
+    parser.add_argument('--log', default=None,
+                        help='append a line on each finished transfer to this file')
+    parser.add_argument('plots', nargs='+', metavar='plot')
+    parser.add_argument('archdir')
+    args = parser.parse_args(argv)
+
+    # Stopping (e.g. to change the bandwidth limit) leaves the copy resumable.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    for plot in args.plots:
+        t = LocalTransfer(plot, args.archdir, bwlimit=args.bwlimit,
+                          bwlimit_file=args.bwlimit_file)
+        last_report = [t.clock(), 0]
+
+        def report(t):
+            now = t.clock()
+            if now - last_report[0] >= PROGRESS_INTERVAL_S or t.bytes_done == t.size:
+                moved = t.bytes_done - max(last_report[1], t.resumed_from)
+                rate = moved / max(now - last_report[0], 1e-6)
+                last_report[:] = [now, t.bytes_done]
+                print(progress_line(t.bytes_done, t.size, rate), flush=True)
+
+        t.run(remove_source=args.remove_source_files, progress=report)
+        line = summary(t)
+        print(line, flush=True)
+        if args.log is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(args.log)), exist_ok=True)
+            with open(args.log, 'a') as f:
+                f.write(line + '\n')
+
+if __name__ == '__main__':
+    sys.exit(main())
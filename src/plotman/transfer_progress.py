@@ -0,0 +1,239 @@
+'''Progress and throughput of archive transfers.
+
+archive.start_transfer() sends each transfer's output (rsync -P progress,
+or the same lines from plotman.transfer) to a progress file named after its
+first plot, in plotman's data dir, so that any plotman process can see how
+far it has got.  A transfer sends its plots in turn, removing each once
+sent, so the last progress line is of the first of them still in its dst
+dir.  From it, the sizes of the plots and the transfer's start time come
+its TransferStats for the whole batch: bytes moved, current and average
+throughput, and ETA.
+
+TransferMonitor keeps these up to date in a background thread for
+`plotman interactive`, and appends a line on each transfer it saw finish to
+a history file (JSON lines), for capacity planning.  A transfer restarted
+(e.g. with a new bandwidth limit) is timed from its first start.'''
+
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+from typing import NamedTuple, Optional, Tuple
+
+import appdirs
+import psutil
+
+# rsync's units, which are binary.
+UNITS = { 'B': 1, 'kB': 2**10, 'MB': 2**20, 'GB': 2**30 }
+
+PROGRESS_RE = re.compile(r'([\d,]+)\s+(\d+)%\s+([\d.]+)(B|kB|MB|GB)/s\s+(\d+):(\d+):(\d+)')
+
+# Read this much of the end of a progress file for its last line.
+TAIL_BYTES = 4096
+
+
+def get_progress_dir():
+    return os.path.join(appdirs.user_data_dir('plotman'), 'transfers')
+
+def get_history_path():
+    return os.path.join(appdirs.user_data_dir('plotman'), 'archive-history.jsonl')
+
+def progress_path(plot, progress_dir=None):
+    '''The progress file of the transfer of plot.'''
+    if progress_dir is None:
+        progress_dir = get_progress_dir()
+    return os.path.join(progress_dir, os.path.basename(plot) + '.progress')
+
+
+class Progress(NamedTuple):
+    '''A progress line of rsync -P.'''
+    bytes: int
+    percent: int
+    bytes_s: float    # Over the last few seconds
+    eta_s: int
+
+
+def parse_progress(text):
+    '''The last Progress in text, or None.  rsync separates updates of the
+       same line with carriage returns.'''
+    for line in reversed(re.split(r'[\r\n]', text)):
+        m = PROGRESS_RE.search(line)
+        if m:
+            (moved, percent, rate, unit, h, mins, secs) = m.groups()
+            return Progress(int(moved.replace(',', '')), int(percent),
+                            float(rate) * UNITS[unit], int(h) * 3600 + int(mins) * 60 + int(secs))
+    return None
+
+def read_progress(path):
+    '''The last Progress in the file at path, or None.'''
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - TAIL_BYTES))
+            return parse_progress(f.read().decode('utf-8', 'replace'))
+    except FileNotFoundError:
+        return None
+
+
+class TransferStats(NamedTuple):
+    pid: int
+    plot: str                    # Being sent now, or the last if all were
+    archdir: str
+    bytes: int                   # Of all the plots
+    size: Optional[int]          # Of all the plots, None if none was seen
+    bytes_s: float               # Current throughput
+    average_bytes_s: Optional[float]
+    eta_s: Optional[int]
+    elapsed_s: Optional[float]
+    plots: Tuple[str, ...] = ()  # All those of the transfer
+
+
+def transfer_stats(t, progress_dir=None, now=None, sizes=None, batch=None):
+    '''The TransferStats of an archive.ArchiveTransfer.  sizes maps plots
+       to their sizes, and is updated with those found, so that those sent
+       since are counted; a plot gone before it was seen is taken to be the
+       size of the others.  batch is the plots of the transfer as first
+       started, if it was restarted with only those not sent yet.'''
+    if now is None:
+        now = time.time()
+    if sizes is None:
+        sizes = {}
+    plots = tuple(t.plots if batch is None else batch)
+    for plot in plots:
+        with contextlib.suppress(FileNotFoundError):
+            sizes[plot] = os.stat(plot).st_size
+    # Plots are sent in turn, and removed once sent.
+    current = next((plot for plot in plots if os.path.exists(plot)), None)
+    sent = plots if current is None else plots[:plots.index(current)]
+
+    known = [sizes[plot] for plot in plots if plot in sizes]
+    size = None
+    if known:
+        guess = sum(known) // len(known)
+        size = sum(sizes.get(plot, guess) for plot in plots)
+        sent_bytes = sum(sizes.get(plot, guess) for plot in sent)
+    progress = read_progress(progress_path(t.plots[0], progress_dir)) if t.plots else None
+    elapsed_s = None
+    with contextlib.suppress(psutil.Error):
+        elapsed_s = max(0.0, now - psutil.Process(t.pid).create_time())
+
+    bytes_s = progress.bytes_s if progress is not None else 0.0
+    if size is None:
+        moved = progress.bytes if progress is not None else 0
+    elif current is None:
+        moved = size
+    else:
+        moved = sent_bytes + (progress.bytes if progress is not None else 0)
+        # The last line may be of the plot just sent, until the next starts.
+        moved = min(moved, sent_bytes + sizes[current])
+    average_bytes_s = moved / elapsed_s if elapsed_s else None
+    eta_s = None
+    if size is not None and bytes_s > 0:
+        eta_s = int(max(0, size - moved) / bytes_s)
+    plot = current if current is not None else (plots[-1] if plots else '')
+    return TransferStats(t.pid, plot, t.archdir, moved, size, bytes_s,
+                         average_bytes_s, eta_s, elapsed_s, plots)
+
+def history_record(stats, finished):
+    '''The history file entry for a transfer last seen with stats.'''
+    # Plots are removed from their dst dir once archived.
+    complete = not any(os.path.exists(plot) for plot in stats.plots)
+    moved = stats.size if complete and stats.size is not None else stats.bytes
+    seconds = stats.elapsed_s
+    return {
+        'finished': finished,
+        'plots': list(stats.plots),
+        'archdir': stats.archdir,
+        'bytes': moved,
+        'seconds': None if seconds is None else round(seconds, 1),
+        'average_mb_s': None if not seconds else round(moved / seconds / 1e6, 1),
+        'complete': complete,
+    }
+
+
+class TransferMonitor:
+    '''Polls the progress of the transfers given to watch() in a background
+       thread.'''
+
+    def __init__(self, interval_s=2, progress_dir=None, history_path=None, clock=time.time):
+        self.interval_s = interval_s
+        self.progress_dir = progress_dir
+        self.history_path = get_history_path() if history_path is None else history_path
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.watched = []
+        self.latest = {}      # Map from pid to TransferStats
+        self.started = {}     # Map from plot to clock() when first seen sending it
+        self.batches = {}     # Map from plot to the plots of the transfer first sending it
+        self.sizes = {}       # Map from plot to its size, while in a transfer
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.poll()
+            self.stopped.wait(self.interval_s)
+
+    def watch(self, transfers):
+        '''Follow these transfers (all those running) from now on.'''
+        with self.lock:
+            self.watched = list(transfers)
+
+    def stats(self):
+        '''The latest TransferStats of the transfers watched, by pid.'''
+        with self.lock:
+            return [self.latest[t.pid] for t in self.watched if t.pid in self.latest]
+
+    def poll(self):
+        with self.lock:
+            watched = list(self.watched)
+        now = self.clock()
+        latest = {}
+        for t in watched:
+            if not t.plots:
+                continue
+            # A transfer restarted (e.g. with a new bandwidth limit) goes on
+            # with the plots not sent yet, and is timed from its first start.
+            batch = self.batches.get(t.plots[0], ())
+            if not set(t.plots) <= set(batch):
+                batch = tuple(t.plots)
+            s = transfer_stats(t, self.progress_dir, now, self.sizes, batch)
+            started = min(self.started.get(plot, now) for plot in batch)
+            if s.elapsed_s is not None:
+                started = min(started, now - s.elapsed_s)
+                elapsed_s = now - started
+                s = s._replace(elapsed_s=elapsed_s,
+                               average_bytes_s=s.bytes / elapsed_s if elapsed_s else None)
+            for plot in batch:
+                self.batches[plot] = batch
+                self.started[plot] = started
+            latest[t.pid] = s
+        plots = { plot for s in latest.values() for plot in s.plots }
+        with self.lock:
+            finished = [s for (pid, s) in self.latest.items()
+                        if pid not in latest and not plots.intersection(s.plots)]
+            self.latest = latest
+        for s in finished:
+            for plot in s.plots:
+                self.started.pop(plot, None)
+                self.batches.pop(plot, None)
+                self.sizes.pop(plot, None)
+            self.record(s, now)
+
+    def record(self, stats, finished):
+        os.makedirs(os.path.dirname(self.history_path), exist_ok=True)
+        with open(self.history_path, 'a') as f:
+            f.write(json.dumps(history_record(stats, finished)) + '\n')
+        # A transfer restarted has the progress file of its first plot left.
+        for plot in stats.plots:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(progress_path(plot, self.progress_dir))